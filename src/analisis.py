@@ -1,5 +1,13 @@
+import weakref
+
+import numpy as np
 import pabutools
 
+from utils import ArrayProfile, dense_profile
+
+# {id(profile): (weak reference to profile, DenseProfile)}, filled by as_dense
+__dense_profiles = {}
+
 def project_ballot_support(ballot, project, use_cost = False):
     """
         get support given by ballot to project
@@ -51,7 +59,67 @@ def single_utility(ballot, instance, use_cost = True):
         Returns:
             float: support
     """
-    return sum([project_ballot_support(ballot, project, use_cost) for project in instance])
+    projects = instance if isinstance(instance, (set, frozenset)) else set(instance)
+    match ballot:
+        case pabutools.election.ballot.CumulativeBallot() | pabutools.election.ballot.CardinalBallot():
+            if use_cost:
+                return sum([votes * project.cost for project, votes in ballot.items() if project in projects])
+            return sum([votes for project, votes in ballot.items() if project in projects])
+        case pabutools.election.ballot.ApprovalBallot():
+            if use_cost:
+                return sum([project.cost for project in ballot if project in projects])
+            return sum([1 for project in ballot if project in projects])
+        case _:
+            raise TypeError('type ' + type(ballot).__name__ + ' is incorrect')
+
+def as_dense(instance, profile):
+    """
+        get DenseProfile with raw votes of profile, conversion of every profile is done once
+        and kept for as long as the profile exists, so the profile must not be modified afterwards.
+        Array-backed profiles (DenseProfile, SparseProfile) are returned as they are
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile | ArrayProfile): profile of election
+            
+        Returns:
+            ArrayProfile
+    """
+    if isinstance(profile, ArrayProfile):
+        return profile
+    key = id(profile)
+    entry = __dense_profiles.get(key)
+    if entry is not None and entry[0]() is profile:
+        return entry[1]
+    dense = dense_profile(instance, profile)
+    __dense_profiles[key] = (weakref.ref(profile, lambda _, key=key: __dense_profiles.pop(key, None)), dense)
+    return dense
+
+def clear_dense_cache():
+    """
+        Forget DenseProfiles made by as_dense, so the next metric of every profile converts it again
+        
+        Returns:
+            None
+    """
+    __dense_profiles.clear()
+
+def dense_utilities(profile, alloc, use_cost = True):
+    """
+        get support given by every voter of dense profile to set of projects
+        
+        Args:
+            profile (ArrayProfile): profile with raw votes
+            alloc (iterable(Project)): set of projects being voted on
+            use_cost (bool): Should votes be multiplied by project cost
+            
+        Returns:
+            numpy.ndarray: support per voter
+    """
+    weights = profile.mask(alloc)
+    if use_cost:
+        weights *= profile.costs
+    return profile.product(weights)
 
 def avg_utility(instances, profiles, alloc, use_cost = True):
     """
@@ -59,7 +127,7 @@ def avg_utility(instances, profiles, alloc, use_cost = True):
         
         Args:
             instances ([Instance]): list of instances of election
-            profiles ([Profile]): list of profile of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
             alloc (set(Project)): set of projects chosen from the elections
             use_cost (bool): Should the cost or score utility be used
             
@@ -69,42 +137,101 @@ def avg_utility(instances, profiles, alloc, use_cost = True):
     sum_u = 0
     max_u = 0
     for ii in range(len(instances)):
-        instance = instances[ii]
-        profile = profiles[ii]
-        trimmed_alloc = [p for p in instance if p in alloc]
-        single_u = 0
-        single_max_u = 0
-        for ballot in profile:
-            single_u += single_utility(ballot, trimmed_alloc, use_cost)
-            single_max_u += single_utility(ballot, instance, use_cost)
-        sum_u += single_u
-        max_u += single_max_u
+        profile = as_dense(instances[ii], profiles[ii])
+        sum_u += float(profile.total(dense_utilities(profile, alloc, use_cost)))
+        max_u += profile.max_utility(use_cost)
     return sum_u / max_u
 
+def utility_matrix(profile, allocs, use_cost = True):
+    """
+        get support given by every voter of dense profile to each of many sets of projects at once
+        
+        Args:
+            profile (ArrayProfile): profile with raw votes
+            allocs ([iterable(Project)]): sets of projects being voted on
+            use_cost (bool): Should votes be multiplied by project cost
+            
+        Returns:
+            numpy.ndarray: voters x allocations matrix of support
+    """
+    weights = np.zeros((len(profile.projects), len(allocs)), dtype=np.float64)
+    for idx, alloc in enumerate(allocs):
+        weights[:, idx] = profile.mask(alloc)
+    if use_cost:
+        weights *= profile.costs[:, None]
+    return profile.product(weights)
+
+def __preference_counts(profile, utilities):
+    """
+        count voters preferring one allocation over other for every pair of allocations
+        
+        Args:
+            profile (ArrayProfile): profile the utilities come from, rows count as many voters as their weights
+            utilities (numpy.ndarray): rows x allocations matrix of support
+            
+        Returns:
+            numpy.ndarray: allocations x allocations matrix, entry i, j is number of voters with higher utility from i than from j
+    """
+    allocs_count = utilities.shape[1]
+    counts = np.zeros((allocs_count, allocs_count), dtype=np.int64)
+    for idx in range(allocs_count):
+        counts[idx] = profile.total(utilities[:, idx, None] > utilities)
+    return counts
+
+def dominance_margin_matrix(instance, profile, allocs, use_cost = True):
+    """
+        Calculate dominance margins of every pair of many sets of projects in one pass over the profile
+        
+        Args:
+            instance (Instance): instance of election used
+            profile (Profile | ArrayProfile): profile of election used
+            allocs ([set(Project)]): sets of projects being compared
+            use_cost (bool): Should the cost or score utility be used internally
+            
+        Returns:
+            numpy.ndarray: allocations x allocations matrix, entry i, j is dominance margin of allocs[i] over allocs[j]
+    """
+    profile = as_dense(instance, profile)
+    return __preference_counts(profile, utility_matrix(profile, allocs, use_cost)) / profile.num_ballots()
+
 def dominance_margin(instance, profile, alloc1, alloc2, use_cost = True):
     """
         Calculate dominance margin of set of projects over other set of projects
         
         Args:
-            instances (Instance): instances of election used
-            profiles ([Profile]): profile of election used
+            instance (Instance): instance of election used
+            profile (Profile | ArrayProfile): profile of election used
             alloc1 (set(Project)): set of projects dominating alloc2
             alloc2 (set(Project)): set of projects being dominated
             use_cost (bool): Should the cost or score utility be used internally
             
         Returns:
-            float: dominance margin
-    """
-    margin1 = 0
-    margin2 = 0
-    for ballot in profile:
-        utility1 = single_utility(ballot, alloc1, use_cost)
-        utility2 = single_utility(ballot, alloc2, use_cost)
-        if utility1 > utility2:
-            margin1 += 1
-        if utility2 > utility1:
-            margin2 += 1
-    return (margin1 / len(profile), margin2 / len(profile))
+            tuple: (dominance margin of alloc1 over alloc2, dominance margin of alloc2 over alloc1)
+    """
+    margins = dominance_margin_matrix(instance, profile, [alloc1, alloc2], use_cost)
+    return (float(margins[0, 1]), float(margins[1, 0]))
+
+def improvement_margin_matrix(instances, profiles, allocs, use_cost = True):
+    """
+        Calculate improvement margins of every pair of many sets of projects,
+        every profile is multiplied with all allocations at once
+        
+        Args:
+            instances ([Instance]): list of instances of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
+            allocs ([set(Project)]): sets of projects being compared
+            use_cost (bool): Should the cost or score utility be used
+            
+        Returns:
+            numpy.ndarray: allocations x allocations matrix, entry i, j is improvement margin of allocs[i] over allocs[j]
+    """
+    counts = np.zeros((len(allocs), len(allocs)), dtype=np.int64)
+    voters_count = 0
+    for ii in range(len(instances)):
+        profile = as_dense(instances[ii], profiles[ii])
+        counts += __preference_counts(profile, utility_matrix(profile, allocs, use_cost))
+        voters_count += profile.num_ballots()
+    return (counts - counts.T) / voters_count
 
 def improvement_margins(instances, profiles, alloc1, alloc2, use_cost = True):
     """
@@ -112,7 +239,7 @@ def improvement_margins(instances, profiles, alloc1, alloc2, use_cost = True):
         
         Args:
             instances ([Instance]): list of instances of election
-            profiles ([Profile]): list of profile of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
             alloc1 (set(Project)): set of projects comparing to alloc2
             alloc2 (set(Project)): set of projects being compared to
             use_cost (bool): Should the cost or scre utility be used
@@ -120,24 +247,35 @@ def improvement_margins(instances, profiles, alloc1, alloc2, use_cost = True):
         Returns:
             float: improvement margin
     """
-    sum1 = 0
-    sum2 = 0
-    voters_count = 0
+    return float(improvement_margin_matrix(instances, profiles, [alloc1, alloc2], use_cost)[0, 1])
+
+def exclusion_ratios(instances, profiles, allocs):
+    """
+        Calculate combined exclusion ratio of list of elections for many sets of projects at once,
+        voters covered by a set are OR of supporter bitsets of its projects
+        
+        Args:
+            instances ([Instance]): list of instances of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
+            allocs ([set(Project)]): sets of projects chosen from the elections
+            
+        Returns:
+            numpy.ndarray: exclusion ratio of every set
+    """
+    exclusion = np.zeros(len(allocs), dtype=np.int64)
+    voter_count = 0
     for ii in range(len(instances)):
-        profile = profiles[ii]
-        voters_count += len(profile)
-        margin1 = 0
-        margin2 = 0
-        for ballot in profile:
-            utility1 = single_utility(ballot, alloc1, use_cost)
-            utility2 = single_utility(ballot, alloc2, use_cost)
-            if utility1 > utility2:
-                margin1 += 1
-            if utility2 > utility1:
-                margin2 += 1
-        sum1 += margin1
-        sum2 += margin2
-    return (sum1 - sum2) / voters_count
+        profile = as_dense(instances[ii], profiles[ii])
+        bits = profile.support_bits()
+        for idx, alloc in enumerate(allocs):
+            covered = np.bitwise_or.reduce(bits[profile.columns(alloc)], axis=0)
+            if profile.weights is None:
+                exclusion[idx] += len(profile) - int(np.bitwise_count(covered).sum())
+            else:
+                covered_rows = np.unpackbits(covered, count=len(profile)).astype(bool)
+                exclusion[idx] += int(profile.weights[~covered_rows].sum())
+        voter_count += profile.num_ballots()
+    return exclusion / voter_count
 
 def exclusion_ratio(instances, profiles, alloc):
     """
@@ -145,38 +283,103 @@ def exclusion_ratio(instances, profiles, alloc):
         
         Args:
             instances ([Instance]): list of instances of election
-            profiles ([Profile]): list of profile of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
             alloc (set(Project)): set of projects chosen from the elections
-            use_cost (bool): Should the cost or scre utility be used
             
         Returns:
             float: exclusion ratio
     """
-    exclusion = 0
-    voter_count = 0
-    for profile in profiles:
-        for ballot in profile:
-            supp = 1
-            match ballot:
-                case pabutools.election.ballot.CumulativeBallot():
-                    for project in alloc:
-                        if ballot.get(project, 0) > 0:
-                            supp = 0
-                            break
-                case pabutools.election.ballot.CardinalBallot():
-                    for project in alloc:
-                        if ballot.get(project, 0) > 0:
-                            supp = 0
-                            break
-                case pabutools.election.ballot.ApprovalBallot():
-                    for project in alloc:
-                        if project in ballot:                        
-                            supp = 0
-                            break
-            exclusion += supp
-        voter_count += len(profile)
+    return float(exclusion_ratios(instances, profiles, [alloc])[0])
+
+def power_shares(profile, alloc):
+    """
+        get share of cost of chosen projects paid by every voter, cost of every project
+        is split between voters proportionally to their raw support of it
         
-    return exclusion / voter_count
+        Args:
+            profile (ArrayProfile): profile with raw votes
+            alloc (iterable(Project)): set of chosen projects
+            
+        Returns:
+            numpy.ndarray: share of every voter of row
+    """
+    weights = profile.mask(alloc)
+    pr_sums = profile.support()
+    supported = (weights > 0) & (pr_sums > 0)
+    weights[supported] = profile.costs[supported] / pr_sums[supported]
+    weights[~supported] = 0.0
+    return profile.product(weights)
+
+class PowerInequality:
+    """
+        Streaming power inequality, shares of every election are reduced to their count, mean
+        and sum of squared deviations as soon as they are added, so any number of elections
+        can be combined without keeping the shares in memory
+        
+        Attributes:
+            count (int): number of voters added
+            mean (float): mean share
+            m2 (float): sum of squared deviations of shares from mean
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, instance, profile, alloc):
+        """
+            Add shares of voters of single election
+            
+            Args:
+                instance (Instance): instance of election
+                profile (Profile | ArrayProfile): profile of election
+                alloc (set(Project)): set of projects chosen from the elections
+                
+            Returns:
+                None
+        """
+        profile = as_dense(instance, profile)
+        self.add_shares(power_shares(profile, alloc), profile.weights)
+
+    def add_shares(self, shares, weights = None):
+        """
+            Add shares of voters, moments are merged with Chan's parallel formula
+            
+            Args:
+                shares (numpy.ndarray): share per voter
+                weights (numpy.ndarray): number of voters with every share, None if every share is one voter
+                
+            Returns:
+                None
+        """
+        if weights is None:
+            count = len(shares)
+            if count == 0:
+                return
+            mean = float(shares.mean())
+            m2 = float(((shares - mean) ** 2).sum())
+        else:
+            count = int(weights.sum())
+            if count == 0:
+                return
+            mean = float(weights @ shares) / count
+            m2 = float(weights @ ((shares - mean) ** 2))
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def value(self):
+        """
+            Get power inequality of all added shares
+                
+            Returns:
+                float: power inequality
+        """
+        if self.count == 0 or self.mean == 0.0:
+            raise ZeroDivisionError('power inequality of no shares')
+        return self.m2 / self.count / (self.mean * self.mean)
 
 def power_inequality(instances, profiles, alloc):
     """
@@ -184,83 +387,137 @@ def power_inequality(instances, profiles, alloc):
         
         Args:
             instances ([Instance]): list of instances of election
-            profiles ([Profile]): list of profile of election
+            profiles ([Profile | ArrayProfile]): list of profile of election
             alloc (set(Project)): set of projects chosen from the elections
-            use_cost (bool): Should the cost or scre utility be used
             
         Returns:
             float: power inequality
     """
-    shares = []
-    for idx, profile in enumerate(profiles):
-        arr = []
-        for project in alloc:
-            pr_sum = 0.0
-            for ballot in profile:
-                pr_sum += project_ballot_support(project=project, ballot=ballot, use_cost=False)
-            if pr_sum > 0:    
-                arr.append((project, pr_sum))
-        for ballot in profile:
-            share = 0.0
-            for (project, pr_sum) in arr:
-                if pr_sum > 0:
-                    share += \
-                        float(project_ballot_support(project=project, ballot=ballot, use_cost=True)) \
-                        / pr_sum
-            shares.append(share)
-
-    m = sum(shares) / len(shares)
-    ineq = 0.0
-    for share in shares:
-        ineq += (share/m - 1.0)**2
-    return ineq / len(shares)
+    inequality = PowerInequality()
+    for ii in range(len(instances)):
+        inequality.add(instances[ii], profiles[ii], alloc)
+    return inequality.value()
 
 class Election:
     def __init__(self, profile, budget):
         self.profile = profile
         self.budget = budget
 
+class EJRIndex:
+    """
+        Index of elections for checking EJR+ of many outcomes, supporters of every project
+        are kept in flat arrays so that checking an outcome is a few sorts and comparisons
+        
+        Attributes:
+            projects ([Project]): project of every (election, project) slot, in order of elections and their profiles
+            costs (numpy.ndarray): cost of project of every slot
+            entry_slots (numpy.ndarray): slot of every (slot, supporter) entry
+            entry_voters (numpy.ndarray): index of supporter of every entry
+            entry_utilities (numpy.ndarray): utility of supporter from project of every entry
+            entry_weights (numpy.ndarray): number of voters with ballot of supporter of every entry
+            voters_count (int): number of voters supporting any project
+            budget_limit (float): combined budget of elections
+    """
+    def __init__(self, elections):
+        voters = {}
+        self.projects = []
+        entry_slots = []
+        entry_voters = []
+        entry_utilities = []
+        for e in elections:
+            for p in e.profile.keys():
+                for v, u in e.profile[p].items():
+                    entry_slots.append(len(self.projects))
+                    entry_voters.append(voters.setdefault(v, len(voters)))
+                    entry_utilities.append(u)
+                self.projects.append(p)
+        self.costs = np.array([float(p.cost) for p in self.projects], dtype=np.float64)
+        self.entry_slots = np.array(entry_slots, dtype=np.intp)
+        self.entry_voters = np.array(entry_voters, dtype=np.intp)
+        self.entry_utilities = np.array(entry_utilities, dtype=np.float64)
+        self.entry_weights = np.ones(len(entry_slots), dtype=np.int64)
+        self.voters_count = len(voters)
+        self.budget_limit = sum([e.budget for e in elections])
+
+    def violations(self, outcome, up_to_one = True):
+        """
+            Find projects violating EJR+ for outcome. Supporters of every project that was not elected
+            are sorted by satisfaction, k-th of them fails if their satisfaction is lower than k/n of the budget
+            (minus cost of the project if up_to_one), and the project is a violation if any of them fails
+            
+            Args:
+                outcome (set(Project)): set of projects chosen from the elections
+                up_to_one (bool): Should the EJR be calculated up to one
+                
+            Returns:
+                [str]: names of projects violating EJR+
+        """
+        in_outcome = np.array([p in outcome for p in self.projects], dtype=bool)
+        elected_entries = in_outcome[self.entry_slots]
+        satisfaction = np.bincount(self.entry_voters, weights=np.where(elected_entries, self.entry_utilities, 0.0),
+                                   minlength=self.voters_count)
+        slots = self.entry_slots[~elected_entries]
+        sats = satisfaction[self.entry_voters[~elected_entries]]
+        order = np.lexsort((sats, slots))
+        slots = slots[order]
+        sats = sats[order]
+        # voters of every entry are counted together, identical voters have the same satisfaction
+        # and the last of them has the highest threshold
+        voters = np.cumsum(self.entry_weights[~elected_entries][order])
+        coalition_size = voters - np.concatenate(([0], voters))[np.searchsorted(slots, slots, side='left')]
+        threshold = (coalition_size / self.voters_count) * self.budget_limit
+        if up_to_one:
+            threshold = threshold - self.costs[slots]
+        failed = np.zeros(len(self.projects), dtype=bool)
+        failed[slots[sats < threshold]] = True
+        return [self.projects[slot].name for slot in np.flatnonzero(failed)]
+
+def dense_ejr_index(instance, profile):
+    """
+        Build EJRIndex of single election straight from its profile, every positive vote of cumulative
+        or approval ballot gives utility of votes times project cost, other ballot types give no utility
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile | ArrayProfile): profile of election
+            
+        Returns:
+            EJRIndex
+    """
+    profile = as_dense(instance, profile)
+    index = EJRIndex([])
+    index.projects = list(profile.projects)
+    index.costs = profile.costs
+    index.budget_limit = instance.budget_limit
+    if profile.ballot_type is None or not issubclass(profile.ballot_type, (pabutools.election.ballot.CumulativeBallot,
+                                                                           pabutools.election.ballot.ApprovalBallot)):
+        return index
+    (rows, columns, votes) = profile.entries()
+    positive = votes > 0
+    (rows, columns, votes) = (rows[positive], columns[positive], votes[positive])
+    (voters, index.entry_voters) = np.unique(rows, return_inverse=True)
+    index.entry_slots = columns
+    index.entry_utilities = votes * profile.costs[columns]
+    if profile.weights is None:
+        index.entry_weights = np.ones(len(rows), dtype=np.int64)
+        index.voters_count = len(voters)
+    else:
+        index.entry_weights = profile.weights[rows].astype(np.int64)
+        index.voters_count = int(profile.weights[voters].sum())
+    return index
+
 def ejr_plus_violations(elections, outcome, up_to_one = True):
     """
-        Calculate combined EJR of list of elections
+        Calculate combined EJR of list of elections, use EJRIndex directly to check many outcomes
         
         Args:
-            elections ([Election]): list of elections
+            elections ([Election] | EJRIndex): list of elections or index made from them
             outcome (set(Project)): set of projects chosen from the elections
             up_to_one (bool): Should the EJR be calculated up to one
             
         Returns:
-            [Project]: list of EJR violations
-    """
-    utility = {}
-    budget_limit = sum([e.budget for e in elections])
-    for e in elections:
-        for p in e.profile.keys():
-            for v in e.profile[p].keys():
-                utility[v] = 0
-
-    for p in outcome:
-        for e in elections:
-            if p in e.profile.keys():
-                for v in e.profile[p].keys():
-                    utility[v] += e.profile[p][v]
-
-    sorted_voters = sorted(utility.items(), key=lambda item : item[1])
-
-    failures = []
-    for e in elections:
-        for not_elected in e.profile.keys():
-            if not_elected in outcome:
-                continue
-            coalition_size = 0
-            for vot, sat in sorted_voters:
-                if vot in e.profile[not_elected].keys():
-                    coalition_size += 1
-                    if up_to_one:
-                        ejr_satisfied = sat >= (coalition_size / len(sorted_voters)) * budget_limit - not_elected.cost
-                    else:
-                        ejr_satisfied = sat >= (coalition_size / len(sorted_voters)) * budget_limit
-                    if not ejr_satisfied:
-                        failures.append(not_elected.name)
-                        break
-    return failures
\ No newline at end of file
+            [str]: names of projects violating EJR+
+    """
+    if not isinstance(elections, EJRIndex):
+        elections = EJRIndex(elections)
+    return elections.violations(outcome, up_to_one)
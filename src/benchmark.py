@@ -0,0 +1,295 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import pabutools
+
+import telemetry
+from analisis import (
+    avg_utility,
+    power_inequality,
+    improvement_margins,
+    dominance_margin,
+    exclusion_ratio,
+    ejr_plus_violations,
+    clear_dense_cache,
+    Election
+)
+from limits import current_rss
+from utils import (
+    rules,
+    greedy_all,
+    read_path,
+    read_dense,
+    stream_dense,
+    balance_profile,
+    dense_profile,
+    sparse_profile,
+    ROOT_PATH,
+    INSTANCES_PATH,
+    PABUTOOLS_VERSION,
+    SAMPLE_PRESETS
+)
+
+BASELINE_PATH = str(ROOT_PATH.joinpath("benchmark_baseline.json"))
+# Relative slowdown of median over baseline reported as regression
+REGRESSION_THRESHOLD = 0.2
+STAGES = ['parse', 'balance', 'rules', 'metrics']
+
+def __ejr_elections(instance, profile):
+    """
+        Build Election used by ejr_plus_violations the same way visualization.py does
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile): profile of election
+        
+        Returns:
+            [Election]
+    """
+    election = dict()
+    for h in range(len(profile)):
+        match profile[h]:
+            case pabutools.election.ballot.CumulativeBallot():
+                for p, u in profile[h].items():
+                    if u > 0:
+                        election.setdefault(p, dict())[h] = u * p.cost
+            case pabutools.election.ballot.ApprovalBallot():
+                for p in profile[h]:
+                    election.setdefault(p, dict())[h] = p.cost
+    return [Election(election, instance.budget_limit)]
+
+# {metric name: function(instance, profile, alloc1, alloc2)}, profile is raw (not balanced)
+metrics = {
+    'utility cost score': lambda instance, profile, alloc1, alloc2: avg_utility([instance], [profile], alloc1, use_cost=True),
+    'utility score': lambda instance, profile, alloc1, alloc2: avg_utility([instance], [profile], alloc1, use_cost=False),
+    'power inequality': lambda instance, profile, alloc1, alloc2: power_inequality([instance], [profile], alloc1),
+    'improvement margin': lambda instance, profile, alloc1, alloc2: improvement_margins([instance], [profile], alloc1, alloc2),
+    'dominance margin': lambda instance, profile, alloc1, alloc2: dominance_margin(instance, profile, alloc1, alloc2),
+    'exclusion ratio': lambda instance, profile, alloc1, alloc2: exclusion_ratio([instance], [profile], alloc1),
+    'ejr': lambda instance, profile, alloc1, alloc2: ejr_plus_violations(__ejr_elections(instance, profile), alloc1),
+}
+# metrics that also accept DenseProfile and SparseProfile
+dense_metrics = ['utility cost score', 'utility score', 'power inequality', 'improvement margin',
+                 'dominance margin', 'exclusion ratio']
+
+def measure(run, repeat, budget, setup=None):
+    """
+        Time function several times, it is run at least once and at most repeat times,
+        repeating stops early once budget seconds were spent
+        
+        Args:
+            run (callable): measured function
+            repeat (int): maximal number of runs
+            budget (float): seconds after which no more runs are started
+            setup (callable): function called before every run, it is not timed
+        
+        Returns:
+            dict: {'repeats', 'median', 'p95' (seconds), 'rss' (bytes of peak RSS growth during first run)}
+    """
+    if repeat < 1:
+        raise ValueError(f'repeat must be at least 1, got {repeat}')
+    times = []
+    spent = 0.0
+    rss_before = current_rss()
+    telemetry.reset_peak_rss()
+    while len(times) < repeat and (not times or spent < budget):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+        spent += times[-1]
+        if len(times) == 1:
+            rss = max(telemetry.peak_rss() - rss_before, 0)
+    return {
+        'repeats': len(times),
+        'median': float(np.median(times)),
+        'p95': float(np.percentile(times, 95)),
+        'rss': rss,
+    }
+
+def benchmark_instance(election_name, stages, rule_ids, repeat, budget, instances_path=INSTANCES_PATH):
+    """
+        Benchmark all stages of pipeline on single election
+        
+        Args:
+            election_name (str): name of election
+            stages ([str]): entries of STAGES to run
+            rule_ids ([int]): numbers of entries in utils.rules to run
+            repeat (int): maximal number of runs of every benchmark
+            budget (float): seconds after which no more runs of benchmark are started
+            instances_path (str): directory with election files
+        
+        Returns:
+            dict: {benchmark name: result of measure}
+    """
+    path = instances_path + "/" + election_name + ".pb"
+    results = {}
+    if 'parse' in stages:
+        results['parse'] = measure(lambda: read_path(path, use_cache=False), repeat, budget)
+        read_path(path)
+        results['parse cached'] = measure(lambda: read_path(path), repeat, budget)
+        results['parse streaming dense'] = measure(lambda: stream_dense(path), repeat, budget)
+        results['parse streaming sparse'] = measure(lambda: stream_dense(path, sparse=True), repeat, budget)
+        read_dense(path)
+        results['parse dense mapped'] = measure(lambda: read_dense(path), repeat, budget)
+    (instance, profile) = read_path(path)
+    balanced = {}
+    for use_cost in [True, False]:
+        setting = 'cost' if use_cost else 'score'
+        if 'balance' in stages:
+            results[f'balance {setting}'] = measure(
+                lambda: balance_profile(instance, profile, use_cost, use_cost, use_cost), repeat, budget)
+            results[f'balance dense {setting}'] = measure(
+                lambda: balance_profile(instance, profile, use_cost, use_cost, use_cost, True), repeat, budget)
+            results[f'balance sparse {setting}'] = measure(
+                lambda: balance_profile(instance, profile, use_cost, use_cost, use_cost, sparse=True), repeat, budget)
+        (_, balanced[use_cost]) = balance_profile(instance, profile, use_cost, use_cost, use_cost)
+    if 'rules' in stages:
+        for rule_id in rule_ids:
+            (name, use_cost, rule) = rules[rule_id]
+            results[f'rule {name}'] = measure(lambda: rule(instance=instance, profile=balanced[use_cost]), repeat, budget)
+    if 'metrics' in stages:
+        greedy = greedy_all(instance, balanced[True])
+        (alloc1, alloc2) = (greedy['GE'], greedy['GS'])
+        dense = dense_profile(instance, profile)
+        sparse = sparse_profile(instance, profile)
+        for metric_name, metric in metrics.items():
+            # metrics of Profile convert it to DenseProfile once and keep it, so first (cold) and later (warm)
+            # runs are timed separately
+            results[f'metric {metric_name}'] = measure(
+                lambda: metric(instance, profile, alloc1, alloc2), repeat, budget, clear_dense_cache)
+            results[f'metric {metric_name} warm'] = measure(
+                lambda: metric(instance, profile, alloc1, alloc2), repeat, budget)
+            if metric_name in dense_metrics:
+                results[f'metric {metric_name} dense'] = measure(
+                    lambda: metric(instance, dense, alloc1, alloc2), repeat, budget)
+                results[f'metric {metric_name} sparse'] = measure(
+                    lambda: metric(instance, sparse, alloc1, alloc2), repeat, budget)
+    return results
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+        Find benchmarks whose median got slower than baseline by more than threshold
+        
+        Args:
+            results (dict): {election name: {benchmark name: result of measure}}
+            baseline (dict): results stored by earlier run
+            threshold (float): allowed relative slowdown
+        
+        Returns:
+            [(str, str, float)]: list of (election name, benchmark name, median over baseline median)
+    """
+    regressions = []
+    for election_name, benchmarks in results.items():
+        for benchmark_name, result in benchmarks.items():
+            base = baseline.get(election_name, {}).get(benchmark_name)
+            if base is None or base['median'] <= 0:
+                continue
+            ratio = result['median'] / base['median']
+            if ratio > 1.0 + threshold:
+                regressions.append((election_name, benchmark_name, ratio))
+    return regressions
+
+def report(results, baseline):
+    """
+        Print results of every benchmark next to its baseline
+        
+        Args:
+            results (dict): {election name: {benchmark name: result of measure}}
+            baseline (dict): results stored by earlier run
+        
+        Returns:
+            None
+    """
+    for election_name, benchmarks in results.items():
+        print(election_name)
+        for benchmark_name, result in benchmarks.items():
+            line = (f'  {benchmark_name:<32} n={result["repeats"]:<3} median: {result["median"]:10.4f}s  '
+                    f'p95: {result["p95"]:10.4f}s  rss: {result["rss"] / 1024 ** 2:8.1f}MB')
+            base = baseline.get(election_name, {}).get(benchmark_name)
+            if base is not None and base['median'] > 0:
+                line += f'  vs baseline: {result["median"] / base["median"]:6.2f}x'
+            print(line)
+
+def load_baseline(path):
+    """
+        Read stored baseline, missing file is treated as empty baseline
+        
+        Args:
+            path (str): path to baseline
+        
+        Returns:
+            dict: {election name: {benchmark name: result of measure}}
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['results']
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(path, results):
+    """
+        Store results as baseline together with description of environment they were measured in
+        
+        Args:
+            path (str): path to baseline
+            results (dict): {election name: {benchmark name: result of measure}}
+        
+        Returns:
+            None
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'python': sys.version,
+            'pabutools': PABUTOOLS_VERSION,
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'time': time.time(),
+            'results': results,
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark parsing, balancing, rules and metrics on sample elections')
+    parser.add_argument('--preset', default='minimal', choices=sorted(SAMPLE_PRESETS), help='set of elections to use')
+    parser.add_argument('--instance', action='append', default=[], help='use given election instead of preset, can be repeated')
+    parser.add_argument('--stage', action='append', choices=STAGES, help='only run given stage, can be repeated')
+    parser.add_argument('--rule', action='append', default=[], choices=[name for name, _, _ in rules], metavar='RULE',
+                        help='only run given rule from utils.rules, can be repeated')
+    parser.add_argument('--repeat', type=int, default=5, help='maximal number of runs of every benchmark')
+    parser.add_argument('--budget', type=float, default=10.0, help='seconds after which no more runs of benchmark are started')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path to stored baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store results as new baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='relative slowdown of median reported as regression')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error(f'--repeat must be at least 1, got {args.repeat}')
+
+    election_names = args.instance or list(dict.fromkeys(SAMPLE_PRESETS[args.preset]))
+    stages = args.stage or STAGES
+    rule_ids = [rule_id for rule_id, (name, _, _) in enumerate(rules) if not args.rule or name in args.rule]
+    baseline = load_baseline(args.baseline)
+    results = {}
+    for election_name in election_names:
+        try:
+            results[election_name] = benchmark_instance(election_name, stages, rule_ids, args.repeat, args.budget, args.instances)
+        except (TypeError, FileNotFoundError) as e:
+            # unsupported ballot type or election missing from instances directory
+            print(f'{election_name}\n  skipped: {type(e).__name__} {e}')
+    report(results, baseline)
+    regressions = compare(results, baseline, args.threshold)
+    for (election_name, benchmark_name, ratio) in regressions:
+        print(f'REGRESSION {election_name} {benchmark_name}: {ratio:.2f}x baseline median')
+    if args.save_baseline:
+        for election_name, benchmarks in results.items():
+            baseline.setdefault(election_name, {}).update(benchmarks)
+        save_baseline(args.baseline, baseline)
+    if regressions:
+        sys.exit(1)
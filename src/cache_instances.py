@@ -0,0 +1,42 @@
+import argparse
+import multiprocessing
+import os
+import pathlib
+import time
+
+from utils import read_path, INSTANCES_PATH
+
+def __measure_instance(path):
+    """
+        Parses election without cache, stores it in cache and loads it back from cache
+        
+        Args:
+            path (str): path to election file
+        
+        Returns:
+            tuple: (election name, cold load time, warm load time)
+    """
+    start_time = time.perf_counter()
+    read_path(path, use_cache=False)
+    cold_time = time.perf_counter() - start_time
+    read_path(path)
+    start_time = time.perf_counter()
+    read_path(path)
+    warm_time = time.perf_counter() - start_time
+    return (pathlib.Path(path).stem, cold_time, warm_time)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill cache of parsed elections and compare cold and warm load times')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args()
+    instances_path = pathlib.Path(INSTANCES_PATH)
+    paths = [str(p) for p in sorted(instances_path.glob('*.pb'))]
+    with multiprocessing.Pool(args.jobs) as pool:
+        times = pool.map(__measure_instance, paths, chunksize=1)
+    times.sort(key=lambda t: t[1], reverse=True)
+    for (name, cold_time, warm_time) in times:
+        print(f'{name}\n  cold: {cold_time:.3f}s\n  warm: {warm_time:.3f}s')
+    cold_sum = sum(t[1] for t in times)
+    warm_sum = sum(t[2] for t in times)
+    print(f'total\n  cold: {cold_sum:.3f}s\n  warm: {warm_sum:.3f}s\n  speedup: {cold_sum / warm_sum:.2f}x')
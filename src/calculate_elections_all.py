@@ -1,88 +1,474 @@
+import argparse
 import time
 import json
 import multiprocessing
+import os
 import pathlib
+import shutil
+import tempfile
 
-from utils import rules, read_pb, ENCODING
+import manifest
+import telemetry
+import utils
+from dense_cstv import shared_cstv
+from limits import guard, parse_limits, LimitExceeded, DEFAULT_LIMITS
+from manifest import output_hash
+from scheduler import schedule, report
+from utils import (
+    rules, 
+    rule_family, 
+    greedy_rules, 
+    greedy_all, 
+    read_path, 
+    balance_profile, 
+    merge_identical, 
+    filter_instances, 
+    ENCODING, 
+    INSTANCES_PATH, 
+    RESULTS_PATH, 
+    SAMPLE_PRESETS
+)
 
-def __res_path(rule_name, election_name):
+def __res_path(rule_name, election_name, results_path=RESULTS_PATH):
     """
         Shortcut for makiong path to specific results file
         
         Args:
             rule_name (str): name of rule used for results
-            election_name(str): name of calculated election 
-            
+            election_name(str): name of calculated election
+            results_path(str): directory with results of all rules
+        
         Returns:
             Path
     """
-    return pathlib.Path("../election_results/" + rule_name + "/" + election_name + ".json")
+    return pathlib.Path(results_path + "/" + rule_name + "/" + election_name + ".json")
+
+def __write_result(rule_name, election_name, res, results_path=RESULTS_PATH):
+    """
+        Save results of specific election and rule, replacing old results atomically
+        
+        Args:
+            rule_name (str): name of rule used for results
+            election_name(str): name of calculated election
+            res (iterable(Project)): projects chosen by the rule
+            results_path(str): directory with results of all rules
+        
+        Returns:
+            [str]: names of chosen projects as written
+    """
+    res = [str(x).replace("'", '"') for x in res]
+    path = __res_path(rule_name, election_name, results_path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding=ENCODING) as f:
+            json.dump(res, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return res
 
-def __recalculate_election(election_name, rule_id):
+def __run_guarded(rule_id, limits, run):
+    """
+        Run rule within wall-clock and RSS limits of its family
+        
+        Args:
+            rule_id(int): number of entry in utils.rules assosiated with rule used
+            limits(dict): {family: (seconds, bytes)}
+            run(callable): calculates chosen projects
+        
+        Returns:
+            tuple: (status, chosen projects or None, runtime in seconds)
+    """
+    (timeout, max_rss) = limits[rule_family(rule_id)]
+    start_time = time.time()
+    try:
+        with guard(timeout, max_rss):
+            res = run()
+    except LimitExceeded as e:
+        return (e.status, None, time.time() - start_time)
+    return ('ok', res, time.time() - start_time)
+
+def __recalculate_election(election_name, rule_id, instances_path=INSTANCES_PATH, results_path=RESULTS_PATH, limits=DEFAULT_LIMITS):
     """
         Recalculate results of specific election and rule
         
         Args:
             election_name (str): name of calculated election 
             rule_id(int): number of entry in utils.rules assosiated with rule used
-            
+            instances_path(str): directory with election files
+            results_path(str): directory with results of all rules
+            limits(dict): {family: (seconds, bytes)}
+        
         Returns:
-            None
+            tuple: ({rule name: (status, runtime in seconds, output hash)}, [telemetry record],
+                    {use cost: (rounds made, rounds made separately)}, {use cost: (ballots, distinct ballots)})
     """
-    (name, use_cost, rule) = rules[rule_id]
-    try:
-        (instance, profile) = read_pb("../instances_all/" + election_name + ".pb",
-                                        use_cost, use_cost, use_cost)
-    except TypeError as e:
-        return
-    print(f'{election_name} {name}\n  started at: {time.localtime().tm_hour}:{time.localtime().tm_min}:{time.localtime().tm_sec}')
-    start_time = time.time()
-    res = rule(instance=instance, profile=profile)
-    print(f'{election_name} {name}\n  finished at: {time.localtime().tm_hour}:{time.localtime().tm_min}:{time.localtime().tm_sec}\n  runtime: {time.time() - start_time}')
-    res = [str(x).replace("'", '"') for x in res]
+    return __calculate_instance(election_name, [rule_id], instances_path, results_path, limits)
 
-    with __res_path(name, election_name).open('w', encoding=ENCODING) as f:
-        json.dump(res, f, indent=2)
+def __calculate_instance(election_name, rule_ids, instances_path=INSTANCES_PATH, results_path=RESULTS_PATH, limits=DEFAULT_LIMITS):
+    """
+        Calculate results of specific election for many rules,
+        election is read once and balanced once per cost setting.
+        With utils.SHARED_CSTV all cstv rules of a cost setting are run together by shared_cstv,
+        with utils.MERGE_BALLOTS identical balanced ballots of array-backed profiles are merged by merge_identical
+        
+        Args:
+            election_name (str): name of calculated election 
+            rule_ids([int]): numbers of entries in utils.rules assosiated with rules used
+            instances_path(str): directory with election files
+            results_path(str): directory with results of all rules
+            limits(dict): {family: (seconds, bytes)}
+        
+        Returns:
+            tuple: ({rule name: (status, runtime in seconds, output hash)}, [telemetry record],
+                    {use cost: (rounds made, rounds made separately)} of shared cstv runs,
+                    {use cost: (ballots, distinct ballots)} of merged profiles)
+    """
+    results = {}
+    records = []
+    telemetry.reset_peak_rss()
+    start_time = time.perf_counter()
+    (instance, raw_profile) = read_path(instances_path + "/" + election_name + ".pb")
+    parse_time = time.perf_counter() - start_time
+    (voters, projects) = (len(raw_profile), len(instance))
+    profiles = {}
+    greedy_results = {}
+    cstv_results = {}
+    shared_rounds = {}
+    merged = {}
+    for rule_id in rule_ids:
+        (name, use_cost, rule) = rules[rule_id]
+        # greedy rules only need support of projects, which is cheapest to get from dense profile,
+        # dense_cstv works on the same profile
+        dense = rule in greedy_rules or utils.DENSE_CSTV
+        balance_time = 0.0
+        try:
+            if (use_cost, dense) not in profiles:
+                start_time = time.perf_counter()
+                (_, profiles[(use_cost, dense)]) = balance_profile(instance, raw_profile,
+                                                                  use_cost, use_cost, use_cost,
+                                                                  dense and not utils.SPARSE_PROFILES,
+                                                                  dense and utils.SPARSE_PROFILES)
+                if dense and utils.MERGE_BALLOTS:
+                    ballots = len(profiles[(use_cost, dense)])
+                    profiles[(use_cost, dense)] = merge_identical(profiles[(use_cost, dense)])
+                    merged[use_cost] = (ballots, len(profiles[(use_cost, dense)]))
+                balance_time = time.perf_counter() - start_time
+        except TypeError as e:
+            results[name] = ('unsupported', None, None)
+            records.append(telemetry.make_record(election_name, name, 'unsupported', voters, projects,
+                                                 parse_time, balance_time, None, telemetry.peak_rss()))
+            parse_time = 0.0
+            telemetry.reset_peak_rss()
+            continue
+        profile = profiles[(use_cost, dense)]
+        if rule in greedy_rules:
+            if use_cost not in greedy_results:
+                greedy_results[use_cost] = __run_guarded(rule_id, limits,
+                                                         lambda: greedy_all(instance, profile))
+                (status, res, runtime) = greedy_results[use_cost]
+                rule_time = runtime
+            else:
+                # all greedy rules are calculated by the first one, 
+                # the manifest still gets the runtime needed to calculate this rule alone
+                (status, res, runtime) = greedy_results[use_cost]
+                rule_time = 0.0
+            if status == 'ok':
+                res = res[greedy_rules[rule]]
+        elif utils.SHARED_CSTV:
+            if use_cost not in cstv_results:
+                combinations = [rules[other_id][2].combination for other_id in rule_ids
+                                if rules[other_id][1] == use_cost and rules[other_id][2] not in greedy_rules]
+                cstv_results[use_cost] = __run_guarded(rule_id, limits,
+                                                       lambda: shared_cstv(instance, profile, combinations))
+                (status, res, runtime) = cstv_results[use_cost]
+                rule_time = runtime
+                if status == 'ok':
+                    shared_rounds[use_cost] = res[1]
+            else:
+                # like greedy rules, the manifest gets runtime of all rules run together
+                (status, res, runtime) = cstv_results[use_cost]
+                rule_time = 0.0
+            if status == 'ok':
+                res = res[0][rule.combination.name]
+        else:
+            (status, res, runtime) = __run_guarded(rule_id, limits,
+                                                   lambda: rule(instance=instance, profile=profile))
+            rule_time = runtime
+        records.append(telemetry.make_record(election_name, name, status, voters, projects,
+                                             parse_time, balance_time, rule_time, telemetry.peak_rss()))
+        parse_time = 0.0
+        telemetry.reset_peak_rss()
+        if status != 'ok':
+            results[name] = (status, runtime, None)
+            continue
+        res = __write_result(name, election_name, res, results_path)
+        results[name] = ('ok', runtime, output_hash(res))
+    return (results, records, shared_rounds, merged)
 
-def __calculate_election(election_name, rule_id, force_recalculate=False):
+def __run_job(election_name, rule_ids, predicted, per_instance, instances_path, results_path, limits):
     """
-        Calculate missing results of specific election and rule
+        Run single scheduled job
         
         Args:
             election_name (str): name of calculated election 
-            rule_id(int): number of entry in utils.rules assosiated with rule used
-            force_recalculate(bool): force recalculation even if results already exist
-            
+            rule_ids([int]): numbers of entries in utils.rules assosiated with rules used
+            predicted(dict): {rule name: predicted seconds}
+            per_instance(bool): job covers all rule_ids at once instead of a single rule
+            instances_path(str): directory with election files
+            results_path(str): directory with results of all rules
+            limits(dict): {family: (seconds, bytes)}
+        
+        Returns:
+            tuple: (election name, predicted, {rule name: (status, runtime in seconds, output hash)}, 
+                    [telemetry record], {use cost: (rounds made, rounds made separately)},
+                    {use cost: (ballots, distinct ballots)}, job wall time)
+    """
+    start_time = time.perf_counter()
+    if per_instance:
+        (results, records, shared_rounds, merged) = __calculate_instance(election_name, rule_ids, instances_path,
+                                                                         results_path, limits)
+    else:
+        (results, records, shared_rounds, merged) = __recalculate_election(election_name, rule_ids[0], instances_path,
+                                                                           results_path, limits)
+    return (election_name, predicted, results, records, shared_rounds, merged, time.perf_counter() - start_time)
+
+def __run_job_star(args):
+    """
+        Unpack arguments of __run_job for Pool.imap_unordered
+        
+        Args:
+            args (tuple): arguments of __run_job
+        
+        Returns:
+            tuple: result of __run_job
+    """
+    return __run_job(*args)
+
+def __init_worker(cache_path, dense_cstv, shared_cstv, sparse_profiles, merge_ballots):
+    """
+        Set up worker process
+        
+        Args:
+            cache_path (str): directory with parsed elections cache
+            dense_cstv (bool): run cstv rules with dense_cstv
+            shared_cstv (bool): run cstv rules of an election together with shared_cstv
+            sparse_profiles (bool): balance profiles of greedy rules and dense_cstv to SparseProfile
+            merge_ballots (bool): merge identical ballots of profiles of greedy rules and dense_cstv
+        
+        Returns:
+            None
+    """
+    utils.CACHE_PATH = cache_path
+    utils.DENSE_CSTV = dense_cstv
+    utils.SHARED_CSTV = shared_cstv
+    utils.SPARSE_PROFILES = sparse_profiles
+    utils.MERGE_BALLOTS = merge_ballots
+
+def __run(instaces_names, rule_ids, force_recalculate, per_instance, processes, instances_path=INSTANCES_PATH, results_path=RESULTS_PATH, 
+          dry_run=False, limits=DEFAULT_LIMITS, retry_limited=False, telemetry_path=None):
+    """
+        Calculate results of all given elections and rules in parallel, 
+        only results that are stale according to the manifest are calculated and longest predicted jobs are started first
+        
+        Args:
+            instaces_names ([str]): names of calculated elections
+            rule_ids([int]): numbers of entries in utils.rules assosiated with rules used
+            force_recalculate(bool): force recalculation even if results are up to date
+            per_instance(bool): make one job per election instead of one job per election and rule
+            processes(int): number of worker processes, defaults to number of cores
+            instances_path(str): directory with election files
+            results_path(str): directory with results of all rules
+            dry_run(bool): only print jobs that would be run
+            limits(dict): {family: (seconds, bytes)}
+            retry_limited(bool): recalculate results that ran out of time or memory before
+            telemetry_path(str): JSONL log runtime of every rule is appended to, defaults to one in results_path
+        
         Returns:
             None
     """
-    if force_recalculate:
-        __recalculate_election(election_name, rule_id)
+    if not dry_run:
+        for rule_id in rule_ids:
+            pathlib.Path(results_path).joinpath(rules[rule_id][0]).mkdir(parents=True, exist_ok=True)
+    conn = manifest.connect(results_path)
+    versions = {rule_id: manifest.rule_version(rule_id) for rule_id in rule_ids}
+    hashes = {}
+    jobs = []
+    for instance_name in instaces_names:
+        hashes[instance_name] = manifest.input_hash(conn, instances_path, instance_name)
+        if force_recalculate:
+            stale = rule_ids
+        else:
+            stale = manifest.stale_rules(conn, instance_name, rule_ids, hashes[instance_name], versions, results_path,
+                                         manifest.LIMITED_STATUSES if retry_limited else ())
+        if not stale:
+            continue
+        if per_instance:
+            jobs.append((instance_name, stale))
+        else:
+            jobs.extend((instance_name, [rule_id]) for rule_id in stale)
+    conn.commit()
+    args = [(election_name, job_rule_ids, predicted, per_instance, instances_path, results_path, limits)
+            for (election_name, job_rule_ids, predicted) in schedule(jobs, instances_path, manifest.load_runtimes(conn))]
+    if dry_run:
+        conn.close()
+        for (election_name, job_rule_ids, predicted, *_) in args:
+            print(f'{election_name} [{", ".join(predicted)}]\n  predicted: {sum(predicted.values()):.3f}s')
+        print(f'{len(args)} jobs, {sum(len(job[1]) for job in args)} results to calculate')
         return
-    (name, use_cost, rule) = rules[rule_id]
-    if __res_path(name, election_name).exists():
-        with __res_path(name, election_name).open('r', encoding=ENCODING) as f:
-            try:
-                arr = json.load(f)
-                if not arr:
-                    __recalculate_election(election_name, rule_id)
-            except ValueError as e:
-                __recalculate_election(election_name, rule_id)
+    if telemetry_path is None:
+        telemetry_path = telemetry.telemetry_path(results_path)
+    rule_ids_by_name = {rules[rule_id][0]: rule_id for rule_id in rule_ids}
+    finished = []
+    limited = []
+    shared = []
+    reductions = []
+    worker_args = (utils.CACHE_PATH, utils.DENSE_CSTV, utils.SHARED_CSTV, utils.SPARSE_PROFILES, utils.MERGE_BALLOTS)
+    with multiprocessing.Pool(processes, initializer=__init_worker, initargs=worker_args) as pool:
+        for (election_name, predicted, results, records, shared_rounds, merged, wall_time) in pool.imap_unordered(__run_job_star, args, chunksize=1):
+            telemetry.append(telemetry_path, records)
+            for name, (status, runtime, res_hash) in results.items():
+                manifest.record(conn, election_name, name, hashes[election_name],
+                                versions[rule_ids_by_name[name]], runtime, res_hash, status)
+            conn.commit()
+            runtimes = {name: runtime for name, (status, runtime, _) in results.items() if status == 'ok'}
+            finished.append((election_name, predicted, runtimes, wall_time))
+            limited.extend((election_name, name, status) for name, (status, _, _) in results.items()
+                           if status in manifest.LIMITED_STATUSES)
+            shared.extend((election_name, use_cost, rounds) for use_cost, rounds in shared_rounds.items())
+            reductions.extend((election_name, use_cost, counts) for use_cost, counts in merged.items())
+    conn.close()
+    report(finished)
+    report_shared(shared)
+    report_merged(reductions)
+    for (election_name, name, status) in sorted(limited):
+        print(f'{election_name} {name}\n  status: {status}')
+
+def report_shared(shared):
+    """
+        Print how many rounds of cstv were saved by running rules of an election together
+        
+        Args:
+            shared ([(str, bool, (int, int))]): list of
+                (election name, use cost, (rounds made, rounds made by running rules separately))
+        
+        Returns:
+            None
+    """
+    if not shared:
         return
-    else:
-        __recalculate_election(election_name, rule_id)
+    total = [0, 0]
+    for (election_name, use_cost, (rounds, separate_rounds)) in sorted(shared):
+        total[0] += rounds
+        total[1] += separate_rounds
+        setting = 'cost' if use_cost else 'score'
+        print(f'{election_name} cstv {setting}\n  rounds: {rounds} of {separate_rounds}\n  saved: {separate_rounds - rounds}')
+    print(f'total cstv\n  rounds: {total[0]} of {total[1]}\n  saved: {total[1] - total[0]}')
+
+def report_merged(reductions):
+    """
+        Print how many ballots were left after merging identical ones
+        
+        Args:
+            reductions ([(str, bool, (int, int))]): list of (election name, use cost, (ballots, distinct ballots))
+        
+        Returns:
+            None
+    """
+    if not reductions:
         return
+    total = [0, 0]
+    for (election_name, use_cost, (ballots, distinct)) in sorted(reductions):
+        total[0] += ballots
+        total[1] += distinct
+        setting = 'cost' if use_cost else 'score'
+        print(f'{election_name} ballots {setting}\n  distinct: {distinct} of {ballots}\n  ratio: {ballots / max(distinct, 1):.2f}')
+    print(f'total ballots\n  distinct: {total[1]} of {total[0]}\n  ratio: {total[0] / max(total[1], 1):.2f}')
+
+def __benchmark_scheduling(instaces_names, rule_ids, processes, instances_path=INSTANCES_PATH):
+    """
+        Compare total wall time of per election and rule jobs with per election jobs,
+        results are written to temporary directories
+        
+        Args:
+            instaces_names ([str]): names of calculated elections
+            rule_ids([int]): numbers of entries in utils.rules assosiated with rules used
+            processes(int): number of worker processes
+            instances_path(str): directory with election files
+        
+        Returns:
+            dict: {mode name: wall time in seconds}
+    """
+    # both modes should load elections from a warm cache
+    for instance_name in instaces_names:
+        read_path(instances_path + "/" + instance_name + ".pb")
+    times = {}
+    for mode_name, per_instance in [('per (instance, rule)', False), ('per instance', True)]:
+        results_path = tempfile.mkdtemp(prefix='election_results_')
+        try:
+            start_time = time.perf_counter()
+            __run(instaces_names, rule_ids, True, per_instance, processes, instances_path, results_path)
+            times[mode_name] = time.perf_counter() - start_time
+        finally:
+            shutil.rmtree(results_path)
+    for mode_name, wall_time in times.items():
+        print(f'{mode_name}\n  wall time: {wall_time:.3f}s')
+    return times
 
 
 if __name__ == '__main__':
-    force_recalculate = False
-    instances_path = pathlib.Path('../instances_all')
-    instaces_names = [p.stem for p in list(instances_path.glob('*.pb'))]
-    for rule_name, _, _ in rules:
-        pathlib.Path('../election_results').joinpath(rule_name).mkdir(parents=True, exist_ok=True)
-    pool = multiprocessing.Pool(12)
-    args = []
-    for instance_name in instaces_names:
-        for rule_id in range(len(rules)):
-            args.append((instance_name, rule_id ,force_recalculate))
-    pool.starmap(__calculate_election, args, chunksize=1)
+    parser = argparse.ArgumentParser(description='Calculate results of voting rules on elections')
+    parser.add_argument('--glob', action='append', default=[], metavar='PATTERN',
+                        help='select elections whose name matches shell-style pattern, can be repeated')
+    parser.add_argument('--regex', action='append', default=[], metavar='REGEX',
+                        help='select elections whose name contains match of regular expression, can be repeated')
+    parser.add_argument('--preset', action='append', default=[], choices=sorted(SAMPLE_PRESETS),
+                        help='select elections from utils.SAMPLE_ELECTION_NAMES or MINIMAL_SAMPLE_ELECTION_NAMES')
+    parser.add_argument('--rule', action='append', default=[], choices=[name for name, _, _ in rules], metavar='RULE',
+                        help='only calculate given rule from utils.rules, can be repeated')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='recalculate results even if they are up to date')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only print jobs that would be run')
+    parser.add_argument('--timeout', action='append', default=[], metavar='FAMILY=SECONDS',
+                        help='wall-clock limit of single rule of family greedy or cstv, 0 disables it, can be repeated')
+    parser.add_argument('--max-rss', action='append', default=[], metavar='FAMILY=MB',
+                        help='RSS limit of worker running rule of family greedy or cstv, 0 disables it, can be repeated')
+    parser.add_argument('--retry-limited', action='store_true',
+                        help='recalculate results that ran out of time or memory in earlier runs')
+    parser.add_argument('--telemetry', default=None, help='JSONL log of runtimes, defaults to telemetry.jsonl in results directory')
+    parser.add_argument('--per-pair', action='store_true', help='make one job per (election, rule) instead of one per election')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare wall time of per (election, rule) and per election jobs on selected elections')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    parser.add_argument('--results', default=RESULTS_PATH, help='directory with results of all rules')
+    parser.add_argument('--cache', default=utils.CACHE_PATH, help='directory with parsed elections cache')
+    parser.add_argument('--dense-cstv', action='store_true',
+                        help='run cstv rules with dense_cstv instead of pabutools cstv')
+    parser.add_argument('--shared-cstv', action='store_true',
+                        help='run cstv rules of an election together, sharing their common rounds (implies --dense-cstv)')
+    parser.add_argument('--sparse', action='store_true',
+                        help='keep only votes voters gave in profiles of greedy rules and dense_cstv')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge identical ballots of profiles of greedy rules and dense_cstv into weighted rows')
+    args = parser.parse_args()
+    try:
+        limits = parse_limits(args.timeout, args.max_rss)
+    except ValueError as e:
+        parser.error(str(e))
+
+    utils.CACHE_PATH = args.cache
+    utils.DENSE_CSTV = args.dense_cstv or args.shared_cstv
+    utils.SHARED_CSTV = args.shared_cstv
+    utils.SPARSE_PROFILES = args.sparse
+    utils.MERGE_BALLOTS = args.merge
+    instaces_names = sorted(p.stem for p in pathlib.Path(args.instances).glob('*.pb'))
+    instaces_names = filter_instances(instaces_names, args.glob, args.regex, args.preset)
+    rule_ids = [rule_id for rule_id, (name, _, _) in enumerate(rules) if not args.rule or name in args.rule]
+    if args.benchmark:
+        if not (args.glob or args.regex or args.preset):
+            instaces_names = filter_instances(instaces_names, presets=['minimal'])
+        __benchmark_scheduling(instaces_names, rule_ids, args.workers, args.instances)
+    else:
+        __run(instaces_names, rule_ids, args.force, not args.per_pair, args.workers, args.instances, args.results,
+              args.dry_run, limits, args.retry_limited, args.telemetry)
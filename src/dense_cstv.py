@@ -0,0 +1,892 @@
+import argparse
+import copy
+import json
+import math
+import pathlib
+import time
+
+import numpy as np
+from gmpy2 import mpq
+from pabutools.rules.budgetallocation import BudgetAllocation
+
+from utils import (
+    DenseProfile,
+    SparseProfile,
+    ENCODING,
+    INSTANCES_PATH,
+    RESULTS_PATH,
+    SAMPLE_PRESETS,
+    balance_profile,
+    dense_profile,
+    exact_number,
+    filter_instances,
+    greedy_rules,
+    read_path,
+    rules
+)
+
+# {combination name: (project selection, procedure used when no project is eligible)}
+COMBINATIONS = {
+    'EWT': ('GE', 'EWT'),
+    'EWTC': ('GSC', 'EWT'),
+    'EWTS': ('GS', 'EWT'),
+    'MT': ('GE', 'MT'),
+    'MTC': ('GSC', 'MT'),
+    'MTS': ('GS', 'MT'),
+}
+# Same limit as pabutools minimal_transfer
+MAX_TRANSFER_LOOPS = 10000
+# minimal_transfer rounds moved donations up to 14 decimal places
+TRANSFER_PRECISION = 100000000000000
+
+def __sum(values, axis=0):
+    """
+        Sum values one after another like the built-in sum used by cstv, numpy.sum adds pairwise
+        and can round float64 donations differently
+        
+        Args:
+            values (numpy.ndarray): values to sum
+            axis (int): axis to sum over
+        
+        Returns:
+            numpy.ndarray: sums, a number for one-dimensional values
+    """
+    if values.shape[axis] == 0:
+        return np.zeros(values.shape[:axis] + values.shape[axis + 1:], dtype=values.dtype)[()]
+    return np.cumsum(values, axis=axis).take(-1, axis=axis)
+
+def __scores(selection, support, costs):
+    """
+        Get score of every project used to choose project to fund
+        
+        Args:
+            selection (str): 'GE' (excess support), 'GSC' (support over cost) or 'GS' (support)
+            support (numpy.ndarray): total donations to every project
+            costs (numpy.ndarray): cost of every project
+        
+        Returns:
+            numpy.ndarray: score per project
+    """
+    match selection:
+        case 'GE':
+            return support - costs
+        case 'GSC':
+            return support / costs
+        case 'GS':
+            return support
+
+def __eligible(selection, support, costs):
+    """
+        Get projects with enough donations to be funded, the test is made the same way as
+        is_eligible_gsc for GSC and as is_eligible_ge otherwise
+        
+        Args:
+            selection (str): 'GE', 'GSC' or 'GS'
+            support (numpy.ndarray): total donations to every project
+            costs (numpy.ndarray): cost of every project
+        
+        Returns:
+            numpy.ndarray: bool per project
+    """
+    if selection == 'GSC':
+        return support / costs >= 1
+    return support - costs >= 0
+
+def __round_up(change):
+    """
+        Round donations moved by minimal transfer up like minimal_transfer, fractions of exact profiles stay exact
+        
+        Args:
+            change (numpy.ndarray): moved donations
+        
+        Returns:
+            numpy.ndarray: rounded donations
+    """
+    if change.dtype == object:
+        return np.frompyfunc(lambda value: mpq(math.ceil(value * TRANSFER_PRECISION), TRANSFER_PRECISION), 1, 1)(change)
+    return np.ceil(change * TRANSFER_PRECISION) / TRANSFER_PRECISION
+
+def __round_taken(change):
+    """
+        Round donations taken by minimal transfer of exact profiles down to 28 decimal places, far below rounding
+        of float64 donations. Exact fractions taken in every loop would otherwise make denominators of donations
+        longer with every loop, so exact minimal transfers would in practice never end
+        
+        Args:
+            change (numpy.ndarray): taken donations as gmpy2 fractions
+        
+        Returns:
+            numpy.ndarray: rounded donations
+    """
+    precision = TRANSFER_PRECISION * TRANSFER_PRECISION
+    return np.frompyfunc(lambda value: mpq(math.floor(value * precision), precision), 1, 1)(change)
+
+def __best(scores, candidates, ranks, lowest=False):
+    """
+        Get candidate with highest (or lowest) score, ties go to the candidate with the lowest rank
+        
+        Args:
+            scores (numpy.ndarray): score per project
+            candidates (numpy.ndarray): bool per project
+            ranks (numpy.ndarray): rank per project, position of project in order of names or in the set cstv iterates
+            lowest (bool): Take the candidate with the lowest score
+        
+        Returns:
+            int: column of project
+    """
+    columns = np.flatnonzero(candidates)
+    values = scores[columns]
+    tied = columns[values == (values.min() if lowest else values.max())]
+    return int(tied[np.argmin(ranks[tied])])
+
+def __spread(donations, rows, to_distribute, total):
+    """
+        Add to_distribute of every donor in rows to its donations proportionally to them
+        
+        Args:
+            donations (numpy.ndarray): voters x projects matrix of donations, changed in place
+            rows (numpy.ndarray): bool per voter, donors to change
+            to_distribute (numpy.ndarray): amount per voter
+            total (numpy.ndarray): sum of donations the amount is spread over per voter
+        
+        Returns:
+            None
+    """
+    block = donations[rows]
+    donations[rows] = block + to_distribute[rows, None] * (block / total[rows, None])
+
+def __redistribute_excess(donations, project, gama):
+    """
+        Give part 1 - gama of donations to funded project back to other projects of the same donors,
+        mirrors excess_redistribution_procedure, the part of donors without other donations is lost
+        
+        Args:
+            donations (numpy.ndarray): voters x projects matrix of donations, changed in place
+            project (int): column of funded project
+            gama (float): part of donations used to fund the project
+        
+        Returns:
+            None
+    """
+    to_distribute = donations[:, project] * (1 - gama)
+    donations[:, project] = 0
+    total = __sum(donations, 1)
+    __spread(donations, total != 0, to_distribute, total)
+
+class SparseDonations:
+    """
+        Donations kept only where voters gave votes, donations never move to a project the voter did not
+        vote for, so the set of stored entries does not change while cstv runs. The project of every column
+        of the profile is moved to the column given by positions
+        
+        Attributes:
+            rows (numpy.ndarray): voter of every entry, increasing
+            columns (numpy.ndarray): project of every entry, increasing within every voter
+            values (numpy.ndarray): donation of every entry, changed in place
+            column_entries ([numpy.ndarray]): positions of entries of every project, increasing
+            voters (int): number of voters
+            projects (int): number of projects
+    """
+    def __init__(self, profile, positions):
+        rows = profile.rows()
+        columns = positions[profile.indices]
+        order = np.lexsort((columns, rows))
+        self.rows = rows[order]
+        self.columns = columns[order]
+        self.values = np.array(profile.data, dtype=np.float64)[order]
+        self.voters = len(profile)
+        self.projects = len(profile.projects)
+        order = np.argsort(self.columns, kind='stable')
+        self.column_entries = np.split(order, np.cumsum(np.bincount(self.columns, minlength=self.projects))[:-1])
+
+    def copy(self):
+        """
+            Get donations with own values and shared entries
+            
+            Returns:
+                SparseDonations
+        """
+        other = copy.copy(self)
+        other.values = self.values.copy()
+        return other
+
+    def support(self):
+        """
+            Get total donations to every project, added voter after voter
+            
+            Returns:
+                numpy.ndarray: support per project
+        """
+        return np.bincount(self.columns, weights=self.values, minlength=self.projects)
+
+    def totals(self):
+        """
+            Get total donations of every voter, added project after project
+            
+            Returns:
+                numpy.ndarray: donations per voter
+        """
+        return np.bincount(self.rows, weights=self.values, minlength=self.voters)
+
+def __totals(donations):
+    """
+        Get total donations of every row
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+        
+        Returns:
+            numpy.ndarray: donations per row
+    """
+    if isinstance(donations, SparseDonations):
+        return donations.totals()
+    return __sum(donations, 1)
+
+def __support(donations, weights):
+    """
+        Get total donations to every project
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+        
+        Returns:
+            numpy.ndarray: support per project
+    """
+    if isinstance(donations, SparseDonations):
+        if weights is None:
+            return donations.support()
+        return np.bincount(donations.columns, weights=donations.values * weights[donations.rows],
+                           minlength=donations.projects)
+    if weights is None:
+        return __sum(donations)
+    return __sum(donations * weights[:, None])
+
+def __project_support(donations, weights, project):
+    """
+        Get total donations to one project, minimal transfer needs only the project it moves donations to
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            project (int): column of project
+        
+        Returns:
+            float: support of project
+    """
+    if isinstance(donations, SparseDonations):
+        entries = donations.column_entries[project]
+        values = donations.values[entries]
+        rows = donations.rows[entries]
+    else:
+        values = donations[:, project]
+        rows = slice(None)
+    if weights is not None:
+        values = values * weights[rows]
+    return __sum(values)
+
+def __budget(donations, weights):
+    """
+        Get all donations left, cstv completes the allocation with this budget
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+        
+        Returns:
+            float: sum of donations
+    """
+    totals = __totals(donations)
+    if weights is not None:
+        totals = totals * weights
+    return __sum(totals)
+
+def __reach(donations, weights):
+    """
+        Get total donations of all supporters of every project, project has a chance to be funded
+        if it is not below its cost
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+        
+        Returns:
+            numpy.ndarray: donations of supporters per project
+    """
+    totals = __totals(donations)
+    if weights is not None:
+        totals = totals * weights
+    if isinstance(donations, SparseDonations):
+        given = donations.values > 0
+        return np.bincount(donations.columns[given], weights=totals[donations.rows[given]],
+                           minlength=donations.projects)
+    return __sum(np.where(donations > 0, totals[:, None], 0))
+
+def __sparse_spread(donations, rows, to_distribute, total):
+    """
+        Add to_distribute of every donor in rows to its donations proportionally to them, __spread of SparseDonations
+        
+        Args:
+            donations (SparseDonations): donations of voters, changed in place
+            rows (numpy.ndarray): bool per voter, donors to change
+            to_distribute (numpy.ndarray): amount per voter
+            total (numpy.ndarray): sum of donations the amount is spread over per voter
+        
+        Returns:
+            None
+    """
+    entries = rows[donations.rows]
+    voters = donations.rows[entries]
+    values = donations.values[entries]
+    donations.values[entries] = values + to_distribute[voters] * (values / total[voters])
+
+def __sparse_redistribute_excess(donations, project, gama):
+    """
+        __redistribute_excess of SparseDonations
+        
+        Args:
+            donations (SparseDonations): donations of voters, changed in place
+            project (int): column of funded project
+            gama (float): part of donations used to fund the project
+        
+        Returns:
+            None
+    """
+    entries = donations.column_entries[project]
+    to_distribute = np.zeros(donations.voters, dtype=np.float64)
+    to_distribute[donations.rows[entries]] = donations.values[entries] * (1 - gama)
+    donations.values[entries] = 0
+    total = donations.totals()
+    __sparse_spread(donations, total != 0, to_distribute, total)
+
+def __sparse_eliminate_with_transfer(donations, project, current, eliminated):
+    """
+        __eliminate_with_transfer of SparseDonations
+        
+        Args:
+            donations (SparseDonations): donations of voters, changed in place
+            project (int): column of eliminated project
+            current (numpy.ndarray): bool per project still considered, changed in place
+            eliminated ([int]): columns of eliminated projects, changed in place
+        
+        Returns:
+            None
+    """
+    entries = donations.column_entries[project]
+    to_distribute = np.zeros(donations.voters, dtype=np.float64)
+    to_distribute[donations.rows[entries]] = donations.values[entries]
+    total = donations.totals() - to_distribute
+    rows = total != 0
+    __sparse_spread(donations, rows, to_distribute, total)
+    donations.values[entries[rows[donations.rows[entries]]]] = 0
+    current[project] = False
+    eliminated.append(project)
+
+def __sparse_minimal_transfer(donations, weights, costs, project, current, eliminated, ranks):
+    """
+        __minimal_transfer of SparseDonations, supporters are numbered 0 to number of supporters - 1
+        so every loop only touches their entries
+        
+        Args:
+            donations (SparseDonations): donations of voters, changed in place
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            costs (numpy.ndarray): cost of every project
+            project (int): column of best project that could still be funded
+            current (numpy.ndarray): bool per project still considered
+            eliminated ([int]): columns of eliminated projects, changed in place
+            ranks (numpy.ndarray): position of every project in the set of projects cstv iterates
+        
+        Returns:
+            bool: False if no project can be funded anymore, projects still considered are then eliminated
+    """
+    project_entries = donations.column_entries[project]
+    project_entries = project_entries[donations.values[project_entries] > 0]
+    supporters = donations.rows[project_entries]
+    is_supporter = np.zeros(donations.voters, dtype=bool)
+    is_supporter[supporters] = True
+    entries = np.flatnonzero(is_supporter[donations.rows])
+    # number of supporter of every entry, supporters and rows are both increasing
+    owners = np.searchsorted(supporters, donations.rows[entries])
+    others = donations.columns[entries] != project
+    # entry of the project of every supporter, for every entry of the supporter
+    targets = project_entries[owners]
+    cost = costs[project]
+    r = __project_support(donations, weights, project) / cost
+    __check_transfer(r)
+    loops = 0
+    while r < 1:
+        loops += 1
+        values = donations.values[entries]
+        donation = donations.values[project_entries]
+        total = np.bincount(owners, weights=values, minlength=len(supporters))
+        if np.all(total == donation):
+            eliminated.extend(__in_order(current, ranks))
+            return False
+        total -= donation
+        rows = total > 0
+        to_distribute = np.minimum(total, donation / r - donation)
+        given = (values > 0) & others & rows[owners]
+        change = np.zeros_like(values)
+        change[given] = to_distribute[owners[given]] * values[given] / total[owners[given]]
+        change[given & (1 - change < 1e-14)] = 1
+        donations.values[entries] = values - change
+        # added one after another to the donation like in minimal_transfer
+        np.add.at(donations.values, targets[given], __round_up(change[given]))
+        r = __project_support(donations, weights, project) / cost
+        if loops > MAX_TRANSFER_LOOPS:
+            raise RuntimeError('minimal transfer did not reach required support, this can be due to floating point arithmetic')
+    return True
+
+def __eliminate_with_transfer(donations, project, current, eliminated):
+    """
+        Eliminate project and move its donations to other projects of the same donors,
+        mirrors elimination_with_transfers, donors without other donations keep theirs
+        
+        Args:
+            donations (numpy.ndarray): voters x projects matrix of donations, changed in place
+            project (int): column of eliminated project
+            current (numpy.ndarray): bool per project still considered, changed in place
+            eliminated ([int]): columns of eliminated projects, changed in place
+        
+        Returns:
+            None
+    """
+    to_distribute = donations[:, project].copy()
+    total = __sum(donations, 1) - to_distribute
+    rows = total != 0
+    __spread(donations, rows, to_distribute, total)
+    donations[rows, project] = 0
+    current[project] = False
+    eliminated.append(project)
+
+def __check_transfer(r):
+    """
+        Stop minimal transfer that pabutools would repeat forever: it is only made when no project is eligible,
+        so a project with support ratio already at 1 fails the eligibility test only by rounding
+        
+        Args:
+            r (float): support of chosen project over its cost
+        
+        Returns:
+            None
+    """
+    if r >= 1:
+        raise RuntimeError('minimal transfer did not reach required support, this can be due to floating point arithmetic')
+
+def __minimal_transfer(donations, weights, costs, project, current, eliminated, ranks):
+    """
+        Move donations of supporters of project to it until it has enough support, mirrors minimal_transfer
+        
+        Args:
+            donations (numpy.ndarray): voters x projects matrix of donations, changed in place
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            costs (numpy.ndarray): cost of every project
+            project (int): column of best project that could still be funded
+            current (numpy.ndarray): bool per project still considered
+            eliminated ([int]): columns of eliminated projects, changed in place
+            ranks (numpy.ndarray): position of every project in the set of projects cstv iterates
+        
+        Returns:
+            bool: False if no project can be funded anymore, projects still considered are then eliminated
+    """
+    supporters = np.flatnonzero(donations[:, project] > 0)
+    cost = costs[project]
+    r = __project_support(donations, weights, project) / cost
+    __check_transfer(r)
+    loops = 0
+    while r < 1:
+        loops += 1
+        block = donations[supporters]
+        donation = block[:, project].copy()
+        total = __sum(block, 1)
+        if np.all(total == donation):
+            eliminated.extend(__in_order(current, ranks))
+            return False
+        total -= donation
+        rows = total > 0
+        to_distribute = np.minimum(total, donation / r - donation)
+        given = block > 0
+        given[:, project] = False
+        given &= rows[:, None]
+        change = np.zeros_like(block)
+        np.divide(to_distribute[:, None] * block, total[:, None], out=change, where=given)
+        if change.dtype == object:
+            change[given] = __round_taken(change[given])
+        change[given & (1 - change < 1e-14)] = 1
+        block -= change
+        # added one after another to the donation like in minimal_transfer
+        block[:, project] = __sum(np.column_stack([donation, __round_up(change)]), 1)
+        donations[supporters] = block
+        r = __project_support(donations, weights, project) / cost
+        if loops > MAX_TRANSFER_LOOPS:
+            raise RuntimeError('minimal transfer did not reach required support, this can be due to floating point arithmetic')
+    return True
+
+def __in_order(candidates, ranks):
+    """
+        Get candidates in the order cstv iterates its set of projects
+        
+        Args:
+            candidates (numpy.ndarray): bool per project
+            ranks (numpy.ndarray): position of every project in the set
+        
+        Returns:
+            [int]: columns of candidates
+    """
+    columns = np.flatnonzero(candidates)
+    return [int(column) for column in columns[np.argsort(ranks[columns])]]
+
+def __decide(donations, weights, support, costs, current, combination, names, ranks):
+    """
+        Get next step of cstv without making it, combinations with equal step on equal state
+        stay in equal state after it
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            support (numpy.ndarray): total donations to every project
+            costs (numpy.ndarray): cost of every project
+            current (numpy.ndarray): bool per project still considered
+            combination (str): key of COMBINATIONS
+            names (numpy.ndarray): position of every project in order of names
+            ranks (numpy.ndarray): position of every project in the set of projects cstv iterates
+        
+        Returns:
+            tuple: ('select', column), ('eliminate', column), ('eliminate last', column),
+                   ('transfer', column), ('give up',) or ('stop',)
+    """
+    (selection, transfer) = COMBINATIONS[combination]
+    if not current.any():
+        return ('stop',)
+    eligible = current & __eligible(selection, support, costs)
+    if eligible.any():
+        # lexico_tie_breaking
+        return ('select', __best(__scores(selection, support, costs), eligible, names))
+    if transfer == 'EWT':
+        columns = np.flatnonzero(current)
+        if len(columns) == 1:
+            return ('eliminate last', int(columns[0]))
+        # elimination_with_transfers takes the lowest excess support with every selection,
+        # min keeps the first of tied projects in the set
+        return ('eliminate', __best(support - costs, current, ranks, True))
+    chance = current & (__reach(donations, weights) >= costs)
+    if not chance.any():
+        return ('give up',)
+    # minimal_transfer takes the first of tied projects in the set
+    return ('transfer', __best(__scores(selection, support, costs), chance, ranks))
+
+def __closest(scores, scales, candidates, lowest):
+    """
+        Get smallest difference between score of the best candidate and score of any other candidate
+        
+        Args:
+            scores (numpy.ndarray): score per project
+            scales (numpy.ndarray): value per project differences are relative to
+            candidates (numpy.ndarray): bool per project
+            lowest (bool): Is the best candidate the one with the lowest score
+        
+        Returns:
+            float: relative difference, inf for less than two candidates
+    """
+    columns = np.flatnonzero(candidates)
+    if len(columns) < 2:
+        return np.inf
+    (scores, scales) = (scores[columns], scales[columns])
+    best = np.argmin(scores) if lowest else np.argmax(scores)
+    gaps = np.abs(scores - scores[best]) / np.maximum(scales, scales[best])
+    gaps[best] = np.inf
+    return float(gaps.min())
+
+def __margin(donations, weights, support, costs, current, combination):
+    """
+        Get how close the step chosen by __decide is to a tie: the smallest difference between support and cost
+        of a project still considered that cannot be funded yet and between score of the chosen project and
+        of any other candidate, relative to project costs (scores of GSC are already relative). A small margin
+        means that rounding of float64 donations could change the step. Funded projects are left out because
+        minimal transfer stops as soon as the project reaches its cost, so they are always just above it
+        
+        Args:
+            donations (numpy.ndarray | SparseDonations): donations of voters
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            support (numpy.ndarray): total donations to every project
+            costs (numpy.ndarray): cost of every project
+            current (numpy.ndarray): bool per project still considered
+            combination (str): key of COMBINATIONS
+        
+        Returns:
+            float: relative difference, 0 for exact ties and inf when there is no choice to make
+    """
+    (selection, transfer) = COMBINATIONS[combination]
+    if not current.any():
+        return np.inf
+    eligible = current & __eligible(selection, support, costs)
+    below = current & ~eligible
+    margins = [float(((costs - support) / costs)[below].min()) if below.any() else np.inf]
+    scores = __scores(selection, support, costs)
+    scales = np.ones_like(costs) if selection == 'GSC' else costs
+    if eligible.any():
+        margins.append(__closest(scores, scales, eligible, False))
+    elif transfer == 'EWT':
+        margins.append(__closest(support - costs, costs, current, True))
+    else:
+        reach = __reach(donations, weights)
+        margins.append(float((np.abs(reach - costs) / costs)[current].min()))
+        margins.append(__closest(scores, scales, current & (reach >= costs), False))
+    return min(margins)
+
+def __step(state, weights, support, costs, decision, ranks):
+    """
+        Make step of cstv chosen by __decide
+        
+        Args:
+            state (list): [donations, current, selected, eliminated, budget], changed in place
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            support (numpy.ndarray): total donations to every project before the step
+            costs (numpy.ndarray): cost of every project
+            decision (tuple): step from __decide
+            ranks (numpy.ndarray): position of every project in the set of projects cstv iterates
+        
+        Returns:
+            bool: False if cstv ended
+    """
+    (donations, current, selected, eliminated, _) = state
+    sparse = isinstance(donations, SparseDonations)
+    match decision:
+        case ('select', project):
+            excess = support[project] - costs[project]
+            if excess < 0:
+                # GSC eligibility rounded up to 1, cstv would pick the same project forever
+                raise RuntimeError('eligible project is below its cost, this can be due to floating point arithmetic')
+            if excess > 0.01:
+                gama = costs[project] / (excess + costs[project])
+                if sparse:
+                    __sparse_redistribute_excess(donations, project, gama)
+                else:
+                    __redistribute_excess(donations, project, gama)
+            elif sparse:
+                donations.values[donations.column_entries[project]] = 0
+            else:
+                donations[:, project] = 0
+            selected.append(project)
+            current[project] = False
+            # every round of cstv starts with the budget of donations left
+            state[4] = __budget(donations, weights)
+            return True
+        case ('eliminate', project):
+            if sparse:
+                __sparse_eliminate_with_transfer(donations, project, current, eliminated)
+            else:
+                __eliminate_with_transfer(donations, project, current, eliminated)
+            return True
+        case ('eliminate last', project):
+            current[project] = False
+            eliminated.append(project)
+            return False
+        case ('transfer', project):
+            if sparse:
+                return __sparse_minimal_transfer(donations, weights, costs, project, current, eliminated, ranks)
+            return __minimal_transfer(donations, weights, costs, project, current, eliminated, ranks)
+        case ('give up',) | ('stop',):
+            return False
+
+def __complete(state, weights, costs, projects, names, combination):
+    """
+        Add eliminated projects that fit in the budget of donations left at the start of the last round,
+        in the order cstv iterates its set of eliminated projects for EWT (reverse_eliminations) and
+        best first for MT (acceptance_of_under_supported_projects, ties by name)
+        
+        Args:
+            state (list): [donations, current, selected, eliminated, budget] after last step
+            weights (numpy.ndarray): number of voters of every row, None if every row is one voter
+            costs (numpy.ndarray): cost of every project
+            projects ([Project]): project of every column
+            names (numpy.ndarray): position of every project in order of names
+            combination (str): key of COMBINATIONS
+        
+        Returns:
+            [int]: columns of chosen projects in order of selection
+    """
+    (selection, transfer) = COMBINATIONS[combination]
+    (donations, _, selected, eliminated, budget) = state
+    chosen = list(selected)
+    if transfer == 'EWT':
+        # the set is built the same way as in cstv, so it is iterated in the same order
+        eliminated_projects = set()
+        for project in eliminated:
+            eliminated_projects.add(projects[project])
+        columns = {project: column for (column, project) in enumerate(projects)}
+        order = [columns[project] for project in eliminated_projects]
+    else:
+        scores = __scores(selection, __support(donations, weights), costs)
+        order = sorted(eliminated, key=lambda project: (-scores[project], names[project]))
+    for project in order:
+        if costs[project] <= budget:
+            chosen.append(project)
+            budget -= costs[project]
+    return chosen
+
+def shared_cstv(instance, profile, combinations, margins=None):
+    """
+        Run many versions of cstv together. All of them start from the same donations and share the state
+        as long as they make the same steps, it is copied only when their steps diverge,
+        so common rounds are calculated once. Every version chooses the same projects as dense_cstv.
+        Donations of SparseProfile are kept sparse, other profiles are made dense. Rows of profile with weights
+        (see merge_identical) stand for as many identical voters, their donations change the same way.
+        Exact profiles (see exact_profile) are run on gmpy2 fractions, only minimal transfers round them
+        (see __round_up and __round_taken)
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile | ArrayProfile): balanced profile, e.g. from balance_profile
+            combinations ([CSTV_Combination | str]): versions of cstv to use
+            margins (dict): filled with {combination name: smallest margin of its steps, see __margin} if given
+        
+        Returns:
+            tuple: ({combination name: BudgetAllocation}, (rounds made, rounds made by running versions separately))
+    """
+    names = list(dict.fromkeys(getattr(combination, 'name', combination) for combination in combinations))
+    if not isinstance(profile, (DenseProfile, SparseProfile)):
+        profile = dense_profile(instance, profile)
+    # columns follow the order cstv keeps donations of every voter in, so sums are added in the same order,
+    # profile keeps projects sorted by name, so the profile column is the position in order of names
+    projects = list(instance)
+    project_names = np.array([profile.index[project] for project in projects], dtype=np.intp)
+    positions = np.empty_like(project_names)
+    positions[project_names] = np.arange(len(projects))
+    # ties of elimination and minimal transfer go to the first project of the set of current projects
+    ranks = np.empty_like(project_names)
+    ranks[[positions[profile.index[project]] for project in set(instance)]] = np.arange(len(projects))
+    if isinstance(profile, SparseProfile):
+        donations = SparseDonations(profile, positions)
+    else:
+        donations = np.array(profile.matrix[:, project_names],
+                             dtype=object if profile.matrix.dtype == object else np.float64)
+    weights = getattr(profile, 'weights', None)
+    costs = profile.costs[project_names]
+    state = [donations, np.ones(len(costs), dtype=bool), [], [], __budget(donations, weights)]
+    groups = [(state, names)]
+    results = {}
+    rounds = 0
+    separate_rounds = 0
+    while groups:
+        (state, group) = groups.pop()
+        (donations, current, _, _, _) = state
+        support = __support(donations, weights)
+        branches = {}
+        for name in group:
+            decision = __decide(donations, weights, support, costs, current, name, project_names, ranks)
+            branches.setdefault(decision, []).append(name)
+            if margins is not None:
+                margins[name] = min(margins.get(name, np.inf), __margin(donations, weights, support, costs, current, name))
+        for (i, (decision, branch)) in enumerate(branches.items()):
+            if i < len(branches) - 1:
+                (donations, current, selected, eliminated, budget) = state
+                branch_state = [donations.copy(), current.copy(), list(selected), list(eliminated), budget]
+            else:
+                branch_state = state
+            if decision != ('stop',):
+                rounds += 1
+                separate_rounds += len(branch)
+            if __step(branch_state, weights, support, costs, decision, ranks):
+                groups.append((branch_state, branch))
+                continue
+            for name in branch:
+                results[name] = BudgetAllocation(projects[project] for project in
+                                                 __complete(branch_state, weights, costs, projects, project_names, name))
+    return (results, (rounds, separate_rounds))
+
+def dense_cstv(instance, profile, combination):
+    """
+        CSTV working on voters x projects matrix of donations, every step (support, eligibility, excess
+        redistribution, elimination and minimal transfers) is an array operation over the matrix,
+        or over stored votes only for SparseProfile.
+        It makes the same steps as pabutools.rules.cstv.cstv with the selection and eligibility test of the
+        combination (GS uses the test of GE), donations are added in the same order, so float64 profiles
+        with one voter per row choose the same projects. Ties are broken by name when choosing project to fund
+        and in acceptance of under-supported projects, and like cstv by the order of its sets of projects
+        otherwise
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile | ArrayProfile): balanced profile, e.g. from balance_profile
+            combination (CSTV_Combination | str): version of cstv to use
+        
+        Returns:
+            BudgetAllocation: chosen projects in order of selection
+    """
+    (results, _) = shared_cstv(instance, profile, [combination])
+    return results[getattr(combination, 'name', combination)]
+
+def verify(election_names, rule_names, instances_path=INSTANCES_PATH, results_path=RESULTS_PATH, sparse=False):
+    """
+        Compare projects chosen by dense_cstv with stored results of cstv rules
+        
+        Args:
+            election_names ([str]): names of elections
+            rule_names ([str]): names of cstv rules from utils.rules
+            instances_path (str): directory with election files
+            results_path (str): directory with results of all rules
+            sparse (bool): Should profiles be balanced to SparseProfile
+        
+        Returns:
+            tuple: ({rule name: (matching results, results in the same order, compared results)},
+                    [(election name, rule name, extra, missing, first step)], seconds spent in dense_cstv),
+                    results are stored in order of selection, so first step is the index of the first project
+                    chosen differently
+    """
+    counts = {rule_name: [0, 0, 0] for rule_name in rule_names}
+    mismatches = []
+    runtime = 0.0
+    for election_name in election_names:
+        (instance, raw_profile) = read_path(instances_path + "/" + election_name + ".pb")
+        profiles = {}
+        for (name, use_cost, rule) in rules:
+            if name not in counts:
+                continue
+            path = pathlib.Path(results_path).joinpath(name, election_name + ".json")
+            if not path.exists():
+                continue
+            with path.open('r', encoding=ENCODING) as f:
+                stored = [str(project) for project in json.load(f)]
+            try:
+                if use_cost not in profiles:
+                    (_, profiles[use_cost]) = balance_profile(instance, raw_profile, use_cost, use_cost, use_cost,
+                                                              not sparse, sparse)
+            except TypeError:
+                continue
+            start_time = time.perf_counter()
+            chosen = [project.name for project in dense_cstv(instance, profiles[use_cost], rule.combination)]
+            runtime += time.perf_counter() - start_time
+            counts[name][2] += 1
+            counts[name][1] += chosen == stored
+            if set(chosen) == set(stored):
+                counts[name][0] += 1
+            else:
+                step = next(step for step, (a, b) in enumerate(zip(chosen + [None], stored + [None])) if a != b)
+                mismatches.append((election_name, name, sorted(set(chosen) - set(stored)),
+                                   sorted(set(stored) - set(chosen)), step))
+    return ({name: tuple(count) for name, count in counts.items()}, mismatches, runtime)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare dense_cstv with stored results of cstv rules')
+    parser.add_argument('--glob', action='append', default=[], metavar='PATTERN', help='instance name pattern')
+    parser.add_argument('--regex', action='append', default=[], metavar='REGEX', help='instance name regex')
+    parser.add_argument('--preset', action='append', default=[], choices=sorted(SAMPLE_PRESETS), help='preset of instances')
+    parser.add_argument('--rule', action='append', default=[], metavar='RULE',
+                        choices=[name for (name, _, rule) in rules if rule not in greedy_rules], help='cstv rule to compare')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    parser.add_argument('--results', default=RESULTS_PATH, help='directory with results of all rules')
+    parser.add_argument('--sparse', action='store_true', help='run on sparse profiles')
+    args = parser.parse_args()
+
+    election_names = sorted(p.stem for p in pathlib.Path(args.instances).glob('*.pb'))
+    election_names = filter_instances(election_names, args.glob, args.regex, args.preset)
+    rule_names = [name for (name, _, rule) in rules if rule not in greedy_rules and (not args.rule or name in args.rule)]
+    (counts, mismatches, runtime) = verify(election_names, rule_names, args.instances, args.results, args.sparse)
+    for (election_name, name, extra, missing, step) in mismatches:
+        print(f'{election_name} {name}\n  extra: {extra}\n  missing: {missing}\n  first different project: {step + 1}')
+    for name, (matching, ordered, compared) in counts.items():
+        print(f'{name}\n  identical: {matching} of {compared}\n  in the same order: {ordered} of {compared}')
+    print(f'mismatches: {len(mismatches)}')
+    print(f'dense_cstv time: {runtime:.3f}s')
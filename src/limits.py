@@ -0,0 +1,119 @@
+import contextlib
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+
+# {family: (wall-clock limit in seconds, RSS limit in bytes)}, None means no limit
+DEFAULT_LIMITS = {
+    'greedy': (600.0, 8 * 1024 ** 3),
+    'cstv': (3 * 3600.0, 8 * 1024 ** 3),
+}
+# How often the watchdog checks elapsed time and RSS, in seconds
+POLL_INTERVAL = 0.5
+
+class LimitExceeded(Exception):
+    """
+        Raised inside guarded code when it runs out of time or memory
+        
+        Attributes:
+            status (str): 'timeout' or 'oom'
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def current_rss():
+    """
+        Get resident set size of current process,
+        peak RSS is used on systems without /proc
+        
+        Returns:
+            int: bytes
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def parse_limits(timeouts, max_rss):
+    """
+        Build limits per rule family from command line values
+        
+        Args:
+            timeouts ([str]): entries 'family=seconds', 0 means no limit
+            max_rss ([str]): entries 'family=megabytes', 0 means no limit
+        
+        Returns:
+            dict: {family: (seconds, bytes)}
+    """
+    limits = {family: list(limit) for family, limit in DEFAULT_LIMITS.items()}
+    for position, entries, scale in [(0, timeouts, 1.0), (1, max_rss, 1024 ** 2)]:
+        for entry in entries:
+            (family, _, value) = entry.partition('=')
+            if family not in limits or not value:
+                raise ValueError(f'expected family=value with family in {sorted(limits)}, got {entry!r}')
+            value = float(value) * scale
+            limits[family][position] = value if value > 0 else None
+    return {family: tuple(limit) for family, limit in limits.items()}
+
+@contextlib.contextmanager
+def guard(timeout=None, max_rss=None):
+    """
+        Interrupt code in the with block once it runs longer than timeout
+        or RSS of the process grows over max_rss, LimitExceeded is raised inside the block.
+        The block is interrupted between Python bytecodes, so a single long call into
+        native code is only stopped after it returns. MemoryError is reported as 'oom' as well.
+        Must be entered from the main thread.
+        
+        Args:
+            timeout (float): wall-clock limit in seconds, None means no limit
+            max_rss (int): RSS limit in bytes, None means no limit
+        
+        Yields:
+            None
+    """
+    if timeout is None and max_rss is None:
+        try:
+            yield
+        except MemoryError as e:
+            raise LimitExceeded('oom', 'out of memory') from e
+        return
+    breach = []
+    stop = threading.Event()
+    main_thread = threading.main_thread().ident
+    start_time = time.monotonic()
+
+    def on_signal(signum, frame):
+        # the block may finish while the signal is on its way, it must not raise outside of it
+        if breach and not stop.is_set():
+            raise LimitExceeded(*breach)
+
+    def watch():
+        while not stop.wait(POLL_INTERVAL):
+            elapsed = time.monotonic() - start_time
+            if timeout is not None and elapsed > timeout:
+                breach.extend(['timeout', f'exceeded {timeout:.0f}s'])
+            elif max_rss is not None and current_rss() > max_rss:
+                breach.extend(['oom', f'exceeded {max_rss / 1024 ** 2:.0f}MB RSS'])
+            else:
+                continue
+            signal.pthread_kill(main_thread, signal.SIGUSR1)
+            return
+
+    old_handler = signal.signal(signal.SIGUSR1, on_signal)
+    watchdog = threading.Thread(target=watch, daemon=True)
+    watchdog.start()
+    try:
+        yield
+        stop.set()
+    except MemoryError as e:
+        raise LimitExceeded('oom', 'out of memory') from e
+    finally:
+        stop.set()
+        watchdog.join()
+        signal.signal(signal.SIGUSR1, old_handler)
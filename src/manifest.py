@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import inspect
+import json
+import pathlib
+import sqlite3
+import sys
+import time
+
+import dense_cstv
+import utils
+from utils import rules, greedy_rules, balance_profile, project_support, greedy_all, PABUTOOLS_VERSION, ENCODING, INSTANCES_PATH, RESULTS_PATH
+
+MANIFEST_NAME = "manifest.sqlite"
+# Statuses of results stopped by time or memory limits, they are not retried unless asked to
+LIMITED_STATUSES = ('timeout', 'oom')
+
+def connect(results_path):
+    """
+        Open manifest of results stored in results_path, creating it if needed
+        
+        Args:
+            results_path (str): directory with results of all rules
+        
+        Returns:
+            sqlite3.Connection
+    """
+    pathlib.Path(results_path).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(pathlib.Path(results_path).joinpath(MANIFEST_NAME), timeout=60)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS results (
+            instance TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            input_hash TEXT NOT NULL,
+            rule_version TEXT NOT NULL,
+            runtime REAL,
+            output_hash TEXT,
+            status TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (instance, rule)
+        )''')
+    create_inputs(conn)
+    conn.commit()
+    return conn
+
+def create_inputs(conn):
+    """
+        Create table of election file hashes used by input_hash, creating it if needed
+        
+        Args:
+            conn (sqlite3.Connection): database to create table in
+        
+        Returns:
+            None
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inputs (
+            instance TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            input_hash TEXT NOT NULL
+        )''')
+
+def input_hash(conn, instances_path, election_name):
+    """
+        Get SHA-256 of election file, file is only rehashed when its size or modification time changed
+        
+        Args:
+            conn (sqlite3.Connection): manifest or other database with inputs table
+            instances_path (str): directory with election files
+            election_name (str): name of election
+        
+        Returns:
+            str: hex digest
+    """
+    path = pathlib.Path(instances_path).joinpath(election_name + ".pb")
+    stat = path.stat()
+    row = conn.execute('SELECT size, mtime_ns, input_hash FROM inputs WHERE instance = ?', (election_name,)).fetchone()
+    if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        return row[2]
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    conn.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)',
+                 (election_name, stat.st_size, stat.st_mtime_ns, digest))
+    return digest
+
+def rule_version(rule_id):
+    """
+        Get version of rule, made from source code of everything the result depends on
+        
+        Args:
+            rule_id(int): number of entry in utils.rules
+        
+        Returns:
+            str: hex digest
+    """
+    (name, use_cost, rule) = rules[rule_id]
+    sources = [PABUTOOLS_VERSION, str(use_cost), inspect.getsource(balance_profile)]
+    array_backed = rule in greedy_rules or utils.DENSE_CSTV
+    if array_backed:
+        sources += [inspect.getsource(f) for f in (utils.ArrayProfile, utils.DenseProfile, utils.dense_profile,
+                                                    getattr(utils, '__project_costs'))]
+    if utils.SPARSE_PROFILES and array_backed:
+        sources += [inspect.getsource(utils.SparseProfile), inspect.getsource(getattr(utils, '__sparse_from_entries'))]
+    if utils.MERGE_BALLOTS and array_backed:
+        sources += [inspect.getsource(utils.merge_identical)]
+    if rule in greedy_rules:
+        sources += [inspect.getsource(f) for f in (rule, project_support, greedy_all, getattr(utils, '__greedy_select'))]
+    else:
+        sources += [inspect.getsource(rule)]
+        sources += [repr(cell.cell_contents) for cell in rule.__closure__ or ()]
+        if utils.DENSE_CSTV:
+            sources += [inspect.getsource(dense_cstv)]
+        else:
+            sources += [inspect.getsource(inspect.getmodule(utils.cstv))]
+    return hashlib.sha256('\0'.join(sources).encode()).hexdigest()[:16]
+
+def output_hash(res):
+    """
+        Get hash of set of chosen projects
+        
+        Args:
+            res ([str]): names of chosen projects
+        
+        Returns:
+            str: hex digest
+    """
+    return hashlib.sha256(json.dumps(sorted(res)).encode()).hexdigest()[:16]
+
+def record(conn, election_name, rule_name, election_hash, version, runtime, res_hash, status='ok'):
+    """
+        Save information about calculated result
+        
+        Args:
+            conn (sqlite3.Connection): manifest
+            election_name (str): name of election
+            rule_name (str): name of rule
+            election_hash (str): hash of election file
+            version (str): version of rule
+            runtime (float): runtime of rule in seconds
+            res_hash (str): hash of chosen projects
+            status (str): status of calculation
+        
+        Returns:
+            None
+    """
+    conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                 (election_name, rule_name, election_hash, version, runtime, res_hash, status, time.time()))
+
+def stale_rules(conn, election_name, rule_ids, election_hash, versions, results_path, retry_statuses=()):
+    """
+        Find rules whose results are missing or were made from other election file or rule version,
+        results made before the manifest existed are adopted once if their file is not empty and no other
+        result of the rule was recorded with another version, otherwise they may come from older code
+        
+        Args:
+            conn (sqlite3.Connection): manifest
+            election_name (str): name of election
+            rule_ids([int]): numbers of entries in utils.rules to check
+            election_hash (str): hash of election file
+            versions (dict): {rule id: rule version}
+            results_path (str): directory with results of all rules
+            retry_statuses ([str]): statuses treated as stale even if up to date, e.g. LIMITED_STATUSES
+        
+        Returns:
+            [int]: rule ids to calculate
+    """
+    recorded = {
+        rule_name: (row_hash, row_version, status)
+        for (rule_name, row_hash, row_version, status) in conn.execute(
+            'SELECT rule, input_hash, rule_version, status FROM results WHERE instance = ?', (election_name,))
+    }
+    stale = []
+    for rule_id in rule_ids:
+        rule_name = rules[rule_id][0]
+        if rule_name in recorded:
+            (row_hash, row_version, status) = recorded[rule_name]
+            if (row_hash, row_version) != (election_hash, versions[rule_id]) or status in retry_statuses:
+                stale.append(rule_id)
+            continue
+        res = __read_result(results_path, rule_name, election_name)
+        if res and not __rule_changed(conn, rule_name, versions[rule_id]):
+            record(conn, election_name, rule_name, election_hash, versions[rule_id], None, output_hash(res), 'adopted')
+        else:
+            stale.append(rule_id)
+    return stale
+
+def __rule_changed(conn, rule_name, version):
+    """
+        Check if manifest has results of rule made by other version of it
+        
+        Args:
+            conn (sqlite3.Connection): manifest
+            rule_name (str): name of rule
+            version (str): current version of rule
+        
+        Returns:
+            bool
+    """
+    return conn.execute('SELECT 1 FROM results WHERE rule = ? AND rule_version != ? LIMIT 1',
+                        (rule_name, version)).fetchone() is not None
+
+def __read_result(results_path, rule_name, election_name):
+    """
+        Read stored result, missing or broken files are treated as empty
+        
+        Args:
+            results_path (str): directory with results of all rules
+            rule_name (str): name of rule
+            election_name (str): name of election
+        
+        Returns:
+            [str]: names of chosen projects
+    """
+    path = pathlib.Path(results_path).joinpath(rule_name, election_name + ".json")
+    try:
+        with path.open('r', encoding=ENCODING) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def load_runtimes(conn):
+    """
+        Load runtimes recorded by earlier runs
+        
+        Args:
+            conn (sqlite3.Connection): manifest
+        
+        Returns:
+            dict: {election name: {rule name: seconds}}
+    """
+    runtimes = {}
+    for (election_name, rule_name, runtime) in conn.execute(
+            'SELECT instance, rule, runtime FROM results WHERE runtime IS NOT NULL'):
+        runtimes.setdefault(election_name, {})[rule_name] = runtime
+    return runtimes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query manifest of calculated election results')
+    parser.add_argument('--results', default=RESULTS_PATH, help='directory with results of all rules')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    # rule versions depend on the engine, so status and stale take the flags results were calculated with
+    parser.add_argument('--dense-cstv', action='store_true',
+                        help='compare with versions of cstv rules run with dense_cstv instead of pabutools cstv')
+    parser.add_argument('--shared-cstv', action='store_true',
+                        help='compare with versions of cstv rules run together (implies --dense-cstv)')
+    parser.add_argument('--sparse', action='store_true',
+                        help='compare with versions of rules run on profiles keeping only votes voters gave')
+    parser.add_argument('--merge', action='store_true',
+                        help='compare with versions of rules run on profiles with identical ballots merged')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='count up to date and stale results per rule')
+    stale_parser = subparsers.add_parser('stale', help='list stale (instance, rule) pairs')
+    stale_parser.add_argument('--rule', action='append', help='only show given rule, can be repeated')
+    show_parser = subparsers.add_parser('show', help='show recorded results of instance')
+    show_parser.add_argument('instance')
+    slowest_parser = subparsers.add_parser('slowest', help='list slowest recorded results')
+    slowest_parser.add_argument('-n', type=int, default=20)
+    args = parser.parse_args()
+
+    utils.DENSE_CSTV = args.dense_cstv or args.shared_cstv
+    utils.SHARED_CSTV = args.shared_cstv
+    utils.SPARSE_PROFILES = args.sparse
+    utils.MERGE_BALLOTS = args.merge
+    conn = connect(args.results)
+    if args.command == 'show':
+        rows = conn.execute('SELECT rule, input_hash, rule_version, runtime, output_hash, status, updated_at '
+                            'FROM results WHERE instance = ? ORDER BY rule', (args.instance,)).fetchall()
+        if not rows:
+            sys.exit(f'no results recorded for {args.instance}')
+        for (rule_name, row_hash, version, runtime, res_hash, status, updated_at) in rows:
+            runtime = 'unknown' if runtime is None else f'{runtime:.3f}s'
+            print(f'{rule_name}\n  status: {status}\n  input: {row_hash[:16]}\n  rule version: {version}\n'
+                  f'  runtime: {runtime}\n  output: {res_hash}\n  updated: {time.ctime(updated_at)}')
+    elif args.command == 'slowest':
+        for (election_name, rule_name, runtime) in conn.execute(
+                'SELECT instance, rule, runtime FROM results WHERE runtime IS NOT NULL ORDER BY runtime DESC LIMIT ?', (args.n,)):
+            print(f'{runtime:10.3f}s  {election_name} {rule_name}')
+    else:
+        versions = {rule_id: rule_version(rule_id) for rule_id in range(len(rules))}
+        rule_ids = [rule_id for rule_id in range(len(rules))
+                    if args.command == 'status' or not args.rule or rules[rule_id][0] in args.rule]
+        counts = {rules[rule_id][0]: [0, 0] for rule_id in rule_ids}
+        limited = {rules[rule_id][0]: {status: 0 for status in LIMITED_STATUSES} for rule_id in rule_ids}
+        recorded = {}
+        for (election_name, rule_name, row_hash, version, status) in conn.execute(
+                'SELECT instance, rule, input_hash, rule_version, status FROM results'):
+            recorded[(election_name, rule_name)] = (row_hash, version, status)
+        for path in sorted(pathlib.Path(args.instances).glob('*.pb')):
+            election_hash = input_hash(conn, args.instances, path.stem)
+            for rule_id in rule_ids:
+                rule_name = rules[rule_id][0]
+                (row_hash, version, status) = recorded.get((path.stem, rule_name), (None, None, None))
+                if (row_hash, version) == (election_hash, versions[rule_id]):
+                    counts[rule_name][0] += 1
+                    if status in LIMITED_STATUSES:
+                        limited[rule_name][status] += 1
+                else:
+                    counts[rule_name][1] += 1
+                    if args.command == 'stale':
+                        print(f'{path.stem} {rule_name}')
+        conn.commit()
+        if args.command == 'status':
+            for rule_name, (up_to_date, stale) in counts.items():
+                print(f'{rule_name}\n  up to date: {up_to_date}\n  stale: {stale}\n'
+                      f'  timed out: {limited[rule_name]["timeout"]}\n  out of memory: {limited[rule_name]["oom"]}')
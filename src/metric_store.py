@@ -0,0 +1,251 @@
+import argparse
+import csv
+import hashlib
+import json
+import pathlib
+import sqlite3
+import time
+
+from manifest import create_inputs, output_hash
+from utils import ROOT_PATH, ENCODING
+
+STORE_PATH = str(ROOT_PATH.joinpath("metrics.sqlite"))
+# Columns of exported metrics table, one row per (instance, rule, metric)
+EXPORT_FIELDS = ['instance', 'ballot_type', 'voters', 'projects', 'rule', 'metric', 'value']
+
+def connect(store_path=STORE_PATH):
+    """
+        Open store of calculated metrics, creating it if needed
+        
+        Args:
+            store_path (str): path to store
+        
+        Returns:
+            sqlite3.Connection
+    """
+    pathlib.Path(store_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(store_path, timeout=60)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS metrics (
+            instance TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value REAL,
+            input_hash TEXT NOT NULL,
+            result_hash TEXT NOT NULL,
+            metric_version TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (instance, rule, metric)
+        )''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS elections (
+            instance TEXT PRIMARY KEY,
+            input_hash TEXT NOT NULL,
+            ballot_type TEXT,
+            voters INTEGER NOT NULL,
+            projects INTEGER NOT NULL
+        )''')
+    create_inputs(conn)
+    conn.commit()
+    return conn
+
+def result_hash(results_path, rule_name, election_name):
+    """
+        Get hash of stored result the same way manifest does
+        
+        Args:
+            results_path (str): directory with results of all rules
+            rule_name (str): name of rule
+            election_name (str): name of election
+        
+        Returns:
+            str: hex digest, None if result is missing or broken
+    """
+    path = pathlib.Path(results_path).joinpath(rule_name, election_name + ".json")
+    try:
+        with path.open('r', encoding=ENCODING) as f:
+            return output_hash(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+def combined_hash(hashes):
+    """
+        Combine hashes of all results a metric value depends on
+        
+        Args:
+            hashes ([str]): hex digests
+        
+        Returns:
+            str: hex digest
+    """
+    return hashlib.sha256('\0'.join(hashes).encode()).hexdigest()[:16]
+
+def election(conn, election_name, election_hash):
+    """
+        Get stored description of election
+        
+        Args:
+            conn (sqlite3.Connection): store
+            election_name (str): name of election
+            election_hash (str): hash of election file
+        
+        Returns:
+            tuple: (ballot type, voters, projects), None if election is not stored or its file changed
+    """
+    row = conn.execute('SELECT input_hash, ballot_type, voters, projects FROM elections WHERE instance = ?',
+                       (election_name,)).fetchone()
+    if row is None or row[0] != election_hash:
+        return None
+    return row[1:]
+
+def record_election(conn, election_name, election_hash, ballot_type, voters, projects):
+    """
+        Save description of election, used to group it on plots
+        
+        Args:
+            conn (sqlite3.Connection): store
+            election_name (str): name of election
+            election_hash (str): hash of election file
+            ballot_type (str): kind of ballots, None if election is not analysed
+            voters (int): number of voters
+            projects (int): number of projects
+        
+        Returns:
+            None
+    """
+    conn.execute('INSERT OR REPLACE INTO elections VALUES (?, ?, ?, ?, ?)',
+                 (election_name, election_hash, ballot_type, voters, projects))
+
+def stale_metrics(conn, election_name, election_hash, metric_names, dependencies, version):
+    """
+        Find metrics with a value that is missing or was calculated from other election file,
+        other results or other version of metrics, or with a value of result that no longer exists
+        
+        Args:
+            conn (sqlite3.Connection): store
+            election_name (str): name of election
+            election_hash (str): hash of election file
+            metric_names ([str]): names of metrics to check
+            dependencies (dict): {(rule name, metric name): combined hash of results value depends on}
+            version (str): version of metrics
+        
+        Returns:
+            set: names of metrics to calculate
+    """
+    recorded = {
+        (rule_name, metric_name): (row_input, row_result, row_version)
+        for (rule_name, metric_name, row_input, row_result, row_version) in conn.execute(
+            'SELECT rule, metric, input_hash, result_hash, metric_version FROM metrics WHERE instance = ?',
+            (election_name,))
+    }
+    stale = {
+        metric_name for (rule_name, metric_name), dependency in dependencies.items()
+        if recorded.get((rule_name, metric_name)) != (election_hash, dependency, version)
+    }
+    stale.update(metric_name for (rule_name, metric_name) in recorded
+                 if metric_name in metric_names and (rule_name, metric_name) not in dependencies)
+    return stale
+
+def record(conn, election_name, election_hash, metric_name, values, dependencies, version):
+    """
+        Replace all values of metric on election, rules missing from values are removed
+        
+        Args:
+            conn (sqlite3.Connection): store
+            election_name (str): name of election
+            election_hash (str): hash of election file
+            metric_name (str): name of metric
+            values (dict): {rule name: value}, None for values left out of plots
+            dependencies (dict): {(rule name, metric name): combined hash of results value depends on}
+            version (str): version of metrics
+        
+        Returns:
+            None
+    """
+    conn.execute('DELETE FROM metrics WHERE instance = ? AND metric = ?', (election_name, metric_name))
+    updated_at = time.time()
+    conn.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        (election_name, rule_name, metric_name, value, election_hash,
+         dependencies[(rule_name, metric_name)], version, updated_at)
+        for rule_name, value in values.items()
+    ])
+
+def prune(conn, election_names):
+    """
+        Remove elections that are no longer in instances directory
+        
+        Args:
+            conn (sqlite3.Connection): store
+            election_names ([str]): names of all current elections
+        
+        Returns:
+            int: number of removed elections
+    """
+    current = set(election_names)
+    removed = [name for (name,) in conn.execute('SELECT instance FROM elections') if name not in current]
+    for table in ('metrics', 'elections', 'inputs'):
+        conn.executemany(f'DELETE FROM {table} WHERE instance = ?', [(name,) for name in removed])
+    return len(removed)
+
+def load(conn, metric_name=None):
+    """
+        Read stored values together with description of their elections
+        
+        Args:
+            conn (sqlite3.Connection): store
+            metric_name (str): only read given metric, None reads all
+        
+        Returns:
+            [dict]: rows with EXPORT_FIELDS, ordered by instance, metric and rule
+    """
+    query = ('SELECT m.instance, e.ballot_type, e.voters, e.projects, m.rule, m.metric, m.value '
+             'FROM metrics m JOIN elections e ON e.instance = m.instance AND e.input_hash = m.input_hash')
+    params = ()
+    if metric_name is not None:
+        query += ' WHERE m.metric = ?'
+        params = (metric_name,)
+    query += ' ORDER BY m.instance, m.metric, m.rule'
+    return [dict(zip(EXPORT_FIELDS, row)) for row in conn.execute(query, params)]
+
+def export(conn, path):
+    """
+        Write all stored values to CSV file
+        
+        Args:
+            conn (sqlite3.Connection): store
+            path (str): path to CSV file
+        
+        Returns:
+            int: number of written rows
+    """
+    rows = load(conn)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query store of calculated metrics')
+    parser.add_argument('--store', default=STORE_PATH, help='path to metric store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='count stored values per metric')
+    show_parser = subparsers.add_parser('show', help='show stored values of instance')
+    show_parser.add_argument('instance')
+    export_parser = subparsers.add_parser('export', help='write all stored values to CSV file')
+    export_parser.add_argument('path')
+    args = parser.parse_args()
+
+    conn = connect(args.store)
+    if args.command == 'show':
+        for row in load(conn):
+            if row['instance'] == args.instance:
+                print(f'{row["metric"]} - {row["rule"]}: {row["value"]}')
+    elif args.command == 'export':
+        print(f'{export(conn, args.path)} rows written to {args.path}')
+    else:
+        for (metric_name, instances, values, excluded) in conn.execute(
+                'SELECT metric, COUNT(DISTINCT instance), COUNT(*), COUNT(*) - COUNT(value) '
+                'FROM metrics GROUP BY metric ORDER BY metric'):
+            print(f'{metric_name}\n  instances: {instances}\n  values: {values}\n  left out of plots: {excluded}')
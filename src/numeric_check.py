@@ -0,0 +1,198 @@
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+from dense_cstv import shared_cstv
+from limits import guard, LimitExceeded
+from manifest import LIMITED_STATUSES
+from utils import (
+    INSTANCES_PATH,
+    SAMPLE_PRESETS,
+    balance_profile,
+    filter_instances,
+    greedy_all,
+    greedy_rules,
+    project_support,
+    read_path,
+    rules
+)
+
+# Rules whose closest step is nearer to a tie than this are rerun with exact fractions
+EPSILON = 1e-9
+# Fractions of cstv donations get longer with every round, so exact reruns get a wall-clock limit in seconds
+EXACT_TIMEOUT = 600
+
+def greedy_margins(instance, profile):
+    """
+        Get how close greedy rules are to a tie, as the smallest difference between scores of projects
+        next to each other in order of scores, relative to project costs (scores of GSC are already relative),
+        or between the cost of a project and the budget left when greedy order reaches it, relative to the cost
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile | ArrayProfile): balanced profile, e.g. from balance_profile
+        
+        Returns:
+            dict: {'GS': float, 'GSC': float, 'GE': float}, inf for elections with one project that does not
+            cost the whole budget
+    """
+    (projects, support) = project_support(instance, profile)
+    costs = np.array([float(p.cost) for p in projects], dtype=np.float64)
+    margins = {}
+    for (name, scores, scales) in [('GS', support, costs), ('GSC', support / costs, np.ones_like(costs)),
+                                   ('GE', support - costs, costs)]:
+        order = np.argsort(-scores, kind='stable')
+        (scores, scales) = (scores[order], scales[order])
+        gaps = np.abs(np.diff(scores)) / np.maximum(scales[1:], scales[:-1])
+        margins[name] = float(gaps.min()) if len(gaps) > 0 else np.inf
+        budget = float(instance.budget_limit)
+        for cost in costs[order]:
+            margins[name] = min(margins[name], float(abs(budget - cost) / cost))
+            if cost <= budget:
+                budget -= cost
+    return margins
+
+def __run_rules(instance, profile, names, margins=None):
+    """
+        Run rules on balanced profile, greedy rules share one support computation and cstv rules
+        are run together by shared_cstv
+        
+        Args:
+            instance (Instance): instance of election
+            profile (ArrayProfile): balanced profile of float64 or exact backend
+            names ({str: function}): rules from utils.rules of the same cost setting by name
+            margins (dict): filled with {rule name: margin} if given, see greedy_margins and shared_cstv
+        
+        Returns:
+            dict: {rule name: set of names of chosen projects, 'error' if minimal transfer did not converge}
+    """
+    results = {}
+    greedy = {name: greedy_rules[rule] for name, rule in names.items() if rule in greedy_rules}
+    if greedy:
+        chosen = greedy_all(instance, profile)
+        kinds = greedy_margins(instance, profile) if margins is not None else {}
+        for name, kind in greedy.items():
+            results[name] = {project.name for project in chosen[kind]}
+            if margins is not None:
+                margins[name] = kinds[kind]
+    combinations = {name: rule.combination.name for name, rule in names.items() if rule not in greedy_rules}
+    if combinations:
+        cstv_margins = {} if margins is not None else None
+        try:
+            (chosen, _) = shared_cstv(instance, profile, list(combinations.values()), cstv_margins)
+        except RuntimeError:
+            # minimal transfer did not converge, which may be caused by rounding, so the rules count as ties
+            chosen = {}
+        for name, combination in combinations.items():
+            results[name] = {project.name for project in chosen[combination]} if combination in chosen else 'error'
+            if margins is not None:
+                margins[name] = cstv_margins[combination] if combination in chosen else 0.0
+    return results
+
+def check_election(instance, profile, rule_names, epsilon=EPSILON, timeout=EXACT_TIMEOUT):
+    """
+        Run rules of an election with the float64 backend and rerun the ones whose closest step is within epsilon
+        of a tie with the exact backend, where votes are balanced and donations are moved with gmpy2 fractions
+        
+        Args:
+            instance (Instance): instance of election
+            profile (Profile): profile of election
+            rule_names ([str]): names of rules from utils.rules
+            epsilon (float): largest margin treated as a near tie
+            timeout (float): wall-clock limit of exact rerun of cstv rules of every cost setting in seconds, None means no limit
+        
+        Returns:
+            [(str, float, set(str) | str, set(str) | str)]: (rule name, margin, float64 result, exact result)
+            of every near tie, results of rules that failed are 'error', 'timeout' or 'oom'
+    """
+    near_ties = []
+    for use_cost in (True, False):
+        names = {name: rule for (name, cost, rule) in rules if cost == use_cost and name in rule_names}
+        if not names:
+            continue
+        (_, fast_profile) = balance_profile(instance, profile, use_cost, use_cost, use_cost, True)
+        margins = {}
+        fast = __run_rules(instance, fast_profile, names, margins)
+        tied = {name: rule for name, rule in names.items() if margins[name] < epsilon}
+        if not tied:
+            continue
+        (_, exact_profile) = balance_profile(instance, profile, use_cost, use_cost, use_cost, exact=True)
+        exact = __run_rules(instance, exact_profile, {name: rule for name, rule in tied.items() if rule in greedy_rules})
+        tied_cstv = {name: rule for name, rule in tied.items() if name not in exact}
+        if tied_cstv:
+            try:
+                with guard(timeout):
+                    exact.update(__run_rules(instance, exact_profile, tied_cstv))
+            except LimitExceeded as e:
+                exact.update({name: e.status for name in tied_cstv})
+        near_ties.extend((name, margins[name], fast[name], exact[name]) for name in tied)
+    return near_ties
+
+def verify(election_names, rule_names, instances_path=INSTANCES_PATH, epsilon=EPSILON, timeout=EXACT_TIMEOUT):
+    """
+        Compare projects chosen by float64 and exact backends on elections with near ties
+        
+        Args:
+            election_names ([str]): names of elections
+            rule_names ([str]): names of rules from utils.rules
+            instances_path (str): directory with election files
+            epsilon (float): largest margin treated as a near tie
+            timeout (float): wall-clock limit of exact rerun of cstv rules of every cost setting in seconds, None means no limit
+        
+        Returns:
+            tuple: ([(election name, rule name, margin, float64 result, exact result)], elections checked,
+                    seconds spent on elections with near ties)
+    """
+    near_ties = []
+    checked = 0
+    runtime = 0.0
+    for election_name in election_names:
+        (instance, profile) = read_path(instances_path + "/" + election_name + ".pb")
+        start_time = time.perf_counter()
+        try:
+            ties = check_election(instance, profile, rule_names, epsilon, timeout)
+        except TypeError:
+            continue
+        checked += 1
+        if ties:
+            runtime += time.perf_counter() - start_time
+        near_ties.extend((election_name, *tie) for tie in ties)
+    return (near_ties, checked, runtime)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rerun near ties of float64 rules with exact fractions and report differences')
+    parser.add_argument('--glob', action='append', default=[], metavar='PATTERN', help='instance name pattern')
+    parser.add_argument('--regex', action='append', default=[], metavar='REGEX', help='instance name regex')
+    parser.add_argument('--preset', action='append', default=[], choices=sorted(SAMPLE_PRESETS), help='preset of instances')
+    parser.add_argument('--rule', action='append', default=[], metavar='RULE', choices=[name for name, _, _ in rules],
+                        help='rule to check')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    parser.add_argument('--epsilon', type=float, default=EPSILON, help='largest relative margin treated as a near tie')
+    parser.add_argument('--timeout', type=float, default=EXACT_TIMEOUT,
+                        help='wall-clock limit of exact rerun of cstv rules of an election and cost setting in seconds, 0 disables it')
+    args = parser.parse_args()
+
+    election_names = sorted(p.stem for p in pathlib.Path(args.instances).glob('*.pb'))
+    election_names = filter_instances(election_names, args.glob, args.regex, args.preset)
+    rule_names = [name for (name, _, _) in rules if not args.rule or name in args.rule]
+    (near_ties, checked, runtime) = verify(election_names, rule_names, args.instances, args.epsilon, args.timeout or None)
+    # near ties whose exact rerun did not finish are not known to be fine, so they fail the check like differences
+    failures = 0
+    for (election_name, name, margin, fast, exact) in near_ties:
+        print(f'{election_name} {name}\n  margin: {margin:.3g}')
+        if exact in LIMITED_STATUSES:
+            failures += 1
+            print(f'  exact: {exact}')
+        elif isinstance(fast, str) or isinstance(exact, str):
+            failures += fast != exact
+            print(f'  float: {fast if isinstance(fast, str) else "ok"}\n  exact: {exact if isinstance(exact, str) else "ok"}')
+        elif fast != exact:
+            failures += 1
+            print(f'  float only: {sorted(fast - exact)}\n  exact only: {sorted(exact - fast)}')
+    print(f'elections: {checked}\n  near ties: {len(near_ties)}\n  failures: {failures}\n'
+          f'  time of near ties: {runtime:.3f}s')
+    sys.exit(1 if failures else 0)
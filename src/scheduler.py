@@ -0,0 +1,153 @@
+import statistics
+
+from utils import rules, rule_family, ENCODING
+
+# Seconds per unit of estimated work, used for families without recorded runtimes
+DEFAULT_SECONDS_PER_UNIT = {
+    'greedy': 1e-9,
+    'cstv': 1e-6,
+}
+
+def instance_size(path):
+    """
+        Get number of voters and projects of election from META section without parsing it
+        
+        Args:
+            path (str): path to election file
+        
+        Returns:
+            tuple: (voters, projects)
+    """
+    meta = {}
+    section = ""
+    projects = 0
+    voters = 0
+    with open(path, 'r', encoding=ENCODING) as f:
+        for line in f:
+            row = line.strip().split(';')
+            if row[0].strip().lower() in ["meta", "projects", "votes"]:
+                section = row[0].strip().lower()
+                next(f)
+            elif section == "meta" and len(row) > 1:
+                meta[row[0].strip()] = row[1].strip()
+                if "num_votes" in meta and "num_projects" in meta:
+                    return (int(meta["num_votes"]), int(meta["num_projects"]))
+            elif section == "projects" and row[0]:
+                projects += 1
+            elif section == "votes" and row[0]:
+                voters += 1
+    return (voters, projects)
+
+def estimate_work(voters, projects, family):
+    """
+        Estimate amount of work needed by rule, greedy rules go over the profile once
+        and cstv goes over it once per round
+        
+        Args:
+            voters (int): number of voters
+            projects (int): number of projects
+            family (str): 'greedy' or 'cstv'
+        
+        Returns:
+            int: units of work
+    """
+    if family == 'greedy':
+        return voters * projects
+    return voters * projects * projects
+
+def seconds_per_unit(runtimes, sizes):
+    """
+        Fit speed of every rule family to recorded runtimes
+        
+        Args:
+            runtimes (dict): {election name: {rule name: seconds}}
+            sizes (dict): {election name: (voters, projects)}
+        
+        Returns:
+            dict: {family: seconds per unit of work}
+    """
+    ratios = {family: [] for family in DEFAULT_SECONDS_PER_UNIT}
+    for rule_id, (name, _, _) in enumerate(rules):
+        family = rule_family(rule_id)
+        for election_name, rule_runtimes in runtimes.items():
+            if name in rule_runtimes and election_name in sizes:
+                work = estimate_work(*sizes[election_name], family)
+                if work > 0:
+                    ratios[family].append(rule_runtimes[name] / work)
+    return {
+        family: statistics.median(ratios[family]) if ratios[family] else DEFAULT_SECONDS_PER_UNIT[family]
+        for family in ratios
+    }
+
+def predict(election_name, rule_ids, sizes, runtimes, rates):
+    """
+        Predict runtime of every rule of job, recorded runtime of the same election and rule is preferred over estimate
+        
+        Args:
+            election_name (str): name of calculated election
+            rule_ids([int]): numbers of entries in utils.rules run by the job
+            sizes (dict): {election name: (voters, projects)}
+            runtimes (dict): {election name: {rule name: seconds}}
+            rates (dict): {family: seconds per unit of work}
+        
+        Returns:
+            dict: {rule name: predicted seconds}
+    """
+    recorded = runtimes.get(election_name, {})
+    predicted = {}
+    for rule_id in rule_ids:
+        name = rules[rule_id][0]
+        if name in recorded:
+            predicted[name] = recorded[name]
+        else:
+            family = rule_family(rule_id)
+            predicted[name] = estimate_work(*sizes[election_name], family) * rates[family]
+    return predicted
+
+def schedule(jobs, instances_path, runtimes):
+    """
+        Order jobs longest first by predicted runtime
+        
+        Args:
+            jobs ([(str, [int])]): list of (election name, rule ids)
+            instances_path (str): directory with election files
+            runtimes (dict): {election name: {rule name: seconds}} recorded by earlier runs
+        
+        Returns:
+            [(str, [int], dict)]: list of (election name, rule ids, {rule name: predicted seconds})
+    """
+    sizes = {}
+    for election_name, _ in jobs:
+        if election_name not in sizes:
+            sizes[election_name] = instance_size(instances_path + "/" + election_name + ".pb")
+    rates = seconds_per_unit(runtimes, sizes)
+    predicted = [
+        (election_name, rule_ids, predict(election_name, rule_ids, sizes, runtimes, rates))
+        for election_name, rule_ids in jobs
+    ]
+    predicted.sort(key=lambda job: sum(job[2].values()), reverse=True)
+    return predicted
+
+def report(finished):
+    """
+        Print runtime of every job next to its prediction
+        
+        Args:
+            finished ([(str, dict, dict, float)]): list of 
+                (election name, {rule name: predicted seconds}, {rule name: seconds}, job wall time)
+        
+        Returns:
+            None
+    """
+    total_predicted = 0.0
+    total_actual = 0.0
+    for election_name, rule_predictions, rule_runtimes, wall_time in sorted(finished, key=lambda job: job[3], reverse=True):
+        if not rule_runtimes:
+            continue
+        predicted = sum(rule_predictions[name] for name in rule_runtimes)
+        actual = sum(rule_runtimes.values())
+        total_predicted += predicted
+        total_actual += actual
+        rule_names = ', '.join(rule_runtimes)
+        print(f'{election_name} [{rule_names}]\n  predicted: {predicted:.3f}s\n  actual: {actual:.3f}s\n  job runtime: {wall_time:.3f}s')
+    print(f'total\n  predicted: {total_predicted:.3f}s\n  actual: {total_actual:.3f}s')
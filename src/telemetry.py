@@ -0,0 +1,184 @@
+import argparse
+import json
+import pathlib
+import resource
+import statistics
+import sys
+import time
+
+from utils import RESULTS_PATH
+
+TELEMETRY_NAME = "telemetry.jsonl"
+# Fields of every record, times are in seconds and peak_rss in bytes
+FIELDS = ('time', 'instance', 'rule', 'status', 'voters', 'projects',
+          'parse_time', 'balance_time', 'rule_time', 'peak_rss')
+
+def reset_peak_rss():
+    """
+        Reset peak RSS of current process so that the next peak_rss() only covers what runs after it,
+        does nothing on systems without /proc/self/clear_refs
+        
+        Returns:
+            None
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss():
+    """
+        Get peak resident set size of current process since start or last reset_peak_rss()
+        
+        Returns:
+            int: bytes
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def make_record(election_name, rule_name, status, voters, projects, parse_time, balance_time, rule_time, peak):
+    """
+        Make telemetry record of single rule run, work shared by many rules of a job
+        (parsing, balancing) is counted only for the rule that did it
+        
+        Args:
+            election_name (str): name of election
+            rule_name (str): name of rule
+            status (str): status of calculation
+            voters (int): number of voters
+            projects (int): number of projects
+            parse_time (float): seconds spent reading election
+            balance_time (float): seconds spent balancing profile
+            rule_time (float): seconds spent in rule, None if it did not run
+            peak (int): peak RSS in bytes
+        
+        Returns:
+            dict: record with FIELDS
+    """
+    return dict(zip(FIELDS, (time.time(), election_name, rule_name, status, voters, projects,
+                             parse_time, balance_time, rule_time, peak)))
+
+def telemetry_path(results_path=RESULTS_PATH):
+    """
+        Shortcut for making path to telemetry log kept next to results
+        
+        Args:
+            results_path (str): directory with results of all rules
+        
+        Returns:
+            Path
+    """
+    return pathlib.Path(results_path).joinpath(TELEMETRY_NAME)
+
+def append(path, records):
+    """
+        Append records to JSONL log
+        
+        Args:
+            path (str): path to log
+            records ([dict]): records made by make_record
+        
+        Returns:
+            None
+    """
+    with open(path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def load(path):
+    """
+        Read JSONL log, lines that are not valid JSON (e.g. cut by a killed run) are skipped
+        
+        Args:
+            path (str): path to log
+        
+        Returns:
+            [dict]: records, latest record of every (instance, rule) only
+    """
+    latest = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            latest[(record['instance'], record['rule'])] = record
+    return list(latest.values())
+
+def __total_time(record):
+    """
+        Get total time spent on record
+        
+        Args:
+            record (dict): telemetry record
+        
+        Returns:
+            float: seconds
+    """
+    return sum(record[field] or 0.0 for field in ('parse_time', 'balance_time', 'rule_time'))
+
+def summary(records, n=20):
+    """
+        Print slowest instances, rules and (instance, rule) pairs and the largest peak RSS
+        
+        Args:
+            records ([dict]): telemetry records
+            n (int): number of entries in every ranking
+        
+        Returns:
+            None
+    """
+    instances = {}
+    rules_times = {}
+    for record in records:
+        entry = instances.setdefault(record['instance'], [0.0, 0.0, 0.0, 0, record['voters'], record['projects']])
+        entry[0] += record['parse_time'] or 0.0
+        entry[1] += record['balance_time'] or 0.0
+        entry[2] += record['rule_time'] or 0.0
+        entry[3] = max(entry[3], record['peak_rss'] or 0)
+        if record['rule_time'] is not None:
+            rules_times.setdefault(record['rule'], []).append(record['rule_time'])
+
+    print('slowest instances')
+    ranked = sorted(instances.items(), key=lambda item: sum(item[1][:3]), reverse=True)
+    for (election_name, (parse_time, balance_time, rule_time, peak, voters, projects)) in ranked[:n]:
+        print(f'{election_name} ({voters} voters, {projects} projects)\n'
+              f'  total: {parse_time + balance_time + rule_time:.3f}s\n  parse: {parse_time:.3f}s\n'
+              f'  balance: {balance_time:.3f}s\n  rules: {rule_time:.3f}s\n  peak RSS: {peak / 1024 ** 2:.0f}MB')
+
+    print('slowest rules')
+    ranked = sorted(rules_times.items(), key=lambda item: sum(item[1]), reverse=True)
+    for (rule_name, times) in ranked[:n]:
+        print(f'{rule_name}\n  total: {sum(times):.3f}s\n  median: {statistics.median(times):.3f}s\n'
+              f'  max: {max(times):.3f}s\n  runs: {len(times)}')
+
+    print('slowest (instance, rule) pairs')
+    for record in sorted(records, key=__total_time, reverse=True)[:n]:
+        print(f'{__total_time(record):10.3f}s  {record["instance"]} {record["rule"]} ({record["status"]})')
+
+    print('largest peak RSS')
+    for record in sorted(records, key=lambda record: record['peak_rss'] or 0, reverse=True)[:n]:
+        print(f'{(record["peak_rss"] or 0) / 1024 ** 2:10.0f}MB  {record["instance"]} {record["rule"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize runtime telemetry of calculated election results')
+    parser.add_argument('--log', default=str(telemetry_path()), help='path to telemetry log')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary_parser = subparsers.add_parser('summary', help='rank slowest instances and rules')
+    summary_parser.add_argument('-n', type=int, default=20, help='number of entries in every ranking')
+    summary_parser.add_argument('--rule', action='append', help='only use given rule, can be repeated')
+    args = parser.parse_args()
+
+    records = load(args.log)
+    if args.rule:
+        records = [record for record in records if record['rule'] in args.rule]
+    summary(records, args.n)
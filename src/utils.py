@@ -1,10 +1,24 @@
+import array
+import copyreg
+import csv
+import fnmatch
+import gc
+import hashlib
+import importlib.metadata
+import json
+import os
+import pathlib
+import pickle
+import re
+import tempfile
+
+import numpy as np
 import pabutools
 
+from gmpy2 import mpq
+
 from pabutools.rules.cstv import (
     cstv, 
-    select_project_gs, 
-    select_project_gsc, 
-    select_project_ge, 
     CSTV_Combination
 )
 
@@ -13,6 +27,21 @@ pabutools.fractions.FRACTION = "float"
 
 ENCODING="utf-8-sig"
 
+ROOT_PATH = pathlib.Path(__file__).resolve().parent.parent
+INSTANCES_PATH = str(ROOT_PATH.joinpath("instances_all"))
+RESULTS_PATH = str(ROOT_PATH.joinpath("election_results"))
+CACHE_PATH = str(ROOT_PATH.joinpath("instances_cache"))
+USE_CACHE = True
+# Run cstv rules with dense_cstv on DenseProfile instead of pabutools cstv
+DENSE_CSTV = False
+# Run all cstv rules of an election together with dense_cstv.shared_cstv, needs DENSE_CSTV
+SHARED_CSTV = False
+# Balance profiles used by greedy rules and dense_cstv to SparseProfile instead of DenseProfile
+SPARSE_PROFILES = False
+# Merge identical balanced ballots of profiles used by greedy rules and dense_cstv into weighted rows
+MERGE_BALLOTS = False
+PABUTOOLS_VERSION = importlib.metadata.version("pabutools")
+
 SAMPLE_ELECTION_NAMES = [
     'france_toulouse_2019_',
     'poland_czestochowa_2020_',
@@ -48,11 +77,403 @@ MINIMAL_SAMPLE_ELECTION_NAMES = [
 ]
 
 
+class ArrayProfile:
+    """
+        Base of array-backed profiles, one voter per row and one project per column
+        
+        Attributes:
+            projects ([Project]): projects in column order, sorted by name
+            index (dict(Project, int)): column of each project, can also be indexed by project name
+            costs (numpy.ndarray): cost of each project
+            ballot_type (type): type of ballots the profile was made from
+            weights (numpy.ndarray): number of voters who cast ballot of every row, None if every row is one voter
+    """
+    def __init__(self, projects, costs, ballot_type, weights = None):
+        self.projects = projects
+        self.index = {project: idx for idx, project in enumerate(projects)}
+        self.costs = costs
+        self.ballot_type = ballot_type
+        self.weights = weights
+        self.__max_utility = {}
+
+    def num_ballots(self):
+        """
+            Get number of voters, rows with weights count as many voters
+            
+            Returns:
+                int: number of voters
+        """
+        return len(self) if self.weights is None else int(self.weights.sum())
+
+    def total(self, values):
+        """
+            Sum values of rows over all voters, every row is counted as many times as its weight
+            
+            Args:
+                values (numpy.ndarray): value per row, or rows x k matrix of values
+                
+            Returns:
+                numpy.ndarray | float: sum, per column for matrix
+        """
+        if self.weights is None:
+            return values.sum(axis=0)
+        return (values * self.weights.reshape((-1,) + (1,) * (values.ndim - 1))).sum(axis=0)
+
+    def columns(self, projects):
+        """
+            Get columns of projects from this profile, projects not in profile are skipped
+            
+            Args:
+                projects (iterable(Project)): projects to find
+                
+            Returns:
+                numpy.ndarray: column indices
+        """
+        return np.array([self.index[p] for p in projects if p in self.index], dtype=np.intp)
+
+    def mask(self, projects):
+        """
+            Get indicator vector of projects, projects not in profile are skipped
+            
+            Args:
+                projects (iterable(Project)): projects to mark
+                
+            Returns:
+                numpy.ndarray: 1.0 in columns of projects, 0.0 elsewhere
+        """
+        mask = np.zeros(len(self.projects), dtype=np.float64)
+        mask[self.columns(projects)] = 1.0
+        return mask
+
+    def max_utility(self, use_cost = True):
+        """
+            Get utility of all voters from all projects, it does not depend on any outcome so it is calculated once
+            
+            Args:
+                use_cost (bool): Should votes be multiplied by project cost
+                
+            Returns:
+                float: utility
+        """
+        if use_cost not in self.__max_utility:
+            support = self.support()
+            self.__max_utility[use_cost] = float(support @ self.costs) if use_cost else float(support.sum())
+        return self.__max_utility[use_cost]
+
+class DenseProfile(ArrayProfile):
+    """
+        Array-backed profile with one row per voter and one column per project
+        
+        Attributes:
+            projects ([Project]): projects in column order, sorted by name
+            index (dict(Project, int)): column of each project, can also be indexed by project name
+            costs (numpy.ndarray): cost of each project
+            matrix (numpy.ndarray): voters x projects matrix of votes
+            ballot_type (type): type of ballots the profile was made from
+            weights (numpy.ndarray): number of voters who cast ballot of every row, None if every row is one voter
+    """
+    def __init__(self, projects, costs, matrix, ballot_type, weights = None):
+        super().__init__(projects, costs, ballot_type, weights)
+        self.matrix = matrix
+        self.__support_bits = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def support(self):
+        """
+            Get total support of every project
+            
+            Returns:
+                numpy.ndarray: support per column
+        """
+        return self.total(self.matrix)
+
+    def product(self, weights):
+        """
+            Multiply votes by weights of projects
+            
+            Args:
+                weights (numpy.ndarray): weight per project, or projects x k matrix of weights
+                
+            Returns:
+                numpy.ndarray: value per row, or rows x k matrix
+        """
+        return self.matrix @ weights
+
+    def entries(self):
+        """
+            Get non-zero votes in order of voters
+            
+            Returns:
+                tuple: (numpy.ndarray of voters, numpy.ndarray of columns, numpy.ndarray of votes)
+        """
+        (rows, columns) = np.nonzero(self.matrix)
+        return (rows, columns, self.matrix[rows, columns])
+
+    def support_bits(self):
+        """
+            Get packed bitsets of voters supporting every project, bit v of row p is set if voter v gives
+            project p positive support, they are made once and reused
+            
+            Returns:
+                numpy.ndarray: projects x ceil(voters / 8) array of uint8
+        """
+        if self.__support_bits is None:
+            self.__support_bits = np.packbits(self.matrix.T > 0, axis=1)
+        return self.__support_bits
+
+class SparseProfile(ArrayProfile):
+    """
+        Array-backed profile keeping only votes voters gave, in compressed sparse rows,
+        memory and time of its operations depend on number of votes instead of voters x projects
+        
+        Attributes:
+            projects ([Project]): projects in column order, sorted by name
+            index (dict(Project, int)): column of each project, can also be indexed by project name
+            costs (numpy.ndarray): cost of each project
+            indptr (numpy.ndarray): votes of voter v are at positions indptr[v] to indptr[v + 1]
+            indices (numpy.ndarray): column of every vote, increasing within every voter
+            data (numpy.ndarray): every vote
+            ballot_type (type): type of ballots the profile was made from
+            weights (numpy.ndarray): number of voters who cast ballot of every row, None if every row is one voter
+    """
+    def __init__(self, projects, costs, indptr, indices, data, ballot_type, weights = None):
+        super().__init__(projects, costs, ballot_type, weights)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.__support_bits = None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def rows(self):
+        """
+            Get voter of every vote
+            
+            Returns:
+                numpy.ndarray: row per position in data
+        """
+        return np.repeat(np.arange(len(self), dtype=np.intp), np.diff(self.indptr))
+
+    def support(self):
+        """
+            Get total support of every project
+            
+            Returns:
+                numpy.ndarray: support per column
+        """
+        data = self.data if self.weights is None else self.data * self.weights[self.rows()]
+        return np.bincount(self.indices, weights=data, minlength=len(self.projects))
+
+    def product(self, weights):
+        """
+            Multiply votes by weights of projects
+            
+            Args:
+                weights (numpy.ndarray): weight per project, or projects x k matrix of weights
+                
+            Returns:
+                numpy.ndarray: value per row, or rows x k matrix
+        """
+        rows = self.rows()
+        if weights.ndim == 1:
+            return np.bincount(rows, weights=self.data * weights[self.indices], minlength=len(self))
+        products = self.data[:, np.newaxis] * weights[self.indices]
+        return np.stack([np.bincount(rows, weights=column, minlength=len(self)) for column in products.T], axis=1)
+
+    def entries(self):
+        """
+            Get non-zero votes in order of voters
+            
+            Returns:
+                tuple: (numpy.ndarray of voters, numpy.ndarray of columns, numpy.ndarray of votes)
+        """
+        given = self.data != 0
+        return (self.rows()[given], self.indices[given], self.data[given])
+
+    def support_bits(self):
+        """
+            Get packed bitsets of voters supporting every project, bit v of row p is set if voter v gives
+            project p positive support, they are made once and reused
+            
+            Returns:
+                numpy.ndarray: projects x ceil(voters / 8) array of uint8
+        """
+        if self.__support_bits is None:
+            positive = self.data > 0
+            bits = np.zeros((len(self.projects), len(self)), dtype=bool)
+            bits[self.indices[positive], self.rows()[positive]] = True
+            self.__support_bits = np.packbits(bits, axis=1)
+        return self.__support_bits
+
+def __sparse_from_entries(projects, costs, voters, rows, cols, values, ballot_type):
+    """
+        Make SparseProfile from votes in any order, later of repeated votes for the same project wins
+        like in assignment to dense matrix
+        
+        Args:
+            projects ([Project]): projects sorted by name
+            costs (numpy.ndarray): cost of each project
+            voters (int): number of voters
+            rows (numpy.ndarray): voter of every vote
+            cols (numpy.ndarray): column of every vote
+            values (numpy.ndarray): every vote
+            ballot_type (type): type of ballots
+            
+        Returns:
+            SparseProfile
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    keys = rows * len(projects) + cols
+    # last position of every key in reversed order is its last vote
+    order = np.argsort(keys[::-1], kind='stable')
+    (_, first) = np.unique(keys[::-1][order], return_index=True)
+    chosen = len(keys) - 1 - order[first]
+    indptr = np.zeros(voters + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows[chosen], minlength=voters), out=indptr[1:])
+    return SparseProfile(projects, costs, indptr, cols[chosen], np.asarray(values, dtype=np.float64)[chosen], ballot_type)
+
+def __profile_entries(instance, profile):
+    """
+        Collect raw votes of parsed profile, approval ballots give 1 to every approved project
+        
+        Args:
+            instance (pabutools.election.instance.Instance): election instance
+            profile (pabutools.election.profile.Profile): election profile
+            
+        Returns:
+            tuple: ([Project] sorted by name, numpy.ndarray of costs, [voter], [column], [vote], ballot type)
+    """
+    projects = sorted(instance, key=lambda p: p.name)
+    index = {project: idx for idx, project in enumerate(projects)}
+    costs = np.array([float(p.cost) for p in projects], dtype=np.float64)
+    rows = []
+    cols = []
+    values = []
+    ballot_type = None
+    for row, ballot in enumerate(profile):
+        match ballot:
+            case pabutools.election.ballot.CumulativeBallot() | pabutools.election.ballot.CardinalBallot():
+                for project, votes in ballot.items():
+                    rows.append(row)
+                    cols.append(index[project])
+                    values.append(votes)
+            case pabutools.election.ballot.ApprovalBallot():
+                for project in ballot:
+                    rows.append(row)
+                    cols.append(index[project])
+                    values.append(1)
+            case _:
+                raise TypeError
+        ballot_type = type(ballot)
+    return (projects, costs, rows, cols, values, ballot_type)
+
+def dense_profile(instance, profile):
+    """
+        Turns parsed profile into DenseProfile with raw votes, approval ballots give 1 to every approved project
+        
+        Args:
+            instance (pabutools.election.instance.Instance): election instance
+            profile (pabutools.election.profile.Profile): election profile
+            
+        Returns:
+            DenseProfile
+    """
+    (projects, costs, rows, cols, values, ballot_type) = __profile_entries(instance, profile)
+    matrix = np.zeros((len(profile), len(projects)), dtype=np.float64)
+    matrix[rows, cols] = values
+    return DenseProfile(projects, costs, matrix, ballot_type)
+
+def sparse_profile(instance, profile):
+    """
+        Turns parsed profile into SparseProfile with raw votes, approval ballots give 1 to every approved project
+        
+        Args:
+            instance (pabutools.election.instance.Instance): election instance
+            profile (pabutools.election.profile.Profile): election profile
+            
+        Returns:
+            SparseProfile
+    """
+    (projects, costs, rows, cols, values, ballot_type) = __profile_entries(instance, profile)
+    return __sparse_from_entries(projects, costs, len(profile), rows, cols, [float(value) for value in values], ballot_type)
+
+def exact_number(value):
+    """
+        Turns number to gmpy2 fraction of its shortest decimal form, so costs, budgets and votes parsed
+        from decimal strings into floats get back the exact value written in the election file
+        
+        Args:
+            value (Numeric): number to convert
+            
+        Returns:
+            mpq
+    """
+    return mpq(repr(float(value)))
+
+def exact_profile(profile):
+    """
+        Turns array-backed profile into DenseProfile of gmpy2 fractions, it is used by the exact backend
+        of greedy rules and dense_cstv, which work on object arrays the same way as on float64 ones
+        
+        Args:
+            profile (ArrayProfile): profile with float64 votes
+            
+        Returns:
+            DenseProfile: profile with votes and costs as mpq, weights are kept
+    """
+    to_exact = np.frompyfunc(exact_number, 1, 1)
+    if isinstance(profile, SparseProfile):
+        matrix = np.zeros((len(profile), len(profile.projects)), dtype=np.float64)
+        matrix[profile.rows(), profile.indices] = profile.data
+    else:
+        matrix = profile.matrix
+    matrix = to_exact(matrix).astype(object)
+    costs = to_exact(profile.costs).astype(object)
+    return DenseProfile(profile.projects, costs, matrix, profile.ballot_type, profile.weights)
+
+SAMPLE_PRESETS = {
+    'sample': SAMPLE_ELECTION_NAMES,
+    'minimal': MINIMAL_SAMPLE_ELECTION_NAMES,
+}
+
+def filter_instances(instaces_names, globs = (), regexes = (), presets = ()):
+    """
+        Select elections matching any of the filters, all elections are selected if there are no filters
+        
+        Args:
+            instaces_names ([str]): names of elections
+            globs ([str]): shell-style patterns matched against whole name
+            regexes ([str]): regular expressions searched for in name
+            presets ([str]): keys of SAMPLE_PRESETS
+            
+        Returns:
+            [str]: selected names in original order
+    """
+    if not globs and not regexes and not presets:
+        return list(instaces_names)
+    compiled = [re.compile(regex) for regex in regexes]
+    preset_names = set()
+    for preset in presets:
+        preset_names.update(SAMPLE_PRESETS[preset])
+    return [
+        name for name in instaces_names
+        if name in preset_names
+        or any(fnmatch.fnmatchcase(name, pattern) for pattern in globs)
+        or any(regex.search(name) for regex in compiled)
+    ]
+
 def balance_profile(instance, 
                     profile,
                     adjust_cumulative_to_costs = False, 
                     adjust_cardinal_to_costs = False, 
-                    adjust_approval_to_costs = False
+                    adjust_approval_to_costs = False,
+                    dense = False,
+                    sparse = False,
+                    exact = False
                     ):
     """
         Turns profile to a cumulative one and adjusts its votes to make them equal to amount of value from budget assosiated with them
@@ -63,11 +484,49 @@ def balance_profile(instance,
             adjust_cumulative_to_costs (bool): Scale cumulative ballots by project costs.
             adjust_cardinal_to_costs (bool): Scale cardinal ballots by project costs.
             adjust_approval_to_costs (bool): Scale approval ballots by project costs.
+            dense (bool): Return DenseProfile instead of CumulativeProfile
+            sparse (bool): Return SparseProfile instead of CumulativeProfile, only votes voters gave are stored
+            exact (bool): Return DenseProfile of gmpy2 fractions balanced without rounding, with identical ballots merged,
+                          see exact_profile and merge_identical
             
         Returns:
             tuple: (instance, balanced_profile)
     """
     budget_per_ballot = instance.budget_limit / len(profile)
+    if exact:
+        # identical ballots are balanced the same way, merging them first keeps the number of fractions low
+        profile = exact_profile(merge_identical(dense_profile(instance, profile)))
+        budget_per_ballot = exact_number(instance.budget_limit) / profile.num_ballots()
+    elif dense or sparse:
+        profile = sparse_profile(instance, profile) if sparse else dense_profile(instance, profile)
+    if dense or sparse or exact:
+        if issubclass(profile.ballot_type, pabutools.election.ballot.CumulativeBallot):
+            adjust_to_costs = adjust_cumulative_to_costs
+        elif issubclass(profile.ballot_type, pabutools.election.ballot.CardinalBallot):
+            adjust_to_costs = adjust_cardinal_to_costs
+        else:
+            adjust_to_costs = adjust_approval_to_costs
+        if sparse:
+            rows = profile.rows()
+            if adjust_to_costs:
+                totals = profile.product(profile.costs)
+            else:
+                totals = np.bincount(rows, weights=profile.data, minlength=len(profile))
+        elif adjust_to_costs:
+            totals = profile.matrix @ profile.costs
+        else:
+            totals = profile.matrix.sum(axis=1)
+        if not totals.all():
+            raise ZeroDivisionError('ballot without votes cannot be balanced')
+        if sparse:
+            profile.data *= (budget_per_ballot / totals)[rows]
+            if adjust_to_costs:
+                profile.data *= profile.costs[profile.indices]
+            return (instance, profile)
+        profile.matrix *= (budget_per_ballot / totals)[:, np.newaxis]
+        if adjust_to_costs:
+            profile.matrix *= profile.costs
+        return (instance, profile)
     ballots = []
     empty_ballot_dict = {}
     for project in instance:
@@ -113,25 +572,360 @@ def balance_profile(instance,
     profile = pabutools.election.profile.CumulativeProfile(ballots)
     return (instance, profile)
 
-def read_path(path):
+def merge_identical(profile):
+    """
+        Merge identical ballots of array-backed profile into one row weighted by number of voters who cast it,
+        rows keep order of the first voter with every ballot
+        
+        Args:
+            profile (ArrayProfile): profile, e.g. balanced by balance_profile
+            
+        Returns:
+            ArrayProfile: profile of the same type with weights
+    """
+    if isinstance(profile, SparseProfile):
+        bounds = zip(profile.indptr[:-1].tolist(), profile.indptr[1:].tolist())
+        keys = [profile.indices[start:end].tobytes() + profile.data[start:end].tobytes() for (start, end) in bounds]
+    else:
+        keys = [row.tobytes() for row in profile.matrix]
+    first = {}
+    inverse = np.array([first.setdefault(key, len(first)) for key in keys], dtype=np.intp)
+    kept = np.zeros(len(first), dtype=np.intp)
+    kept[inverse[::-1]] = np.arange(len(inverse) - 1, -1, -1)
+    if profile.weights is None:
+        weights = np.bincount(inverse, minlength=len(first))
+    else:
+        weights = np.zeros(len(first), dtype=profile.weights.dtype)
+        np.add.at(weights, inverse, profile.weights)
+    if not isinstance(profile, SparseProfile):
+        return DenseProfile(profile.projects, profile.costs, profile.matrix[kept], profile.ballot_type, weights)
+    lengths = np.diff(profile.indptr)[kept]
+    indptr = np.zeros(len(kept) + 1, dtype=np.intp)
+    np.cumsum(lengths, out=indptr[1:])
+    positions = np.repeat(profile.indptr[kept] - indptr[:-1], lengths) + np.arange(indptr[-1])
+    return SparseProfile(profile.projects, profile.costs, indptr, profile.indices[positions], profile.data[positions],
+                         profile.ballot_type, weights)
+
+def __rebuild_profile(profile_type, ballots, state):
+    """
+        Recreates profile from its pickled parts without revalidating every ballot
+        
+        Args:
+            profile_type (type): class of the profile
+            ballots (list(Ballot)): ballots of the profile
+            state (dict): attributes of the profile
+            
+        Returns:
+            Profile
+    """
+    profile = profile_type.__new__(profile_type)
+    profile.__dict__.update(state)
+    list.extend(profile, ballots)
+    return profile
+
+def __reduce_profile(profile):
+    """
+        Pickle reducer for profiles, default one calls extend before attributes are set
+        
+        Args:
+            profile (Profile): profile to be pickled
+            
+        Returns:
+            tuple: pickle reduce value
+    """
+    return (__rebuild_profile, (type(profile), list(profile), profile.__dict__))
+
+def __cache_file(path):
+    """
+        Shortcut for making path to cached version of election file
+        
+        Args:
+            path (str): path to election file 
+            
+        Returns:
+            Path
+    """
+    return pathlib.Path(CACHE_PATH).joinpath(pathlib.Path(path).stem + ".pickle")
+
+def __load_cached(cache_file, key):
+    """
+        Loads parsed election from cache if it was made from the same file and pabutools version
+        
+        Args:
+            cache_file (Path): path to cache file
+            key (tuple): (content hash, pabutools version) of the election file
+            
+        Returns:
+            tuple: (Instance, Profile) or None if cache is missing or stale
+    """
+    try:
+        with cache_file.open('rb') as f:
+            if pickle.load(f) != key:
+                return None
+            # Loading hundreds of thousands of ballots triggers gc passes that find nothing to collect
+            gc.disable()
+            try:
+                return pickle.load(f)
+            finally:
+                gc.enable()
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+def __store_cached(cache_file, key, instance, profile):
+    """
+        Saves parsed election to cache, replacing the old file atomically
+        
+        Args:
+            cache_file (Path): path to cache file
+            key (tuple): (content hash, pabutools version) of the election file
+            instance (Instance): parsed instance
+            profile (Profile): parsed profile
+            
+        Returns:
+            None
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = copyreg.dispatch_table.copy()
+            pickler.dispatch_table[type(profile)] = __reduce_profile
+            pickler.dump((instance, profile))
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def read_path(path, use_cache = None):
     """
         Reads election and returns adjusted election
         
+        Parsed elections are cached in CACHE_PATH, cache is invalidated when contents of the file 
+        or pabutools version change
+        
         Args:
             path (str): path to election file 
+            use_cache (bool): Should the cache be used, defaults to USE_CACHE
             
         Returns:
             tuple: (Instance, Profile)
     """
-    with open(path, 'r', encoding=ENCODING) as f:
-        (instance, profile) = pabutools.election.pabulib.parse_pabulib_from_string(f.read())
+    if use_cache is None:
+        use_cache = USE_CACHE
+    with open(path, 'rb') as f:
+        content = f.read()
+    if not use_cache:
+        return pabutools.election.pabulib.parse_pabulib_from_string(content.decode(ENCODING))
 
+    key = (hashlib.sha256(content).hexdigest(), PABUTOOLS_VERSION)
+    cache_file = __cache_file(path)
+    cached = __load_cached(cache_file, key)
+    if cached is not None:
+        return cached
+    (instance, profile) = pabutools.election.pabulib.parse_pabulib_from_string(content.decode(ENCODING))
+    __store_cached(cache_file, key, instance, profile)
     return (instance, profile)
 
+def __file_hash(path):
+    """
+        Get SHA-256 of file, read in blocks so that the whole file is never in memory
+        
+        Args:
+            path (str): path to file
+            
+        Returns:
+            str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def stream_dense(path, sparse = False):
+    """
+        Reads election file line by line into instance and DenseProfile, without reading the whole file
+        into one string and without making ballots. Instance is made the same way as
+        pabutools.election.pabulib.parse_pabulib_from_string does, votes are collected in compact arrays
+        and written to the matrix at the end, so DenseProfile is the same as dense_profile of parsed election
+        
+        Args:
+            path (str): path to election file 
+            sparse (bool): Return SparseProfile, the same as sparse_profile of parsed election, instead of DenseProfile
+            
+        Returns:
+            tuple: (Instance, DenseProfile | SparseProfile)
+    """
+    instance = pabutools.election.Instance()
+    optional_sets = {"categories": set(), "targets": set()}
+    section = ""
+    header = []
+    index = None
+    rows = array.array('q')
+    cols = array.array('q')
+    values = array.array('d')
+    voters = 0
+    ballot_type = None
+    with open(path, 'r', encoding=ENCODING, newline='') as f:
+        reader = csv.reader(f, delimiter=";")
+        for row in reader:
+            if len(row) == 0 or (len(row) == 1 and len(row[0].strip()) == 0):
+                continue
+            if str(row[0]).strip().lower() in ["meta", "projects", "votes"]:
+                section = str(row[0]).strip().lower()
+                header = [key.strip() for key in next(reader)]
+            elif section == "meta":
+                instance.meta[row[0].strip()] = row[1].strip()
+            elif section == "projects":
+                p = pabutools.election.Project()
+                p.name = row[0].strip()
+                project_meta = dict()
+                for i in range(len(row)):
+                    if row[i].strip().lower() == "none":
+                        continue
+                    if header[i] in ["category", "categories"]:
+                        project_meta["categories"] = {entry.strip() for entry in row[i].split(",")}
+                        p.categories = set(project_meta["categories"])
+                        optional_sets["categories"].update(project_meta["categories"])
+                    elif header[i] in ["target", "targets"]:
+                        project_meta["targets"] = {entry.strip() for entry in row[i].split(",")}
+                        p.targets = set(project_meta["targets"])
+                        optional_sets["targets"].update(project_meta["targets"])
+                    else:
+                        project_meta[header[i]] = row[i].strip()
+                p.cost = pabutools.fractions.str_as_frac(project_meta["cost"].replace(",", "."))
+                instance.add(p)
+                instance.project_meta[p] = project_meta
+            elif section == "votes":
+                if index is None:
+                    projects = sorted(instance, key=lambda p: p.name)
+                    index = {project.name: idx for idx, project in enumerate(projects)}
+                    match instance.meta["vote_type"]:
+                        case "approval" | "choose-1":
+                            ballot_type = pabutools.election.ballot.ApprovalBallot
+                        case "scoring":
+                            ballot_type = pabutools.election.ballot.CardinalBallot
+                        case "cumulative":
+                            ballot_type = pabutools.election.ballot.CumulativeBallot
+                        case _:
+                            raise TypeError
+                    vote_column = header.index("vote") if "vote" in header else None
+                    points_column = header.index("points") if "points" in header else None
+                vote = row[vote_column].strip() if vote_column is not None and vote_column < len(row) else ""
+                if ballot_type is pabutools.election.ballot.ApprovalBallot:
+                    for project_name in vote.split(","):
+                        if project_name and project_name.lower() != "none":
+                            rows.append(voters)
+                            cols.append(index[project_name])
+                            values.append(1.0)
+                elif points_column is not None and points_column < len(row) and row[points_column].strip().lower() != "none":
+                    points = row[points_column].strip().split(",")
+                    for i, project_name in enumerate(vote.split(",")):
+                        rows.append(voters)
+                        cols.append(index[project_name])
+                        values.append(float(pabutools.fractions.str_as_frac(points[i].strip())))
+                voters += 1
+
+    instance.budget_limit = pabutools.fractions.str_as_frac(instance.meta["budget"].replace(",", "."))
+    instance.categories = optional_sets["categories"]
+    instance.targets = optional_sets["targets"]
+    projects = sorted(instance, key=lambda p: p.name)
+    costs = np.array([float(p.cost) for p in projects], dtype=np.float64)
+    if sparse:
+        return (instance, __sparse_from_entries(projects, costs, voters, np.frombuffer(rows, dtype=np.int64),
+                                                np.frombuffer(cols, dtype=np.int64), np.frombuffer(values, dtype=np.float64),
+                                                ballot_type if voters else None))
+    matrix = np.zeros((voters, len(projects)), dtype=np.float64)
+    matrix[np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64)] = np.frombuffer(values, dtype=np.float64)
+    return (instance, DenseProfile(projects, costs, matrix, ballot_type if voters else None))
+
+def __dense_files(path):
+    """
+        Shortcut for making paths to memory-mapped dense version of election file
+        
+        Args:
+            path (str): path to election file 
+            
+        Returns:
+            tuple: (Path of description, Path of matrix, Path of costs)
+    """
+    stem = pathlib.Path(path).stem
+    cache_path = pathlib.Path(CACHE_PATH)
+    return (cache_path.joinpath(stem + ".dense.pickle"),
+            cache_path.joinpath(stem + ".matrix.npy"),
+            cache_path.joinpath(stem + ".costs.npy"))
+
+def __store_file(target, write):
+    """
+        Writes file next to target and moves it over target atomically
+        
+        Args:
+            target (Path): path of file
+            write (callable): function writing contents to given binary file object
+            
+        Returns:
+            None
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, target)
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+def read_dense(path, use_cache = None):
+    """
+        Reads election as DenseProfile whose matrix and costs are memory-mapped read-only from .npy files in CACHE_PATH
+        
+        The files are published by the first process that needs them and every later process maps the same pages,
+        so worker processes share one copy of the matrix instead of building their own. They are invalidated
+        the same way as read_path cache, description is written last so that it only points to complete arrays
+        
+        Args:
+            path (str): path to election file 
+            use_cache (bool): Should the cache be used, defaults to USE_CACHE, without it the profile is built in memory
+            
+        Returns:
+            tuple: (Instance, DenseProfile)
+    """
+    if use_cache is None:
+        use_cache = USE_CACHE
+    if not use_cache:
+        return stream_dense(path)
+
+    key = (__file_hash(path), PABUTOOLS_VERSION)
+    (description_file, matrix_file, costs_file) = __dense_files(path)
+    try:
+        with description_file.open('rb') as f:
+            if pickle.load(f) == key:
+                (instance, ballot_type) = pickle.load(f)
+                projects = sorted(instance, key=lambda p: p.name)
+                return (instance, DenseProfile(projects, np.load(costs_file, mmap_mode='r'),
+                                               np.load(matrix_file, mmap_mode='r'), ballot_type))
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    (instance, dense) = stream_dense(path)
+    __store_file(matrix_file, lambda f: np.save(f, dense.matrix))
+    __store_file(costs_file, lambda f: np.save(f, dense.costs))
+    def write_description(f):
+        pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump((instance, dense.ballot_type), f, protocol=pickle.HIGHEST_PROTOCOL)
+    __store_file(description_file, write_description)
+    return (instance, DenseProfile(dense.projects, np.load(costs_file, mmap_mode='r'),
+                                   np.load(matrix_file, mmap_mode='r'), dense.ballot_type))
+
 def read_pb(path, 
             adjust_cumulative_to_costs = False, 
             adjust_cardinal_to_costs = False, 
-            adjust_approval_to_costs = False
+            adjust_approval_to_costs = False,
+            dense = False,
+            sparse = False
             ):
     """
         Reads election and returns adjusted cumulative election ready to be run by cstv
@@ -141,6 +935,8 @@ def read_pb(path,
             adjust_cumulative_to_costs (bool): Scale cumulative ballots by project costs.
             adjust_cardinal_to_costs (bool): Scale cardinal ballots by project costs.
             adjust_approval_to_costs (bool): Scale approval ballots by project costs.
+            dense (bool): Return DenseProfile instead of CumulativeProfile
+            sparse (bool): Return SparseProfile instead of CumulativeProfile
             
         Returns:
             tuple: (Instance, Profile)
@@ -152,70 +948,170 @@ def read_pb(path,
         profile,
         adjust_cumulative_to_costs,
         adjust_cardinal_to_costs,
-        adjust_approval_to_costs
+        adjust_approval_to_costs,
+        dense,
+        sparse
         )
 
-def greedy_s(instance, profile):
+def project_index(instance):
     """
-        Calculates set of projects to fill election budget based on greedy by support rule
+        Builds index of projects of election by name, used to turn stored results back into projects
+        
+        Args:
+            instance (Instance): instance of election
+            
+        Returns:
+            dict: {project name: Project}
+    """
+    return {str(project.name): project for project in instance}
+
+def load_result(rule_name, election_name, index, results_path = RESULTS_PATH):
+    """
+        Reads projects chosen by rule from results file, names not found in index are skipped
+        
+        Args:
+            rule_name (str): name of rule used for results
+            election_name (str): name of election
+            index (dict): {project name: Project} made by project_index
+            results_path (str): directory with results of all rules
+            
+        Returns:
+            [Project]: chosen projects in order of results file
+    """
+    path = pathlib.Path(results_path).joinpath(rule_name, election_name + ".json")
+    with path.open('r', encoding=ENCODING) as f:
+        names = json.load(f)
+    return [index[str(name)] for name in names if str(name) in index]
+
+def load_election(election_name, rule_names, instances_path = INSTANCES_PATH, results_path = RESULTS_PATH):
+    """
+        Reads election together with results of many rules, handy for analysing single election by hand
+        
+        Args:
+            election_name (str): name of election
+            rule_names ([str]): names of rules whose results are read
+            instances_path (str): directory with election files
+            results_path (str): directory with results of all rules
+            
+        Returns:
+            tuple: (Instance, Profile, {rule name: [Project]})
+    """
+    (instance, profile) = read_path(instances_path + "/" + election_name + ".pb")
+    index = project_index(instance)
+    allocs = {rule_name: load_result(rule_name, election_name, index, results_path) for rule_name in rule_names}
+    return (instance, profile, allocs)
+
+def project_support(instance, profile):
+    """
+        Calculates total support of every project, shared by all greedy rules
+        
+        Args:
+            instance (Instance): instance of election to be used
+            profile (Profile | ArrayProfile): profile of election to be used
+            
+        Returns:
+            tuple: ([Project] sorted by name, numpy.ndarray of support per project)
+    """
+    if isinstance(profile, ArrayProfile):
+        return (profile.projects, profile.support())
+    projects = sorted(instance, key=lambda p: p.name)
+    index = {project: idx for idx, project in enumerate(projects)}
+    support = np.zeros(len(projects), dtype=np.float64)
+    for ballot in profile:
+        multiplicity = profile.multiplicity(ballot)
+        for project, votes in ballot.items():
+            support[index[project]] += votes * multiplicity
+    return (projects, support)
+
+def __project_costs(projects, support):
+    """
+        Get cost of every project in the same numbers as support, gmpy2 fractions for exact profiles
+        
+        Args:
+            projects ([Project]): projects sorted by name
+            support (numpy.ndarray): support of every project from project_support
+            
+        Returns:
+            numpy.ndarray: cost per project
+    """
+    if support.dtype == object:
+        return np.array([exact_number(p.cost) for p in projects], dtype=object)
+    return np.array([float(p.cost) for p in projects], dtype=np.float64)
+
+def __greedy_select(instance, projects, scores):
+    """
+        Selects projects in order of decreasing score, skipping ones that do not fit in remaining budget,
+        scores of the exact backend also get the budget and costs as exact fractions
         
         Args:
             instance (Instance): instance of election to be used
-            profile (Profile): profile of election to be used
+            projects ([Project]): projects sorted by name
+            scores (numpy.ndarray): score of every project, ties are broken by project name
             
         Returns:
-            tuple: set(Project)
+            set(Project)
     """
-    remaining_projects = set(instance)
     selected_projects = set()
-    donations = [
-        {p: ballot[p] * profile.multiplicity(ballot) for p in instance}
-        for ballot in profile
-    ]
     budget = instance.budget_limit
-    while len(remaining_projects) > 0:
-        tied_projects = select_project_gs(remaining_projects, donations)
-        if not tied_projects:
-            return selected_projects
-        if len(tied_projects) < 1:
-            return selected_projects
-        project = tied_projects[0]
-        if project.cost <= budget:
+    costs = [p.cost for p in projects]
+    if scores.dtype == object:
+        budget = exact_number(budget)
+        costs = [exact_number(cost) for cost in costs]
+    for idx in np.argsort(-scores, kind='stable'):
+        project = projects[idx]
+        cost = costs[idx]
+        if cost <= budget:
             selected_projects.add(project)
-            budget -= project.cost
-        remaining_projects.remove(project)
+            budget -= cost
     return selected_projects
 
+def greedy_all(instance, profile):
+    """
+        Calculates results of all greedy rules using one support computation
+        
+        Args:
+            instance (Instance): instance of election to be used
+            profile (Profile | ArrayProfile): profile of election to be used
+            
+        Returns:
+            dict: {'GS': set(Project), 'GSC': set(Project), 'GE': set(Project)}
+    """
+    (projects, support) = project_support(instance, profile)
+    costs = __project_costs(projects, support)
+    return {
+        'GS': __greedy_select(instance, projects, support),
+        'GSC': __greedy_select(instance, projects, support / costs),
+        'GE': __greedy_select(instance, projects, support - costs),
+    }
+
+def greedy_s(instance, profile):
+    """
+        Calculates set of projects to fill election budget based on greedy by support rule
+        
+        Args:
+            instance (Instance): instance of election to be used
+            profile (Profile | ArrayProfile): profile of election to be used
+            
+        Returns:
+            set(Project)
+    """
+    (projects, support) = project_support(instance, profile)
+    return __greedy_select(instance, projects, support)
+
 def greedy_sc(instance, profile):
     """
         Calculates set of projects to fill election budget based on greedy by support over cost rule
         
         Args:
             instance (Instance): instance of election to be used
-            profile (Profile): profile of election to be used
+            profile (Profile | ArrayProfile): profile of election to be used
             
         Returns:
             set(Project)
     """
-    remaining_projects = set(instance)
-    selected_projects = set()
-    donations = [
-        {p: ballot[p] * profile.multiplicity(ballot) for p in instance}
-        for ballot in profile
-    ]
-    budget = instance.budget_limit
-    while len(remaining_projects) > 0:
-        tied_projects = select_project_gsc(remaining_projects, donations)
-        if not tied_projects:
-            return selected_projects
-        if len(tied_projects) < 1:
-            return selected_projects
-        project = tied_projects[0]
-        if project.cost <= budget:
-            selected_projects.add(project)
-            budget -= project.cost
-        remaining_projects.remove(project)
-    return selected_projects
+    (projects, support) = project_support(instance, profile)
+    costs = __project_costs(projects, support)
+    return __greedy_select(instance, projects, support / costs)
 
 def greedy_e(instance, profile):
     """
@@ -223,30 +1119,14 @@ def greedy_e(instance, profile):
         
         Args:
             instance (Instance): instance of election to be used
-            profile (Profile): profile of election to be used
+            profile (Profile | ArrayProfile): profile of election to be used
             
         Returns:
             set(Project)
     """
-    remaining_projects = set(instance)
-    selected_projects = set()
-    donations = [
-        {p: ballot[p] * profile.multiplicity(ballot) for p in instance}
-        for ballot in profile
-    ]
-    budget = instance.budget_limit
-    while len(remaining_projects) > 0:
-        tied_projects = select_project_ge(remaining_projects, donations)
-        if not tied_projects:
-            return selected_projects
-        if len(tied_projects) < 1:
-            return selected_projects
-        project = tied_projects[0]
-        if project.cost <= budget:
-            selected_projects.add(project)
-            budget -= project.cost
-        remaining_projects.remove(project)
-    return selected_projects
+    (projects, support) = project_support(instance, profile)
+    costs = __project_costs(projects, support)
+    return __greedy_select(instance, projects, support - costs)
 
 def __cstv_short(combination):
     """
@@ -259,7 +1139,11 @@ def __cstv_short(combination):
             function: (instance, profile) -> set(Project)
     """
     def tmp(instance, profile):
+        if DENSE_CSTV:
+            from dense_cstv import dense_cstv
+            return dense_cstv(instance, profile, combination)
         return cstv(instance=instance, profile=profile, combination=combination, verbose=False)
+    tmp.combination = combination
     return tmp
 
 rules = [
@@ -281,4 +1165,23 @@ rules = [
         ('MT', True, __cstv_short(CSTV_Combination.MT)),
         ('MTC', True, __cstv_short(CSTV_Combination.MTC)),
         ('MTS', True, __cstv_short(CSTV_Combination.MTS)),
-    ]
\ No newline at end of file
+    ]
+greedy_rules = {
+        greedy_e: 'GE',
+        greedy_sc: 'GSC',
+        greedy_s: 'GS',
+    }
+
+def rule_family(rule_id):
+    """
+        Get family of rule, greedy rules are much cheaper than cstv ones
+        
+        Args:
+            rule_id(int): number of entry in utils.rules
+            
+        Returns:
+            str: 'greedy' or 'cstv'
+    """
+    if rules[rule_id][2] in greedy_rules:
+        return 'greedy'
+    return 'cstv'
@@ -1,5 +1,8 @@
-import json
+import argparse
+import hashlib
+import inspect
 import multiprocessing
+import os
 import pathlib
 
 import matplotlib.pyplot as plt
@@ -7,165 +10,331 @@ import numpy as np
 import pabutools
 from matplotlib.patches import Patch
 
-from analisis import avg_utility, power_inequality, improvement_margins, Election, ejr_plus_violations, exclusion_ratio
-from utils import ENCODING
+import analisis
+import metric_store
+import utils
+from analisis import (
+    avg_utility,
+    power_inequality,
+    improvement_margin_matrix,
+    exclusion_ratios,
+    dense_ejr_index,
+    as_dense
+)
+from manifest import input_hash
+from metric_store import STORE_PATH
+from scheduler import instance_size
+from utils import (
+    read_path,
+    read_dense,
+    stream_dense,
+    merge_identical,
+    project_index,
+    load_result,
+    ArrayProfile,
+    ROOT_PATH,
+    INSTANCES_PATH,
+    RESULTS_PATH,
+    PABUTOOLS_VERSION
+)
 
+PLOTS_BOX_PATH = str(ROOT_PATH.joinpath("plots_box"))
+PLOTS_VIOLIN_PATH = str(ROOT_PATH.joinpath("plots_violin"))
 
-def visualize(measure_id):
+colors = [
+    'gold',
+    'khaki',
+    'goldenrod',
+    'rosybrown',
+    'salmon',
+    'indianred',
+    'palegreen',
+    'mediumseagreen',
+    'turquoise'
+]
+results_names = [
+    'GE',
+    'GSC',
+    'GS',
+    'EWT',
+    'EWTC',
+    'EWTS',
+    'MT',
+    'MTC',
+    'MTS'
+]
+measure_names = [
+    'utility cost score',
+    'power inequality',
+    'improvement margin',
+    'ejr',
+    'exclusion ratio',
+    'utility score',
+    'ejr scaled'
+]
+labels = [
+    'cumulative small',
+    'cummulative large',
+    'approval small',
+    'approval large'
+]
+
+def ballot_type(profile):
+    """
+        Get kind of ballots of election as stored in metric store
+        
+        Args:
+            profile (Profile | ArrayProfile): profile of election
+            
+        Returns:
+            str: 'cumulative' or 'approval', None for ballot types that are not analysed
+    """
+    kind = profile.ballot_type if isinstance(profile, ArrayProfile) else type(profile[0])
+    if kind is None:
+        return None
+    if issubclass(kind, pabutools.election.ballot.CardinalBallot):
+        return 'cumulative'
+    if issubclass(kind, pabutools.election.ballot.ApprovalBallot):
+        return 'approval'
+    return None
+
+def instance_group(ballot_type, projects):
+    """
+        Get group of election used on plots
+        
+        Args:
+            ballot_type (str): kind of ballots returned by ballot_type
+            projects (int): number of projects
+            
+        Returns:
+            int: index in labels, None for ballot types that are not analysed
+    """
+    match ballot_type:
+        case 'cumulative':
+            group_id = 0
+        case 'approval':
+            group_id = 2
+        case _:
+            return None
+    if projects >= 50:
+        group_id += 1
+    return group_id
+
+def metric_version():
+    """
+        Get version of metrics, made from source code of everything the values depend on
+        
+        Returns:
+            str: hex digest
+    """
+    sources = [PABUTOOLS_VERSION, inspect.getsource(analisis), inspect.getsource(evaluate_instance)]
+    sources += [inspect.getsource(f) for f in (ballot_type, utils.ArrayProfile, utils.DenseProfile, utils.SparseProfile, utils.dense_profile,
+                                              utils.merge_identical, utils.project_index, utils.load_result)]
+    return hashlib.sha256('\0'.join(sources).encode()).hexdigest()[:16]
+
+def metric_dependencies(measure_ids, result_hashes):
+    """
+        Get results every metric value depends on, every rule is compared with the greedy rule
+        of the same kind on improvement margin, so its value also depends on result of that rule
+        
+        Args:
+            measure_ids ([int]): indices in measure_names of metrics
+            result_hashes (dict): {rule name: hash of its result}, only rules with results
+            
+        Returns:
+            dict: {(rule name, metric name): combined hash of results value depends on}
+    """
+    dependencies = {}
+    for measure_id in measure_ids:
+        for name, res_hash in result_hashes.items():
+            hashes = [res_hash]
+            if measure_id == 2:
+                greedy_name = results_names[results_names.index(name) % 3]
+                if greedy_name not in result_hashes:
+                    continue
+                hashes.append(result_hashes[greedy_name])
+            dependencies[(name, measure_names[measure_id])] = metric_store.combined_hash(hashes)
+    return dependencies
+
+def evaluate_instance(instance_path, measure_ids, results_path=RESULTS_PATH, shared=False, sparse=False, merge=False):
     """
-        Calculate metric using all results in ./election_results and save it as a graph
+        Calculate metrics of results of all rules on single election, election and its results are loaded once
+        and every metric is calculated from structures shared by all rules
         
         Args:
-            measure_id (id): which metric should be calculated
+            instance_path (str): path to election file
+            measure_ids ([int]): indices in measure_names of metrics to calculate
+            results_path (str): directory with results of all rules
+            shared (bool): Should the profile be attached from memory-mapped dense matrix in instances cache, see utils.read_dense
+            sparse (bool): Should the profile be read straight into SparseProfile, takes precedence over shared
+            merge (bool): Should identical ballots be merged into weighted rows by merge_identical
+            
+        Returns:
+            tuple: (ballot type, voters, projects), {metric name: {rule name: value}} with None for values
+            left out of plots, metrics that failed are missing
+    """
+    election_name = pathlib.Path(instance_path).stem
+    try:
+        if sparse:
+            (instance, profile) = stream_dense(instance_path, sparse=True)
+        elif shared:
+            (instance, profile) = read_dense(instance_path)
+        else:
+            (instance, profile) = read_path(instance_path)
+    except TypeError:
+        # ballots that have no dense form are not analysed
+        (instance, profile) = read_path(instance_path)
+    description = (ballot_type(profile), len(profile), len(instance))
+    if description[0] is None:
+        return (description, {})
+    if merge:
+        profile = merge_identical(as_dense(instance, profile))
+    instances = [instance]
+    profiles = [profile]
+
+    index = project_index(instance)
+    allocs = {}
+    for results_name in results_names:
+        try:
+            allocs[results_name] = load_result(results_name, election_name, index, results_path)
+        except Exception as e:
+            print(f'Instance {election_name} - {results_name}:\n  {e}')
+    names = list(allocs)
+    alloc_list = [allocs[name] for name in names]
+
+    ejr_violations = None
+    measures = {}
+    for measure_id in measure_ids:
+        try:
+            match measure_id:
+                case 0:
+                    values = {name: avg_utility(instances, profiles, allocs[name], use_cost=True) for name in names}
+                case 1:
+                    values = {}
+                    for name in names:
+                        meas = power_inequality(instances, profiles, allocs[name])
+                        if meas > 200:
+                            print(f'------ Instance {election_name}.pb - {name} for {measure_names[measure_id]} has power inequality of {meas}')
+                            meas = None
+                        values[name] = meas
+                case 2:
+                    # every rule is compared with the greedy rule of the same kind (GE, GSC or GS)
+                    margins = improvement_margin_matrix(instances, profiles, alloc_list)
+                    values = {}
+                    for idx, name in enumerate(names):
+                        greedy_name = results_names[results_names.index(name) % 3]
+                        if greedy_name in allocs:
+                            values[name] = float(margins[idx, names.index(greedy_name)])
+                case 3 | 6:
+                    if ejr_violations is None:
+                        index = dense_ejr_index(instance, profile)
+                        ejr_violations = {name: len(index.violations(allocs[name])) for name in names}
+                    if measure_id == 3:
+                        values = dict(ejr_violations)
+                    else:
+                        values = {name: violations / len(instance) for name, violations in ejr_violations.items()}
+                case 4:
+                    values = dict(zip(names, exclusion_ratios(instances, profiles, alloc_list).tolist()))
+                case 5:
+                    values = {name: avg_utility(instances, profiles, allocs[name], use_cost=False) for name in names}
+        except Exception as e:
+            print(f'Instance {election_name}.pb for {measure_names[measure_id]}:\n  {e}')
+            continue
+        measures[measure_names[measure_id]] = values
+    return (description, measures)
+
+def __evaluate_instance_star(args):
+    """
+        Unpack arguments of evaluate_instance for Pool.imap_unordered
+        
+        Args:
+            args (tuple): election name and arguments of evaluate_instance
+            
+        Returns:
+            tuple: election name and result of evaluate_instance
+    """
+    return (args[0], evaluate_instance(*args[1:]))
+
+def evaluate(measure_ids, processes, instances_path=INSTANCES_PATH, results_path=RESULTS_PATH, store_path=STORE_PATH,
+             shared=False, sparse=False, merge=False):
+    """
+        Calculate metrics that are missing from metric store or whose election, results or code changed,
+        in parallel with one job per election and largest elections first, and save them to the store
+        
+        Args:
+            measure_ids ([int]): indices in measure_names of metrics to calculate
+            processes (int): number of worker processes
+            instances_path (str): directory with election files
+            results_path (str): directory with results of all rules
+            store_path (str): path to metric store
+            shared (bool): Should workers attach to memory-mapped dense matrices instead of parsing profiles
+            sparse (bool): Should workers read elections straight into sparse profiles
+            merge (bool): Should workers merge identical ballots before calculating metrics
             
         Returns:
             None
     """
+    conn = metric_store.connect(store_path)
+    version = metric_version()
+    metric_names = [measure_names[measure_id] for measure_id in measure_ids]
+    paths = sorted(pathlib.Path(instances_path).glob('*.pb'), key=lambda path: path.stem)
+    removed = metric_store.prune(conn, [path.stem for path in paths])
+    hashes = {}
+    dependencies = {}
+    jobs = []
+    for path in paths:
+        election_name = path.stem
+        hashes[election_name] = input_hash(conn, instances_path, election_name)
+        description = metric_store.election(conn, election_name, hashes[election_name])
+        if description is not None and description[0] is None:
+            continue
+        result_hashes = {}
+        for name in results_names:
+            res_hash = metric_store.result_hash(results_path, name, election_name)
+            if res_hash is not None:
+                result_hashes[name] = res_hash
+        dependencies[election_name] = metric_dependencies(measure_ids, result_hashes)
+        stale = metric_store.stale_metrics(conn, election_name, hashes[election_name], metric_names,
+                                           dependencies[election_name], version)
+        if description is None or stale:
+            stale_ids = [measure_id for measure_id in measure_ids if description is None or measure_names[measure_id] in stale]
+            jobs.append((election_name, str(path), stale_ids, results_path, shared, sparse, merge))
+    conn.commit()
+    print(f'{len(jobs)} of {len(paths)} elections to evaluate, {removed} removed from metric store')
+
+    sizes = {job[0]: instance_size(job[1]) for job in jobs}
+    jobs.sort(key=lambda job: sizes[job[0]][0] * sizes[job[0]][1], reverse=True)
+    with multiprocessing.Pool(processes) as pool:
+        for (election_name, (description, measures)) in pool.imap_unordered(__evaluate_instance_star, jobs, chunksize=1):
+            metric_store.record_election(conn, election_name, hashes[election_name], *description)
+            for metric_name, values in measures.items():
+                metric_store.record(conn, election_name, hashes[election_name], metric_name, values,
+                                    dependencies[election_name], version)
+            conn.commit()
+    conn.close()
 
-    colors = [
-        'gold', 
-        'khaki', 
-        'goldenrod', 
-        'rosybrown', 
-        'salmon', 
-        'indianred', 
-        'palegreen', 
-        'mediumseagreen', 
-        'turquoise'
-    ]
-    results_names = [
-        'GE', 
-        'GSC', 
-        'GS', 
-        'EWT', 
-        'EWTC', 
-        'EWTS', 
-        'MT', 
-        'MTC', 
-        'MTS'
-    ]
-    measure_names = [
-        'utility cost score', 
-        'power inequality', 
-        'improvement margin', 
-        'ejr', 
-        'exclusion ratio', 
-        'utility score', 
-        'ejr scaled'
-    ]
-    group_id = -1
-    labels = [
-        'cumulative small', 
-        'cummulative large', 
-        'approval small', 
-        'approval large'
-    ]
+def visualize(measure_id, store_path=STORE_PATH):
+    """
+        Read metric of all results from metric store and save it as a graph
+        
+        Args:
+            measure_id (id): which metric should be plotted
+            store_path (str): path to metric store
+            
+        Returns:
+            None
+    """
     print(f'Starting {measure_names[measure_id]}')
     measure = []
     for _ in range(len(results_names)):
         emp = [[] for _ in labels]
         measure.append(emp)
-    for instance_path in pathlib.Path('../instances_all').glob('*.pb'):
-        with instance_path.open(encoding=ENCODING) as f:
-            (instance, profile) = pabutools.election.pabulib.parse_pabulib_from_string(f.read())
-        instances = [instance]
-        profiles = [profile]
-        match profile[0]:
-            case pabutools.election.ballot.CumulativeBallot():
-                group_id = 0
-            case pabutools.election.ballot.CardinalBallot():
-                group_id = 0
-            case pabutools.election.ballot.ApprovalBallot():
-                group_id = 2
-            case _:
-                group_id = 69
-                continue
-        project_count = 0
-        for instance in instances:
-            project_count += len(instance)
-        if project_count >= 50:
-            group_id += 1
-        i = 0
-        allocG = [[], [], []]
-        for results_name in results_names:
-            results_path = pathlib.Path('..').joinpath('election_results')
-            results_path = results_path.joinpath(results_name)
-            results_path = results_path.joinpath(instance_path.stem + '.json')
-            with results_path.open(encoding=ENCODING) as f:
-                results_strings = json.load(f)
-            results = []
-            for pr_name in results_strings:
-                for instance in instances:
-                    for project in instance:
-                        if str(project.name) == str(pr_name):
-                            results.append(project)
-            if i < 3:
-                allocG[i] = results
-            try:
-                match measure_id:
-                    case 0:
-                        measure[i][group_id].append(avg_utility(instances, profiles, results, use_cost=True))
-                    case 1:
-                            meas = power_inequality(instances, profiles, results)
-                            if meas > 200:
-                                print(f'------ Instance {instance_path.name} - {results_name} for {measure_names[measure_id]} has power inequality of {meas}')
-                            else:
-                                measure[i][group_id].append(meas)
-                    case 2:
-                        measure[i][group_id].append(improvement_margins(instances, profiles, results, allocG[i%3]))
-                    case 3:
-                        elections = []
-                        projects_n = 0
-                        for ii in range(len(instances)):
-                            instance = instances[ii]
-                            profile = profiles[ii]
-                            election = dict()
-                            projects_n += len(instance)
-                            for h in range(len(profile)):
-                                match profile[h]:
-                                    case pabutools.election.ballot.CumulativeBallot():
-                                        for p, u in profile[h].items():
-                                            if u > 0:
-                                                if p not in election:
-                                                    election[p] = dict()
-                                                election[p][h] = u * p.cost
-                                    case pabutools.election.ballot.ApprovalBallot():
-                                        for p in profile[h]:
-                                            if p not in election:
-                                                election[p] = dict()
-                                            election[p][h] = p.cost
-                            elections.append(Election(election, instance.budget_limit))
-                        measure[i][group_id].append(len(ejr_plus_violations(elections, results)))
-                    case 4:
-                        measure[i][group_id].append(exclusion_ratio(instances, profiles, results))
-                    case 5:
-                        measure[i][group_id].append(avg_utility(instances, profiles, results, use_cost=False))
-                    case 6:
-                        elections = []
-                        projects_n = 0
-                        for ii in range(len(instances)):
-                            instance = instances[ii]
-                            profile = profiles[ii]
-                            election = dict()
-                            projects_n += len(instance)
-                            for h in range(len(profile)):
-                                match profile[h]:
-                                    case pabutools.election.ballot.CumulativeBallot():
-                                        for p, u in profile[h].items():
-                                            if u > 0:
-                                                if p not in election:
-                                                    election[p] = dict()
-                                                election[p][h] = u * p.cost
-                                    case pabutools.election.ballot.ApprovalBallot():
-                                        for p in profile[h]:
-                                            if p not in election:
-                                                election[p] = dict()
-                                            election[p][h] = p.cost
-                            elections.append(Election(election, instance.budget_limit))
-                        measure[i][group_id].append(len(ejr_plus_violations(elections, results)) / projects_n)
-            except Exception as e:
-                print(f'Instance {instance_path.name} - {results_name} for {measure_names[measure_id]}:\n  {e}')
-            i += 1
+    conn = metric_store.connect(store_path)
+    for row in metric_store.load(conn, measure_names[measure_id]):
+        group_id = instance_group(row['ballot_type'], row['projects'])
+        if row['value'] is not None and group_id is not None and row['rule'] in results_names:
+            measure[results_names.index(row['rule'])][group_id].append(row['value'])
+    conn.close()
 
     br_n = len(results_names)
     barWidth = 1 / (br_n+1)
@@ -184,7 +353,7 @@ def visualize(measure_id):
 
     artists = [Patch(facecolor=color, edgecolor='grey') for color in colors]
     plt.legend(artists, results_names)
-    plt.savefig(f'plots_box/{measure_names[measure_id]}.png')
+    plt.savefig(f'{PLOTS_BOX_PATH}/{measure_names[measure_id]}.png')
 
     fig = plt.subplots(figsize=(12, 8))
     for i in range(br_n):
@@ -198,23 +367,35 @@ def visualize(measure_id):
 
     artists = [Patch(facecolor=color, edgecolor='grey') for color in colors]
     plt.legend(artists, results_names)
-    plt.savefig(f'plots_violin/{measure_names[measure_id]}.png')
+    plt.savefig(f'{PLOTS_VIOLIN_PATH}/{measure_names[measure_id]}.png')
+    plt.close('all')
 
-    with open(f'plots_box/{measure_names[measure_id]}.txt', "w") as f:
+    with open(f'{PLOTS_BOX_PATH}/{measure_names[measure_id]}.txt', "w") as f:
         for result_id, results in enumerate(measure):
             for group_id, res in enumerate(results):
-                if len(res) > 0: 
+                if len(res) > 0:
                     f.write(f":{results_names[result_id]} - {labels[group_id]}:\n  mean: {sum(res)/len(res)}\n  min: {min(res)}\n  max: {max(res)}\n")
                 else:
                     f.write(f":{results_names[result_id]} - {labels[group_id]}:\n  no results\n")
 
 if __name__ == '__main__':
-    processes = []
-    measure_ids = [0, 1, 2, 3, 4, 5, 6]
-    for measure_id in measure_ids:
-        p = multiprocessing.Process(target=visualize, args=(measure_id,)) 
-        p.start()
-        processes.append(p)
+    parser = argparse.ArgumentParser(description='Calculate metrics of election results and plot them')
+    parser.add_argument('--metric', action='append', choices=measure_names, help='only use given metric, can be repeated')
+    parser.add_argument('--plot-only', action='store_true', help='only plot metrics already in metric store')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--instances', default=INSTANCES_PATH, help='directory with election files')
+    parser.add_argument('--results', default=RESULTS_PATH, help='directory with results of all rules')
+    parser.add_argument('--store', default=STORE_PATH, help='path to metric store')
+    parser.add_argument('--shared', action='store_true',
+                        help='attach workers to memory-mapped dense matrices in instances cache instead of parsing profiles')
+    parser.add_argument('--sparse', action='store_true',
+                        help='read elections straight into sparse profiles, memory depends on number of votes instead of voters x projects')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge identical ballots into weighted rows before calculating metrics')
+    args = parser.parse_args()
 
-    for p in processes:
-        p.join()
\ No newline at end of file
+    measure_ids = [measure_names.index(name) for name in args.metric] if args.metric else list(range(len(measure_names)))
+    if not args.plot_only:
+        evaluate(measure_ids, args.workers, args.instances, args.results, args.store, args.shared, args.sparse, args.merge)
+    for measure_id in measure_ids:
+        visualize(measure_id, args.store)
@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+# Modules of src import each other by name, as when scripts are run from src
+SRC_PATH = pathlib.Path(__file__).resolve().parent.parent.joinpath("src")
+sys.path.insert(0, str(SRC_PATH))
@@ -0,0 +1,221 @@
+import numpy as np
+import pabutools
+import pytest
+
+import utils
+
+from analisis import (
+    EJRIndex,
+    Election,
+    PowerInequality,
+    avg_utility,
+    dense_ejr_index,
+    dominance_margin,
+    dominance_margin_matrix,
+    ejr_plus_violations,
+    exclusion_ratio,
+    exclusion_ratios,
+    improvement_margin_matrix,
+    improvement_margins,
+    power_inequality,
+    power_shares,
+    project_ballot_support
+)
+
+
+def test_power_inequality_of_parts():
+    shares = np.array([0.0, 1.0, 2.0, 2.0, 5.0, 8.0])
+    inequality = PowerInequality()
+    inequality.add_shares(shares[:2])
+    inequality.add_shares(shares[2:])
+    assert inequality.value() == pytest.approx(shares.var() / shares.mean() ** 2)
+
+    weighted = PowerInequality()
+    weighted.add_shares(np.array([0.0, 1.0, 2.0, 5.0, 8.0]), np.array([1, 1, 2, 1, 1]))
+    assert weighted.value() == pytest.approx(inequality.value())
+
+    with pytest.raises(ZeroDivisionError):
+        PowerInequality().value()
+
+
+def test_power_inequality_of_elections():
+    elections = [utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+                 for election_name in ['poland_warszawa_2018_falenica', 'poland_warszawa_2018_las']]
+    instances = [instance for (instance, _) in elections]
+    profiles = [utils.dense_profile(instance, profile) for (instance, profile) in elections]
+    alloc = set(instances[0]) | set(instances[1])
+    shares = np.concatenate([power_shares(profile, alloc) for profile in profiles])
+    assert power_inequality(instances, profiles, alloc) == pytest.approx(shares.var() / shares.mean() ** 2)
+    merged = [utils.merge_identical(profile) for profile in profiles]
+    assert power_inequality(instances, merged, alloc) == pytest.approx(power_inequality(instances, profiles, alloc))
+
+
+# EJR+ check of elections kept as {project: {voter: utility}}, as it was before EJRIndex
+def reference_violations(elections, outcome, up_to_one = True):
+    utility = {}
+    budget_limit = sum([e.budget for e in elections])
+    for e in elections:
+        for p in e.profile.keys():
+            for v in e.profile[p].keys():
+                utility[v] = utility.get(v, 0) + (e.profile[p][v] if p in outcome else 0)
+    sorted_voters = sorted(utility.items(), key=lambda item: item[1])
+    failures = []
+    for e in elections:
+        for not_elected in e.profile.keys():
+            if not_elected in outcome:
+                continue
+            coalition_size = 0
+            for (voter, sat) in sorted_voters:
+                if voter in e.profile[not_elected]:
+                    coalition_size += 1
+                    threshold = (coalition_size / len(sorted_voters)) * budget_limit
+                    if sat < threshold - (not_elected.cost if up_to_one else 0):
+                        failures.append(not_elected.name)
+                        break
+    return failures
+
+
+def approval_election(instance, profile):
+    election = {}
+    for (voter, ballot) in enumerate(profile):
+        for project in ballot:
+            election.setdefault(project, {})[voter] = project.cost
+    return Election(election, instance.budget_limit)
+
+
+def test_ejr_index_finds_violation():
+    (a, b, c) = (pabutools.election.Project('a', 40), pabutools.election.Project('b', 40), pabutools.election.Project('c', 20))
+    # voters 0-2 agree on c, but only projects of voters 3-4 are chosen
+    elections = [Election({a: {3: 40, 4: 40}, b: {3: 40}, c: {0: 20, 1: 20, 2: 20}}, 100)]
+    assert ejr_plus_violations(elections, {a, b}) == ['c']
+    assert ejr_plus_violations(elections, {a, c}) == []
+    assert ejr_plus_violations(elections, {a, b}) == reference_violations(elections, {a, b})
+
+
+@pytest.mark.parametrize('election_name', ['poland_warszawa_2018_falenica', 'poland_warszawa_2018_las'])
+def test_ejr_index_matches_reference(election_name):
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+    elections = [approval_election(instance, profile)]
+    index = EJRIndex(elections)
+    dense_index = dense_ejr_index(instance, profile)
+    merged_index = dense_ejr_index(instance, utils.merge_identical(utils.dense_profile(instance, profile)))
+    projects = sorted(instance, key=lambda p: p.name)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        outcome = {p for p in projects if rng.random() < 0.5}
+        for up_to_one in (True, False):
+            expected = sorted(reference_violations(elections, outcome, up_to_one))
+            assert sorted(index.violations(outcome, up_to_one)) == expected
+            assert sorted(dense_index.violations(outcome, up_to_one)) == expected
+            assert sorted(merged_index.violations(outcome, up_to_one)) == expected
+
+
+# metrics calculated ballot by ballot, as they were before profiles were made dense
+def reference_utility(ballot, projects, use_cost):
+    return sum([project_ballot_support(ballot, project, use_cost) for project in projects])
+
+
+def reference_avg_utility(instances, profiles, alloc, use_cost):
+    sum_u = 0
+    max_u = 0
+    for (instance, profile) in zip(instances, profiles):
+        trimmed_alloc = [p for p in instance if p in alloc]
+        for ballot in profile:
+            sum_u += reference_utility(ballot, trimmed_alloc, use_cost)
+            max_u += reference_utility(ballot, instance, use_cost)
+    return sum_u / max_u
+
+
+def reference_preferences(profile, alloc1, alloc2, use_cost):
+    margin1 = 0
+    margin2 = 0
+    for ballot in profile:
+        utility1 = reference_utility(ballot, alloc1, use_cost)
+        utility2 = reference_utility(ballot, alloc2, use_cost)
+        margin1 += utility1 > utility2
+        margin2 += utility2 > utility1
+    return (margin1, margin2)
+
+
+def reference_exclusion_ratio(profiles, alloc):
+    exclusion = 0
+    voter_count = 0
+    for profile in profiles:
+        for ballot in profile:
+            exclusion += not any(project_ballot_support(ballot, project) > 0 for project in alloc)
+        voter_count += len(profile)
+    return exclusion / voter_count
+
+
+def random_allocations(instances, count):
+    projects = [p for instance in instances for p in sorted(instance, key=lambda p: p.name)]
+    rng = np.random.default_rng(0)
+    return [set()] + [{p for p in projects if rng.random() < share} for share in np.linspace(0.1, 0.9, count)]
+
+
+@pytest.mark.parametrize('election_names', [['poland_warszawa_2018_falenica', 'poland_warszawa_2018_las'],
+                                            ['poland_katowice_2022_zarzecze']])
+def test_metrics_match_reference(election_names):
+    elections = [utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+                 for election_name in election_names]
+    instances = [instance for (instance, _) in elections]
+    profiles = [profile for (_, profile) in elections]
+    sparse = [utils.sparse_profile(instance, profile) for (instance, profile) in elections]
+    allocs = random_allocations(instances, 6)
+    for alloc in allocs:
+        expected = reference_exclusion_ratio(profiles, alloc)
+        assert exclusion_ratio(instances, profiles, alloc) == pytest.approx(expected)
+        assert exclusion_ratio(instances, sparse, alloc) == pytest.approx(expected)
+        for use_cost in (True, False):
+            expected = reference_avg_utility(instances, profiles, alloc, use_cost)
+            assert avg_utility(instances, profiles, alloc, use_cost) == pytest.approx(expected)
+            assert avg_utility(instances, sparse, alloc, use_cost) == pytest.approx(expected)
+    for (alloc1, alloc2) in zip(allocs, allocs[1:] + allocs[:1]):
+        for use_cost in (True, False):
+            counts = [reference_preferences(profile, alloc1, alloc2, use_cost) for profile in profiles]
+            voters = sum(len(profile) for profile in profiles)
+            expected = (sum(m1 for (m1, _) in counts) - sum(m2 for (_, m2) in counts)) / voters
+            assert improvement_margins(instances, profiles, alloc1, alloc2, use_cost) == pytest.approx(expected)
+            assert improvement_margins(instances, sparse, alloc1, alloc2, use_cost) == pytest.approx(expected)
+            (m1, m2) = counts[0]
+            expected = (m1 / len(profiles[0]), m2 / len(profiles[0]))
+            assert dominance_margin(instances[0], profiles[0], alloc1, alloc2, use_cost) == pytest.approx(expected)
+            assert dominance_margin(instances[0], sparse[0], alloc1, alloc2, use_cost) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('voters', [1, 7, 11, 13, 17])
+def test_exclusion_ratios_of_partial_bytes(voters):
+    # padding bits of the last byte of every bitset must not count as covered voters
+    projects = [pabutools.election.Project(str(idx), 10) for idx in range(5)]
+    instance = pabutools.election.Instance(projects, budget_limit=30)
+    rng = np.random.default_rng(voters)
+    profile = pabutools.election.ApprovalProfile(
+        [pabutools.election.ApprovalBallot([p for p in projects if rng.random() < 0.3]) for _ in range(voters)],
+        instance=instance)
+    allocs = [set(), {projects[0]}, {projects[1], projects[2]}, set(projects)]
+    dense = utils.dense_profile(instance, profile)
+    expected = [reference_exclusion_ratio([profile], alloc) for alloc in allocs]
+    for converted in (profile, dense, utils.sparse_profile(instance, profile), utils.merge_identical(dense)):
+        assert list(exclusion_ratios([instance], [converted], allocs)) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('election_name', ['poland_warszawa_2018_falenica', 'poland_katowice_2022_zarzecze'])
+def test_margin_matrices_match_pairwise_margins(election_name):
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+    allocs = random_allocations([instance], 4) + [set()]
+    merged = utils.merge_identical(utils.dense_profile(instance, profile))
+    for use_cost in (True, False):
+        dominance = dominance_margin_matrix(instance, profile, allocs, use_cost)
+        improvement = improvement_margin_matrix([instance], [profile], allocs, use_cost)
+        assert dominance.shape == improvement.shape == (len(allocs), len(allocs))
+        for (i, alloc1) in enumerate(allocs):
+            for (j, alloc2) in enumerate(allocs):
+                (m1, m2) = reference_preferences(profile, alloc1, alloc2, use_cost)
+                assert dominance[i, j] == pytest.approx(m1 / len(profile))
+                assert improvement[i, j] == pytest.approx((m1 - m2) / len(profile))
+        assert dominance_margin_matrix(instance, merged, allocs, use_cost) == pytest.approx(dominance)
+        assert improvement_margin_matrix([instance], [merged], allocs, use_cost) == pytest.approx(improvement)
+    # allocations nobody gets any utility from are not preferred by anyone
+    assert not dominance_margin_matrix(instance, profile, [set(), set()]).any()
+    assert dominance_margin_matrix(instance, profile, []).shape == (0, 0)
+    assert improvement_margin_matrix([instance], [profile], []).shape == (0, 0)
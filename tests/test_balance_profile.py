@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import utils
+
+ELECTIONS = ['poland_warszawa_2019_sadul', 'poland_gdansk_2020_rudniki', 'poland_zabrze_2020_osiedle-mlodego-gornika']
+
+
+@pytest.mark.parametrize('election_name', ELECTIONS)
+@pytest.mark.parametrize('use_cost', [False, True])
+def test_dense_profile_matches_balanced_ballots(election_name, use_cost):
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+    (_, balanced) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost)
+    (_, dense) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, True)
+    assert len(dense) == len(balanced)
+    assert [p.name for p in dense.projects] == sorted(p.name for p in instance)
+    assert np.array_equal(dense.costs, [float(p.cost) for p in dense.projects])
+    expected = np.array([[float(ballot[p]) for p in dense.projects] for ballot in balanced])
+    assert np.allclose(dense.matrix, expected, rtol=1e-12, atol=0)
+    assert np.allclose(dense.support(), expected.sum(axis=0), rtol=1e-12, atol=0)
+
+    (_, sparse) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, sparse=True)
+    matrix = np.zeros_like(expected)
+    matrix[sparse.rows(), sparse.indices] = sparse.data
+    assert np.allclose(matrix, expected, rtol=1e-12, atol=0)
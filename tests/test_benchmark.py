@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark import measure
+
+
+def test_measure_runs_at_least_once():
+    calls = []
+    result = measure(lambda: calls.append(1), 3, 0.0)
+    assert result['repeats'] == len(calls) == 1
+    assert result['median'] >= 0 and result['rss'] >= 0
+    result = measure(lambda: calls.append(1), 3, 10.0)
+    assert result['repeats'] == 3
+    with pytest.raises(ValueError):
+        measure(lambda: calls.append(1), 0, 10.0)
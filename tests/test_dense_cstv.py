@@ -0,0 +1,113 @@
+import pytest
+
+from pabutools.election import ApprovalBallot, ApprovalProfile, Instance, Project
+from pabutools.rules.cstv import (
+    cstv,
+    CSTV_Combination,
+    acceptance_of_under_supported_projects,
+    elimination_with_transfers,
+    is_eligible_ge,
+    is_eligible_gsc,
+    minimal_transfer,
+    reverse_eliminations,
+    select_project_ge,
+    select_project_gs,
+    select_project_gsc
+)
+
+import utils
+
+from dense_cstv import COMBINATIONS, dense_cstv, shared_cstv
+
+
+# votes split between projects in proportion to costs must be exact in float,
+# pabutools only accepts balanced profiles whose voters donate the same amount
+def election(costs, budget_limit, ballots):
+    projects = {name: Project(name, cost) for (name, cost) in costs}
+    instance = Instance(projects.values(), budget_limit=budget_limit)
+    profile = ApprovalProfile([ApprovalBallot([projects[name] for name in ballot]) for ballot in ballots], instance=instance)
+    return (instance, profile)
+
+
+def run_both(instance, profile, combination):
+    (_, balanced) = utils.balance_profile(instance, profile, True, True, True)
+    expected = cstv(instance=instance, profile=balanced, combination=CSTV_Combination[combination], verbose=False)
+    (_, dense) = utils.balance_profile(instance, profile, True, True, True, True)
+    return ({p.name for p in dense_cstv(instance, dense, combination)}, {p.name for p in expected})
+
+
+@pytest.mark.parametrize('combination', COMBINATIONS)
+def test_selection_matches_pabutools(combination):
+    # a gets excess that moves to b, d can not be funded and does not fit in what is left
+    (instance, profile) = election([('a', 300), ('b', 100), ('c', 300), ('d', 400)], 900,
+                                   ['a', 'a', 'ab', 'ab', 'bc', 'bc', 'c', 'c', 'd'])
+    (chosen, expected) = run_both(instance, profile, combination)
+    assert chosen == expected == {'a', 'b', 'c'}
+
+
+@pytest.mark.parametrize('combination', ['EWT', 'EWTC'])
+def test_elimination_matches_pabutools(combination):
+    # c is eliminated first, b after it and b is then completed in the budget left
+    (instance, profile) = election([('a', 200), ('b', 200), ('c', 300)], 600, ['a', 'a', 'a', 'ab', 'b', 'c'])
+    (chosen, expected) = run_both(instance, profile, combination)
+    assert chosen == expected == {'a', 'b'}
+
+
+ELECTIONS = ['poland_warszawa_2018_falenica', 'poland_katowice_2022_zarzecze', 'poland_warszawa_2018_las']
+
+
+def balanced_elections():
+    for election_name in ELECTIONS:
+        (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+        for use_cost in (True, False):
+            yield (instance, profile, use_cost)
+
+
+def selection_procedure(selection):
+    select = {'GE': select_project_ge, 'GSC': select_project_gsc, 'GS': select_project_gs}[selection]
+
+    # acceptance_of_under_supported_projects also passes tie_breaking and resoluteness
+    def tmp(projects, donors, tie_breaking=None, resoluteness=False):
+        tied = select(projects, donors)
+        return tied if tie_breaking is None else tie_breaking.order(None, None, tied)
+    return tmp
+
+
+# the procedures of every combination are passed explicitly, so every combination runs its own selection
+def pabutools_reference(instance, profile, combination):
+    (selection, transfer) = COMBINATIONS[combination]
+    return cstv(instance=instance, profile=profile,
+                select_project_to_fund_func=selection_procedure(selection),
+                eligible_projects_func=is_eligible_gsc if selection == 'GSC' else is_eligible_ge,
+                no_eligible_project_func=elimination_with_transfers if transfer == 'EWT' else minimal_transfer,
+                exhaustiveness_postprocess_func=(reverse_eliminations if transfer == 'EWT'
+                                                 else acceptance_of_under_supported_projects),
+                verbose=False)
+
+
+@pytest.mark.parametrize('combination', COMBINATIONS)
+@pytest.mark.parametrize('instance, profile, use_cost', list(balanced_elections()))
+def test_dense_cstv_matches_pabutools_on_elections(instance, profile, use_cost, combination):
+    (_, balanced) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost)
+    (_, dense) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, True)
+    expected = [p.name for p in pabutools_reference(instance, balanced, combination)]
+    assert [p.name for p in dense_cstv(instance, dense, combination)] == expected
+
+
+@pytest.mark.parametrize('instance, profile, use_cost', list(balanced_elections()))
+def test_shared_cstv_matches_separate_runs(instance, profile, use_cost):
+    (_, dense) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, True)
+    (chosen, (rounds, separate_rounds)) = shared_cstv(instance, dense, COMBINATIONS)
+    assert rounds <= separate_rounds
+    for combination in COMBINATIONS:
+        assert list(chosen[combination]) == list(dense_cstv(instance, dense, combination))
+
+
+@pytest.mark.parametrize('instance, profile, use_cost', list(balanced_elections()))
+def test_sparse_cstv_matches_dense(instance, profile, use_cost):
+    (_, dense) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, True)
+    (_, sparse) = utils.balance_profile(instance, profile, use_cost, use_cost, use_cost, sparse=True)
+    (chosen, _) = shared_cstv(instance, sparse, COMBINATIONS)
+    for combination in COMBINATIONS:
+        assert list(chosen[combination]) == list(dense_cstv(instance, dense, combination))
+        assert list(dense_cstv(instance, sparse, combination)) == list(chosen[combination])
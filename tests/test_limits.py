@@ -0,0 +1,70 @@
+import signal
+import threading
+import time
+
+import pytest
+
+import calculate_elections_all
+import limits
+import manifest
+import utils
+
+from limits import guard, LimitExceeded
+from utils import rules
+
+
+def __sleep(*args):
+    time.sleep(30)
+
+
+def test_guard_interrupts_sleeping_block(monkeypatch):
+    monkeypatch.setattr(limits, 'POLL_INTERVAL', 0.05)
+    start_time = time.monotonic()
+    with pytest.raises(LimitExceeded) as e:
+        with guard(timeout=0.1):
+            __sleep()
+    assert e.value.status == 'timeout'
+    assert time.monotonic() - start_time < 5
+    with pytest.raises(LimitExceeded) as e:
+        with guard(max_rss=1):
+            __sleep()
+    assert e.value.status == 'oom'
+
+
+def test_watchdog_is_cancelled_after_fast_block(monkeypatch):
+    monkeypatch.setattr(limits, 'POLL_INTERVAL', 0.05)
+    threads = threading.active_count()
+    handler = signal.getsignal(signal.SIGUSR1)
+    with guard(timeout=0.2, max_rss=1024 ** 4):
+        pass
+    assert threading.active_count() == threads
+    assert signal.getsignal(signal.SIGUSR1) == handler
+    # the timeout of the finished block must not fire later
+    time.sleep(0.5)
+
+
+@pytest.mark.parametrize('limit, status', [((0.2, None), 'timeout'), ((None, 1), 'oom')])
+def test_limited_job_is_recorded(tmp_path, monkeypatch, limit, status):
+    # workers are forked, so they run the sleeping rule and the shorter poll interval as well
+    monkeypatch.setattr(limits, 'POLL_INTERVAL', 0.05)
+    monkeypatch.setattr(calculate_elections_all, 'greedy_all', __sleep)
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path.joinpath('cache')))
+    election_name = 'poland_warszawa_2019_sadul'
+    rule_id = next(rule_id for rule_id, (name, _, _) in enumerate(rules) if name == 'GE score')
+    results_path = tmp_path.joinpath('results')
+    start_time = time.monotonic()
+    getattr(calculate_elections_all, '__run')([election_name], [rule_id], False, False, 1,
+                                              utils.INSTANCES_PATH, str(results_path),
+                                              limits={'greedy': limit, 'cstv': limit})
+    assert time.monotonic() - start_time < 20
+    conn = manifest.connect(str(results_path))
+    assert conn.execute('SELECT status FROM results WHERE instance = ? AND rule = ?',
+                        (election_name, 'GE score')).fetchall() == [(status,)]
+    assert not results_path.joinpath('GE score', election_name + '.json').exists()
+    # limited results are only calculated again when asked to
+    versions = {rule_id: manifest.rule_version(rule_id)}
+    election_hash = manifest.input_hash(conn, utils.INSTANCES_PATH, election_name)
+    assert manifest.stale_rules(conn, election_name, [rule_id], election_hash, versions, str(results_path)) == []
+    assert manifest.stale_rules(conn, election_name, [rule_id], election_hash, versions, str(results_path),
+                                manifest.LIMITED_STATUSES) == [rule_id]
+    conn.close()
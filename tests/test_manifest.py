@@ -0,0 +1,62 @@
+import json
+import runpy
+import shutil
+import sys
+
+import manifest
+import utils
+
+from utils import rules
+
+
+def __write(results_path, rule_name, election_name, res):
+    path = results_path.joinpath(rule_name)
+    path.mkdir(exist_ok=True)
+    path.joinpath(election_name + ".json").write_text(json.dumps(res))
+
+
+def test_stale_rules(tmp_path):
+    conn = manifest.connect(str(tmp_path))
+    versions = {0: 'v1', 1: 'v1'}
+    assert manifest.stale_rules(conn, 'a', [0, 1], 'h', versions, str(tmp_path)) == [0, 1]
+
+    manifest.record(conn, 'a', rules[0][0], 'h', 'v1', 1.0, manifest.output_hash(['1']))
+    __write(tmp_path, rules[1][0], 'a', ['1'])
+    assert manifest.stale_rules(conn, 'a', [0, 1], 'h', versions, str(tmp_path)) == []
+    assert conn.execute('SELECT status FROM results WHERE rule = ?', (rules[1][0],)).fetchone() == ('adopted',)
+
+    # other election file or rule version
+    assert manifest.stale_rules(conn, 'a', [0, 1], 'h2', versions, str(tmp_path)) == [0, 1]
+    assert manifest.stale_rules(conn, 'a', [0, 1], 'h', {0: 'v2', 1: 'v1'}, str(tmp_path)) == [0]
+
+    manifest.record(conn, 'a', rules[0][0], 'h', 'v1', 1.0, None, 'timeout')
+    assert manifest.stale_rules(conn, 'a', [0], 'h', versions, str(tmp_path)) == []
+    assert manifest.stale_rules(conn, 'a', [0], 'h', versions, str(tmp_path), manifest.LIMITED_STATUSES) == [0]
+
+
+def test_files_are_not_adopted_after_rule_change(tmp_path):
+    conn = manifest.connect(str(tmp_path))
+    manifest.record(conn, 'a', rules[0][0], 'h', 'v1', 1.0, manifest.output_hash(['1']))
+    __write(tmp_path, rules[0][0], 'b', ['1'])
+    assert manifest.stale_rules(conn, 'b', [0], 'h', {0: 'v2'}, str(tmp_path)) == [0]
+    assert manifest.stale_rules(conn, 'b', [0], 'h', {0: 'v1'}, str(tmp_path)) == []
+
+
+def test_cli_uses_engine_flags(tmp_path, monkeypatch, capsys):
+    # the result is recorded with the version of dense_cstv, so it is only up to date with --dense-cstv
+    election_name = 'poland_warszawa_2019_sadul'
+    instances_path = tmp_path.joinpath('instances')
+    instances_path.mkdir()
+    shutil.copy(utils.INSTANCES_PATH + "/" + election_name + ".pb", instances_path)
+    rule_id = next(rule_id for rule_id, (name, _, _) in enumerate(rules) if name == 'EWT')
+    monkeypatch.setattr(utils, 'DENSE_CSTV', True)
+    conn = manifest.connect(str(tmp_path))
+    election_hash = manifest.input_hash(conn, str(instances_path), election_name)
+    manifest.record(conn, election_name, 'EWT', election_hash, manifest.rule_version(rule_id), 1.0, manifest.output_hash([]))
+    conn.commit()
+    conn.close()
+    for (flags, expected) in ((['--dense-cstv'], ''), (['--shared-cstv'], ''), ([], election_name + ' EWT\n')):
+        monkeypatch.setattr(sys, 'argv', ['manifest.py', '--results', str(tmp_path), '--instances', str(instances_path),
+                                          *flags, 'stale', '--rule', 'EWT'])
+        runpy.run_path(manifest.__file__, run_name='__main__')
+        assert capsys.readouterr().out == expected
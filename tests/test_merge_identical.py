@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import utils
+
+from visualization import evaluate_instance, measure_names
+
+ELECTIONS = ['poland_warszawa_2018_falenica', 'poland_katowice_2022_zarzecze']
+
+
+@pytest.mark.parametrize('election_name', ELECTIONS)
+def test_merge_identical(election_name):
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/" + election_name + ".pb", False)
+    dense = utils.dense_profile(instance, profile)
+    merged = utils.merge_identical(dense)
+    assert len(merged) < len(dense)
+    assert merged.num_ballots() == len(dense)
+    assert len({row.tobytes() for row in merged.matrix}) == len(merged)
+    assert np.allclose(merged.support(), dense.support())
+
+    sparse = utils.merge_identical(utils.sparse_profile(instance, profile))
+    assert np.array_equal(sparse.weights, merged.weights)
+    assert np.allclose(sparse.support(), merged.support())
+
+
+@pytest.mark.parametrize('election_name', ELECTIONS)
+def test_merged_metrics_match_unmerged(election_name):
+    path = utils.INSTANCES_PATH + "/" + election_name + ".pb"
+    measure_ids = list(range(len(measure_names)))
+    (description, measures) = evaluate_instance(path, measure_ids)
+    (merged_description, merged_measures) = evaluate_instance(path, measure_ids, merge=True)
+    assert merged_description == description
+    assert set(merged_measures) == set(measures) == set(measure_names)
+    for measure_name, values in measures.items():
+        assert merged_measures[measure_name] == pytest.approx(values)
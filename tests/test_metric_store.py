@@ -0,0 +1,52 @@
+import csv
+
+import metric_store
+
+
+def test_round_trip(tmp_path):
+    conn = metric_store.connect(str(tmp_path.joinpath('metrics.sqlite')))
+    dependencies = {('GE', 'avg'): 'r1', ('EWT', 'avg'): 'r2', ('GE', 'ejr'): 'r1'}
+    assert metric_store.election(conn, 'a', 'h') is None
+    assert metric_store.stale_metrics(conn, 'a', 'h', ['avg', 'ejr'], dependencies, 'v1') == {'avg', 'ejr'}
+
+    metric_store.record_election(conn, 'a', 'h', 'approval', 10, 3)
+    metric_store.record(conn, 'a', 'h', 'avg', {'GE': 0.5, 'EWT': None}, dependencies, 'v1')
+    metric_store.record(conn, 'a', 'h', 'ejr', {'GE': 1.0}, dependencies, 'v1')
+    conn.commit()
+    conn.close()
+
+    conn = metric_store.connect(str(tmp_path.joinpath('metrics.sqlite')))
+    assert metric_store.election(conn, 'a', 'h') == ('approval', 10, 3)
+    assert metric_store.election(conn, 'a', 'h2') is None
+    description = {'instance': 'a', 'ballot_type': 'approval', 'voters': 10, 'projects': 3}
+    assert metric_store.load(conn, 'avg') == [
+        {**description, 'rule': 'EWT', 'metric': 'avg', 'value': None},
+        {**description, 'rule': 'GE', 'metric': 'avg', 'value': 0.5},
+    ]
+    assert len(metric_store.load(conn)) == 3
+    assert metric_store.stale_metrics(conn, 'a', 'h', ['avg', 'ejr'], dependencies, 'v1') == set()
+
+    # other election file, results, version or a value of removed result
+    assert metric_store.stale_metrics(conn, 'a', 'h2', ['avg', 'ejr'], dependencies, 'v1') == {'avg', 'ejr'}
+    assert metric_store.stale_metrics(conn, 'a', 'h', ['avg', 'ejr'], {**dependencies, ('GE', 'ejr'): 'r3'}, 'v1') == {'ejr'}
+    assert metric_store.stale_metrics(conn, 'a', 'h', ['avg', 'ejr'], dependencies, 'v2') == {'avg', 'ejr'}
+    del dependencies[('EWT', 'avg')]
+    assert metric_store.stale_metrics(conn, 'a', 'h', ['avg', 'ejr'], dependencies, 'v1') == {'avg'}
+    metric_store.record(conn, 'a', 'h', 'avg', {'GE': 0.25}, dependencies, 'v1')
+    assert [(row['rule'], row['value']) for row in metric_store.load(conn, 'avg')] == [('GE', 0.25)]
+
+    # values of changed election file are not loaded until it is described again
+    metric_store.record_election(conn, 'a', 'h2', 'approval', 11, 3)
+    assert metric_store.load(conn) == []
+
+    path = tmp_path.joinpath('metrics.csv')
+    metric_store.record_election(conn, 'a', 'h', 'approval', 10, 3)
+    assert metric_store.export(conn, str(path)) == 2
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['rule'], row['metric'], row['value']) for row in rows] == [('GE', 'avg', '0.25'), ('GE', 'ejr', '1.0')]
+
+    assert metric_store.prune(conn, ['b']) == 1
+    assert metric_store.load(conn) == []
+    assert conn.execute('SELECT COUNT(*) FROM metrics').fetchone() == (0,)
+    conn.close()
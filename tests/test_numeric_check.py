@@ -0,0 +1,26 @@
+import utils
+
+from numeric_check import check_election, greedy_margins
+
+
+def test_project_costing_remaining_budget_is_near_tie():
+    # 1695 costs 85000 and 1036 costs 38500 of 123500, so whichever comes second costs exactly the budget left
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/poland_warszawa_2019_sadul.pb", False)
+    (_, balanced) = utils.balance_profile(instance, profile, True, True, True, True)
+    assert greedy_margins(instance, balanced) == {'GS': 0.0, 'GSC': 0.0, 'GE': 0.0}
+
+    near_ties = check_election(instance, profile, ['GS', 'GSC', 'GE'])
+    assert sorted(name for (name, _, _, _) in near_ties) == ['GE', 'GS', 'GSC']
+    for (_, _, fast, exact) in near_ties:
+        assert fast == exact == {'1036', '1695'}
+
+
+def test_exact_minimal_transfer_finishes():
+    # an infinite epsilon reruns every rule exactly
+    (instance, profile) = utils.read_path(utils.INSTANCES_PATH + "/poland_katowice_2022_zarzecze.pb", False)
+    rule_names = ['MT', 'MTC', 'MTS', 'MT score', 'MTC score', 'MTS score']
+    near_ties = check_election(instance, profile, rule_names, float('inf'))
+    assert sorted(name for (name, _, _, _) in near_ties) == sorted(rule_names)
+    for (_, _, fast, exact) in near_ties:
+        assert isinstance(exact, set)
+        assert fast == exact
@@ -0,0 +1,40 @@
+import shutil
+
+import numpy as np
+
+import utils
+
+
+def test_read_dense_maps_cached_arrays(tmp_path, monkeypatch):
+    election_name = 'poland_warszawa_2018_falenica'
+    path = tmp_path.joinpath(election_name + '.pb')
+    shutil.copy(utils.INSTANCES_PATH + "/" + election_name + ".pb", path)
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path.joinpath('cache')))
+    stream_dense = utils.stream_dense
+    streamed = []
+    def counting_stream_dense(*args, **kwargs):
+        streamed.append(1)
+        return stream_dense(*args, **kwargs)
+    monkeypatch.setattr(utils, 'stream_dense', counting_stream_dense)
+
+    (instance, profile) = utils.read_path(str(path), False)
+    dense = utils.dense_profile(instance, profile)
+    for expected_streams in (1, 1):
+        (mapped_instance, mapped) = utils.read_dense(str(path), True)
+        assert len(streamed) == expected_streams
+        assert isinstance(mapped.matrix, np.memmap) and not mapped.matrix.flags.writeable
+        assert mapped_instance.budget_limit == instance.budget_limit
+        assert [p.name for p in mapped.projects] == [p.name for p in dense.projects]
+        assert np.array_equal(mapped.matrix, dense.matrix) and np.array_equal(mapped.costs, dense.costs)
+        assert mapped.ballot_type is dense.ballot_type
+
+    # other contents of the file
+    text = path.read_text(encoding=utils.ENCODING)
+    budget = next(line for line in text.splitlines() if line.startswith('budget;'))
+    path.write_text(text.replace(budget, 'budget;1000'), encoding=utils.ENCODING)
+    (mapped_instance, _) = utils.read_dense(str(path), True)
+    assert len(streamed) == 2 and mapped_instance.budget_limit == 1000
+
+    # cache is not used when asked not to
+    (_, built) = utils.read_dense(str(path), False)
+    assert len(streamed) == 3 and not isinstance(built.matrix, np.memmap)
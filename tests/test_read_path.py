@@ -0,0 +1,44 @@
+import shutil
+
+import pabutools
+
+import utils
+
+
+def test_read_path_cache_is_invalidated(tmp_path, monkeypatch):
+    election_name = 'poland_warszawa_2019_sadul'
+    path = tmp_path.joinpath(election_name + '.pb')
+    shutil.copy(utils.INSTANCES_PATH + "/" + election_name + ".pb", path)
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path.joinpath('cache')))
+    parse = pabutools.election.pabulib.parse_pabulib_from_string
+    parsed = []
+    def counting_parse(content):
+        parsed.append(1)
+        return parse(content)
+    monkeypatch.setattr(pabutools.election.pabulib, 'parse_pabulib_from_string', counting_parse)
+
+    (instance, profile) = utils.read_path(str(path), True)
+    assert len(parsed) == 1 and tmp_path.joinpath('cache', election_name + '.pickle').exists()
+    (cached_instance, cached_profile) = utils.read_path(str(path), True)
+    assert len(parsed) == 1
+    assert cached_instance.budget_limit == instance.budget_limit
+    assert sorted(p.name for p in cached_instance) == sorted(p.name for p in instance)
+    assert [sorted(p.name for p in ballot) for ballot in cached_profile] == [sorted(p.name for p in ballot) for ballot in profile]
+
+    # other contents of the file
+    path.write_text(path.read_text(encoding=utils.ENCODING).replace('budget;123500', 'budget;100000'), encoding=utils.ENCODING)
+    (instance, _) = utils.read_path(str(path), True)
+    assert len(parsed) == 2 and instance.budget_limit == 100000
+    utils.read_path(str(path), True)
+    assert len(parsed) == 2
+
+    # other pabutools version
+    monkeypatch.setattr(utils, 'PABUTOOLS_VERSION', 'other')
+    utils.read_path(str(path), True)
+    assert len(parsed) == 3
+    utils.read_path(str(path), True)
+    assert len(parsed) == 3
+
+    # cache is not used when asked not to
+    utils.read_path(str(path), False)
+    assert len(parsed) == 4
@@ -0,0 +1,42 @@
+import utils
+
+from scheduler import instance_size, schedule
+from utils import rules
+
+ELECTIONS = ['poland_warszawa_2019_sadul', 'poland_warszawa_2018_falenica', 'poland_katowice_2022_zarzecze']
+
+
+def __rule_id(name):
+    return next(rule_id for rule_id, (rule_name, _, _) in enumerate(rules) if rule_name == name)
+
+
+def test_instance_size(tmp_path):
+    for election_name in ELECTIONS:
+        path = utils.INSTANCES_PATH + "/" + election_name + ".pb"
+        (instance, profile) = utils.read_path(path, False)
+        assert instance_size(path) == (len(profile), len(instance))
+        # without num_votes and num_projects sections are counted
+        lines = open(path, encoding=utils.ENCODING).read().splitlines(True)
+        stripped = tmp_path.joinpath(election_name + ".pb")
+        stripped.write_text(''.join(line for line in lines if not line.startswith(('num_votes', 'num_projects'))))
+        assert instance_size(str(stripped)) == (len(profile), len(instance))
+
+
+def test_schedule_starts_longest_jobs_first():
+    (greedy, cstv) = (__rule_id('GE'), __rule_id('EWT'))
+    sizes = [instance_size(utils.INSTANCES_PATH + "/" + election_name + ".pb") for election_name in ELECTIONS]
+    by_size = [election_name for _, election_name in sorted(zip(sizes, ELECTIONS), key=lambda e: e[0][0] * e[0][1] ** 2, reverse=True)]
+    jobs = [(election_name, [rule_id]) for election_name in ELECTIONS for rule_id in (greedy, cstv)]
+
+    scheduled = schedule(jobs, utils.INSTANCES_PATH, {})
+    assert [(election_name, rule_ids) for election_name, rule_ids, _ in scheduled[:len(ELECTIONS)]] == \
+        [(election_name, [cstv]) for election_name in by_size]
+    predicted = [sum(prediction.values()) for _, _, prediction in scheduled]
+    assert predicted == sorted(predicted, reverse=True)
+
+    # recorded runtime of the same election and rule is preferred over estimate
+    runtimes = {election_name: {'GE': 1.0, 'EWT': 2.0} for election_name in ELECTIONS}
+    runtimes[ELECTIONS[0]]['GE'] = 3.0
+    scheduled = schedule(jobs, utils.INSTANCES_PATH, runtimes)
+    assert scheduled[0] == (ELECTIONS[0], [greedy], {'GE': 3.0})
+    assert [prediction for _, _, prediction in scheduled[1:]] == [{'EWT': 2.0}] * len(ELECTIONS) + [{'GE': 1.0}] * (len(ELECTIONS) - 1)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+import utils
+
+ELECTIONS = ['poland_warszawa_2018_falenica', 'poland_katowice_2022_zarzecze']
+
+
+@pytest.mark.parametrize('election_name', ELECTIONS)
+def test_stream_dense_matches_parser(election_name):
+    path = utils.INSTANCES_PATH + "/" + election_name + ".pb"
+    (instance, profile) = utils.read_path(path, False)
+    (streamed_instance, streamed) = utils.stream_dense(path)
+    dense = utils.dense_profile(instance, profile)
+    assert streamed_instance.budget_limit == instance.budget_limit
+    assert [p.name for p in streamed.projects] == [p.name for p in dense.projects]
+    assert np.array_equal(streamed.costs, dense.costs)
+    assert np.array_equal(streamed.matrix, dense.matrix)
+    assert streamed.ballot_type is dense.ballot_type
+
+    (_, streamed) = utils.stream_dense(path, sparse=True)
+    sparse = utils.sparse_profile(instance, profile)
+    for name in ('indptr', 'indices', 'data'):
+        assert np.array_equal(getattr(streamed, name), getattr(sparse, name))
@@ -0,0 +1,36 @@
+import json
+
+import calculate_elections_all
+import telemetry
+import utils
+
+from utils import rules
+
+RULE_NAMES = ['GE score', 'GS score', 'EWT score']
+
+
+def test_records_of_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path.joinpath('cache')))
+    election_name = 'poland_warszawa_2019_sadul'
+    rule_ids = [rule_id for rule_id, (name, _, _) in enumerate(rules) if name in RULE_NAMES]
+    results_path = tmp_path.joinpath('results')
+    getattr(calculate_elections_all, '__run')([election_name], rule_ids, False, True, 1,
+                                              utils.INSTANCES_PATH, str(results_path))
+    path = telemetry.telemetry_path(str(results_path))
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(record['rule'] for record in records) == sorted(RULE_NAMES)
+    for record in records:
+        assert tuple(record) == telemetry.FIELDS
+        assert (record['instance'], record['status'], record['voters'], record['projects']) == (election_name, 'ok', 110, 2)
+        assert record['rule_time'] >= 0 and record['peak_rss'] > 0
+    # the election is read once per job
+    assert sum(record['parse_time'] > 0 for record in records) == 1
+
+    # a line cut by a killed run is skipped and only the latest record of every rule is kept
+    rerun = dict(records[0], time=records[0]['time'] + 1, status='timeout')
+    telemetry.append(path, [rerun])
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(records[1])[:-5])
+    loaded = {record['rule']: record for record in telemetry.load(path)}
+    assert loaded == {record['rule']: record for record in [rerun] + records[1:]}
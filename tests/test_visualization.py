@@ -0,0 +1,63 @@
+import json
+import shutil
+
+import pytest
+
+import metric_store
+import utils
+
+from visualization import evaluate, evaluate_instance, measure_names, results_names
+
+ELECTIONS = ['poland_warszawa_2019_sadul', 'poland_warszawa_2018_falenica']
+
+
+@pytest.mark.parametrize('election_name', ELECTIONS)
+def test_profile_sources_give_same_metrics(tmp_path, monkeypatch, election_name):
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path))
+    path = utils.INSTANCES_PATH + "/" + election_name + ".pb"
+    measure_ids = list(range(len(measure_names)))
+    (description, measures) = evaluate_instance(path, measure_ids)
+    assert set(measures) == set(measure_names)
+    for options in ({'shared': True}, {'sparse': True}):
+        (other_description, other_measures) = evaluate_instance(path, measure_ids, **options)
+        assert other_description == description
+        assert set(other_measures) == set(measures)
+        for measure_name, values in measures.items():
+            assert other_measures[measure_name] == pytest.approx(values)
+
+
+def test_evaluate_only_recalculates_stale_elections(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(utils, 'CACHE_PATH', str(tmp_path.joinpath('cache')))
+    (instances_path, results_path) = (tmp_path.joinpath('instances'), tmp_path.joinpath('results'))
+    instances_path.mkdir()
+    for election_name in ELECTIONS:
+        shutil.copy(utils.INSTANCES_PATH + "/" + election_name + ".pb", instances_path)
+        for name in results_names:
+            results_path.joinpath(name).mkdir(parents=True, exist_ok=True)
+            shutil.copy(utils.RESULTS_PATH + "/" + name + "/" + election_name + ".json", results_path.joinpath(name))
+    store_path = str(tmp_path.joinpath('metrics.sqlite'))
+    measure_ids = list(range(len(measure_names)))
+    def run():
+        evaluate(measure_ids, 1, str(instances_path), str(results_path), store_path)
+        conn = metric_store.connect(store_path)
+        rows = metric_store.load(conn)
+        conn.close()
+        return (capsys.readouterr().out.splitlines()[0], rows)
+
+    (progress, rows) = run()
+    assert progress == '2 of 2 elections to evaluate, 0 removed from metric store'
+    assert len(rows) == len(ELECTIONS) * len(measure_names) * len(results_names)
+    assert run() == ('0 of 2 elections to evaluate, 0 removed from metric store', rows)
+
+    # changed result of one rule only makes its election stale
+    results_path.joinpath('GE', ELECTIONS[0] + ".json").write_text(json.dumps(['1695']), encoding=utils.ENCODING)
+    (progress, changed) = run()
+    assert progress == '1 of 2 elections to evaluate, 0 removed from metric store'
+    value = {(row['instance'], row['rule'], row['metric']): row['value'] for row in changed}
+    assert value[(ELECTIONS[0], 'GE', 'utility cost score')] == value[(ELECTIONS[0], 'GS', 'utility cost score')]
+    assert [row for row in changed if row['instance'] == ELECTIONS[1]] == [row for row in rows if row['instance'] == ELECTIONS[1]]
+
+    instances_path.joinpath(ELECTIONS[1] + ".pb").unlink()
+    (progress, pruned) = run()
+    assert progress == '0 of 1 elections to evaluate, 1 removed from metric store'
+    assert {row['instance'] for row in pruned} == {ELECTIONS[0]}